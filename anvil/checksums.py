@@ -0,0 +1,206 @@
+"""Checksums of rendered frames, computed on the farm
+
+With AVALON_RENDER_CHECKSUMS set, each render task hashes the frames
+it rendered once finished, and writes them to a manifest next to the
+metadata of its render layer.
+
+    <renders>/<scene>/<layer>.json
+    <renders>/<scene>/<layer>.checksums.1001-1010.json
+
+One manifest per task, such that tasks never write to the same file.
+Frames are then verified against their checksum as they are
+integrated, see IntegrateAvalonAsset.
+
+This module runs on the farm as a post-task script of Deadline,
+and so depends on nothing but the standard library.
+
+"""
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+# Identical to anvil.store, such that checksums double as content hashes
+ALGORITHM = "sha256"
+CHUNK_SIZE = 1024 * 1024
+
+# Name of job extra info referencing the metadata of a layer,
+# without its suffix, e.g. <renders>/<scene>/<layer>
+KEY = "AvalonChecksums"
+
+
+class ChecksumError(Exception):
+    """File differs from when it was rendered"""
+
+
+def enabled():
+    """Return whether render tasks should write checksums"""
+    return bool(os.getenv("AVALON_RENDER_CHECKSUMS"))
+
+
+def script():
+    """Return absolute path to this module, as run by Deadline"""
+    path = os.path.abspath(__file__)
+    return os.path.splitext(path)[0] + ".py"
+
+
+def hash_file(path):
+    """Return content hash of `path`, e.g. "sha256:ab12.."
+
+    Identical to :func:`anvil.store.hash_file`
+
+    """
+
+    digest = hashlib.new(ALGORITHM)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return "%s:%s" % (ALGORITHM, digest.hexdigest())
+
+
+def frame_of(name):
+    """Return frame number of file `name`, or None
+
+    Example:
+        >>> frame_of("beauty_v002.1001.exr")
+        1001
+        >>> frame_of("beauty.exr") is None
+        True
+
+    """
+
+    match = re.search(r"(\d+)$", os.path.splitext(name)[0])
+    return int(match.group(1)) if match else None
+
+
+def write(base, start, end, log=None):
+    """Hash frames `start` to `end` of layer at `base`, and write manifest
+
+    Frames are looked for in the directory of the layer, including
+    the "rs_" prefix of Maya 2017, see CollectAvaImageSequences.
+
+    Arguments:
+        base (str): Absolute path to metadata of layer, without suffix
+        start (int): First frame of task
+        end (int): Last frame of task, inclusive
+
+    Returns:
+        path (str): Absolute path to manifest
+
+    """
+
+    dirname, layer = os.path.split(base)
+
+    hashes = dict()
+    for name in (layer, "rs_" + layer):
+        directory = os.path.join(dirname, name)
+
+        if not os.path.isdir(directory):
+            continue
+
+        for fname in os.listdir(directory):
+            frame = frame_of(fname)
+            if frame is None or not start <= frame <= end:
+                continue
+
+            hashes[fname] = hash_file(os.path.join(directory, fname))
+
+    path = "%s.checksums.%d-%d.json" % (base, start, end)
+
+    # Written elsewhere first, such that a publish
+    # never reads a partially written manifest.
+    fd, tmp = tempfile.mkstemp(dir=dirname)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"hashes": hashes}, f, sort_keys=True)
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Windows refuses to replace existing files, such as
+        # those of a requeued task.
+        os.remove(path)
+        os.rename(tmp, path)
+
+    if log is not None:
+        log("Wrote checksums of %d frame(s) to %s" % (len(hashes), path))
+
+    return path
+
+
+def load(base):
+    """Return checksums of every task of layer at `base`, by file name"""
+
+    dirname, layer = os.path.split(base)
+    prefix = layer + ".checksums."
+
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        return dict()
+
+    hashes = dict()
+    for name in sorted(names):
+        if not (name.startswith(prefix) and name.endswith(".json")):
+            continue
+
+        try:
+            with open(os.path.join(dirname, name)) as f:
+                hashes.update(json.load(f)["hashes"])
+        except (IOError, OSError, ValueError, KeyError):
+            continue
+
+    return hashes
+
+
+def verified(function, checksums):
+    """Return `function` raising on files differing from `checksums`
+
+    Frames absent from `checksums` fail too, unless `checksums` is
+    empty altogether, as for renders submitted without checksums.
+
+    Arguments:
+        function (callable): Transfer function, returning "hash"
+            of each file transferred, such as BlobStore.put or
+            :func:`anvil.transfer.copy` with `hashed`
+        checksums (dict): Checksum per file name, see :func:`load`
+
+    """
+
+    def verify(src, dst):
+        name = os.path.basename(src)
+        expected = checksums.get(name)
+
+        if expected is None and checksums and frame_of(name) is not None:
+            raise ChecksumError("%s was rendered without a checksum" % name)
+
+        result = function(src, dst)
+
+        if expected is not None and result.get("hash") != expected:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+
+            raise ChecksumError("%s differs from when it was rendered"
+                                % name)
+
+        return result
+
+    return verify
+
+
+def __main__(*args):
+    """Entry point of Deadline, as PostTaskScript of a render job"""
+    plugin = args[0]
+    base = plugin.GetJob().GetJobExtraInfoKeyValue(KEY)
+
+    if not base:
+        return plugin.LogWarning("No %s with job, skipping checksums" % KEY)
+
+    write(base,
+          int(plugin.GetStartFrame()),
+          int(plugin.GetEndFrame()),
+          log=plugin.LogInfo)
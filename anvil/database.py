@@ -0,0 +1,395 @@
+"""Database helpers used during integration
+
+Documents are gathered per publishing context and written together,
+as opposed to one round-trip per document.
+
+Version numbers are allocated from a counter per subset, incremented
+atomically such that concurrent publishes never receive the same
+number. Counters of existing projects are seeded with
+
+    $ python -m anvil.database seed-counters --project hulk
+
+"""
+
+import os
+import errno
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class WriteBuffer(object):
+    """Collect documents for a single ordered write
+
+    Identifiers are assigned on insertion, such that documents may
+    reference each other before being written to the database.
+
+    Example:
+        >>> buffer = WriteBuffer()
+        >>> version_id = buffer.insert({"type": "version"})
+        >>> _ = buffer.insert({"type": "representation",
+        ...                    "parent": version_id})
+        >>> len(buffer)
+        2
+
+    """
+
+    def __init__(self):
+        self.documents = list()
+
+        # Documents written immediately, and files written to disk,
+        # on behalf of this buffer. Removed on rollback.
+        self.created = list()
+        self.files = list()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def insert(self, document):
+        """Buffer `document` and return its (possibly new) _id"""
+        from avalon import io
+
+        document.setdefault("_id", io.ObjectId())
+        self.documents.append(document)
+        return document["_id"]
+
+    def created_immediately(self, _id):
+        """Track document `_id`, written outside of this buffer"""
+        self.created.append(_id)
+
+    def wrote(self, path):
+        """Track file `path`, written on behalf of buffered documents"""
+        self.files.append(path)
+
+    def flush(self):
+        """Write all buffered documents in a single ordered batch
+
+        The database is restored to its original state on failure.
+
+        Returns:
+            count (int): Number of documents written
+
+        """
+
+        from avalon import io
+
+        if not self.documents:
+            return 0
+
+        documents, self.documents = self.documents, list()
+
+        try:
+            io.insert_many(documents, ordered=True)
+        except Exception:
+            # Ordered writes stop at the first error, but any number
+            # of documents prior to it may already have been written.
+            self.documents = documents
+            self.rollback()
+            raise
+
+        self.created = list()
+        self.files = list()
+
+        return len(documents)
+
+    def rollback(self):
+        """Remove every trace of buffered and tracked documents"""
+        from avalon import io
+
+        ids = [document["_id"] for document in self.documents]
+        ids += self.created
+
+        if ids:
+            io.delete_many({"_id": {"$in": ids}})
+
+        for path in self.files:
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+
+                # Best effort, leftovers are unreferenced by the database
+                log.warning("Could not remove %s" % path)
+
+        self.documents = list()
+        self.created = list()
+        self.files = list()
+
+
+def write_buffer(context):
+    """Return the write buffer of `context`, creating it if needed"""
+    if "writeBuffer" not in context.data:
+        context.data["writeBuffer"] = WriteBuffer()
+
+    return context.data["writeBuffer"]
+
+
+def _freeze(value):
+    """Return hashable equivalent of query `value`"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(value[key])) for key in value))
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+
+    return value
+
+
+class DocumentCache(object):
+    """Remember the results of :func:`avalon.io.find_one`
+
+    Results, including documents not found, are remembered until
+    invalidated. Each call returns a copy, such that callers are
+    free to modify what they receive.
+
+    Arguments:
+        lookup (callable, optional): Called with (filter, projection)
+            on a miss, defaults to :func:`avalon.io.find_one`
+
+    Example:
+        >>> def lookup(filter, projection):
+        ...     return {"type": filter["type"], "name": "hulk"}
+        ...
+        >>> cache = DocumentCache(lookup)
+        >>> project = cache.find_one({"type": "project"})
+        >>> project = cache.find_one({"type": "project"})
+        >>> cache.hits, cache.misses
+        (1, 1)
+
+    """
+
+    def __init__(self, lookup=None):
+        self._documents = dict()
+        self._lookup = lookup
+        self.hits = 0
+        self.misses = 0
+
+    def find_one(self, filter, projection=None):
+        import copy
+
+        key = _freeze((filter, projection))
+
+        try:
+            document = self._documents[key][1]
+            self.hits += 1
+
+        except KeyError:
+            lookup = self._lookup
+            if lookup is None:
+                from avalon import io
+                lookup = io.find_one
+
+            document = lookup(filter, projection)
+            self._documents[key] = (filter, document)
+            self.misses += 1
+
+        return copy.deepcopy(document)
+
+    def parenthood(self, document):
+        """Cached equivalent of :func:`avalon.io.parenthood`"""
+        parents = list()
+
+        while document is not None and document.get("parent"):
+            document = self.find_one({"_id": document["parent"]})
+            parents.append(document)
+
+        return parents
+
+    def invalidate(self, type=None):
+        """Forget remembered results
+
+        Arguments:
+            type (str, optional): Only forget results of queries
+                for documents of this type, e.g. "subset"
+
+        """
+
+        if type is None:
+            return self._documents.clear()
+
+        for key, (filter, _) in list(self._documents.items()):
+            if filter.get("type") == type:
+                del self._documents[key]
+
+    def __str__(self):
+        return "%d hit(s), %d miss(es)" % (self.hits, self.misses)
+
+
+def document_cache(context=None):
+    """Return the document cache of publishing `context`
+
+    Arguments:
+        context (pyblish.api.Context, optional): Publishing context
+            to which the cache belongs. Without one, such as when
+            loading, a new cache is returned, to be kept no longer
+            than the call using it as documents may change meanwhile.
+
+    """
+
+    if context is None:
+        return DocumentCache()
+
+    if "documentCache" not in context.data:
+        context.data["documentCache"] = DocumentCache()
+
+    return context.data["documentCache"]
+
+
+COUNTER_SCHEMA = "anvil:counter-1.0"
+
+
+def _collection():
+    """Return the collection of the active project
+
+    :mod:`avalon.io` doesn't expose find-and-modify, aggregation nor
+    index management, so these go through its database handle. This
+    is the only access to the private handle, everything else goes
+    through the public :mod:`avalon.io` API.
+
+    """
+
+    from avalon import io
+
+    database = getattr(io, "_database", None)
+    assert database is not None, "avalon.io not installed, see io.install()"
+
+    return database[io.active_project()]
+
+
+def _counter_filter(subset_id):
+    return {"type": "counter", "name": "version", "parent": subset_id}
+
+
+def _latest_version(subset_id):
+    from avalon import io
+
+    latest = io.find_one({"type": "version",
+                          "parent": subset_id},
+                         {"name": True},
+                         sort=[("name", -1)])
+
+    return latest["name"] if latest is not None else 0
+
+
+def ensure_counter_index():
+    """Guarantee a single counter per subset"""
+    _collection().create_index(
+        [("type", 1), ("name", 1), ("parent", 1)],
+        name="counter",
+        unique=True,
+        partialFilterExpression={"type": "counter"}
+    )
+
+
+def seed_counter(subset_id, value=None):
+    """Raise the version counter of `subset_id` to at least `value`
+
+    Arguments:
+        subset_id (ObjectId): Subset to which the counter belongs
+        value (int, optional): Defaults to the latest existing version
+
+    """
+
+    from pymongo.errors import DuplicateKeyError
+
+    if value is None:
+        value = _latest_version(subset_id)
+
+    try:
+        _collection().update_one(
+            _counter_filter(subset_id),
+            {"$max": {"value": value},
+             "$setOnInsert": {"schema": COUNTER_SCHEMA}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Seeded simultaneously elsewhere, $max is
+        # idempotent so try again without conflict.
+        seed_counter(subset_id, value)
+
+
+def next_version(subset_id):
+    """Atomically allocate the next version number of `subset_id`
+
+    Numbers are never handed out twice, but a publish
+    that fails after allocation leaves a gap.
+
+    """
+
+    from pymongo import ReturnDocument
+
+    counter = _collection().find_one_and_update(
+        _counter_filter(subset_id),
+        {"$inc": {"value": 1}},
+        projection={"value": True},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if counter is None:
+        # Subset predates counters, or is brand new
+        ensure_counter_index()
+        seed_counter(subset_id)
+        return next_version(subset_id)
+
+    return counter["value"]
+
+
+def seed_counters():
+    """Seed a version counter for every subset of the active project
+
+    Existing counters are only ever raised, never lowered,
+    such that this is safe to run during live publishing.
+
+    Returns:
+        count (int): Number of subsets seeded
+
+    """
+
+    from pymongo import UpdateOne
+
+    ensure_counter_index()
+
+    collection = _collection()
+    latest = collection.aggregate([
+        {"$match": {"type": "version"}},
+        {"$group": {"_id": "$parent", "value": {"$max": "$name"}}},
+    ])
+
+    requests = [
+        UpdateOne(_counter_filter(document["_id"]),
+                  {"$max": {"value": document["value"]},
+                   "$setOnInsert": {"schema": COUNTER_SCHEMA}},
+                  upsert=True)
+        for document in latest
+    ]
+
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+
+    return len(requests)
+
+
+def _main():
+    import argparse
+
+    from avalon import io
+
+    parser = argparse.ArgumentParser(prog="python -m anvil.database")
+    parser.add_argument("command", choices=["seed-counters"])
+    parser.add_argument("--project", default=os.getenv("AVALON_PROJECT"),
+                        help="Defaults to $AVALON_PROJECT")
+
+    args = parser.parse_args()
+    assert args.project, "No project specified"
+
+    io.install()
+    io.activate_project(args.project)
+
+    count = seed_counters()
+    print("Seeded version counters of %d subset(s) in '%s'"
+          % (count, args.project))
+
+
+if __name__ == "__main__":
+    _main()
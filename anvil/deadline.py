@@ -0,0 +1,580 @@
+"""Deadline Web Service client
+
+Jobs of every render layer of a scene are submitted together, posted
+concurrently over a pool of persistent connections. See
+:class:`anvil.standins.DeadlineServer` for a local stand-in of the
+Web Service, supplied via AVALON_DEADLINE.
+
+"""
+
+import os
+import time
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger(__name__)
+
+# Number of simultaneous requests, unless otherwise specified
+# via the AVALON_DEADLINE_WORKERS environment variable.
+DEFAULT_WORKERS = 8
+
+# Seconds each task should take, unless otherwise specified
+# via the AVALON_DEADLINE_TASK_DURATION environment variable.
+DEFAULT_TASK_DURATION = 600
+
+# Number of past submissions of a layer considered, most recent first
+HISTORY = 5
+
+# Seconds per pixel of a frame, per million triangles beyond the first.
+# Calibrated to roughly a minute for an HD frame of a million triangles.
+SECONDS_PER_PIXEL = 1.5e-5
+
+# Seconds job status is reused, before being queried anew
+STATUS_TTL = 5.0
+
+# Seconds pools and groups are reused, unless otherwise specified
+# via the AVALON_DEADLINE_CACHE_TTL environment variable.
+DEFAULT_FARM_TTL = 300.0
+
+# Number of jobs queried per request
+STATUS_BATCH = 100
+
+# From Deadline documentation
+# https://docs.thinkboxsoftware.com/products/deadline/8.0/
+# 1_User%20Manual/manual/rest-jobs.html#job-property-values
+JOB_STATES = {
+    0: "Unknown",
+    1: "Active",
+    2: "Suspended",
+    3: "Completed",
+    4: "Failed",
+    6: "Pending",
+}
+
+# States from which a job won't move on by itself
+FINISHED = ("Completed", "Failed", "Suspended")
+
+# https://docs.thinkboxsoftware.com/products/deadline/8.0/
+# 1_User%20Manual/manual/rest-tasks.html#task-property-values
+TASK_COMPLETED = 5
+
+
+class SubmissionError(Exception):
+    """One or more jobs failed to submit"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(SubmissionError, self).__init__(
+            "%d job(s) failed to submit:\n%s" % (
+                len(errors),
+                "\n".join("  %s: %s" % error for error in errors)
+            )
+        )
+
+
+def batch_enabled():
+    """Return whether render layers should be submitted together"""
+    return bool(os.getenv("AVALON_DEADLINE_BATCH"))
+
+
+def task_duration():
+    """Return configured seconds each task should take"""
+    try:
+        seconds = float(os.getenv("AVALON_DEADLINE_TASK_DURATION",
+                                  DEFAULT_TASK_DURATION))
+    except ValueError:
+        seconds = DEFAULT_TASK_DURATION
+
+    return max(1.0, seconds)
+
+
+def max_workers():
+    """Return configured number of simultaneous requests"""
+    try:
+        count = int(os.getenv("AVALON_DEADLINE_WORKERS", DEFAULT_WORKERS))
+    except ValueError:
+        count = DEFAULT_WORKERS
+
+    return max(1, count)
+
+
+def session(workers=None):
+    """Return session of up to `workers` keep-alive connections"""
+    from avalon.vendor import requests
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=workers or max_workers()
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def submit(url, payloads, workers=None, log=log):
+    """Post each of `payloads` to the Web Service at `url`
+
+    Every job is submitted, failures don't prevent others from
+    being submitted. Submissions aren't retried, as a job may have
+    been created despite a failed response.
+
+    Arguments:
+        url (str): Address of Web Service, e.g. AVALON_DEADLINE
+        payloads (list): JobInfo, PluginInfo and AuxFiles per job
+        workers (int, optional): Maximum number of simultaneous
+            requests, defaults to :func:`max_workers`
+        log (logging.Logger, optional): Destination of progress messages
+
+    Returns:
+        results (list): (job, error) per payload, in the same order,
+            where `job` is the submitted job, or None on failure
+
+    """
+
+    workers = min(workers or max_workers(), max(1, len(payloads)))
+
+    def post(payload):
+        try:
+            response = connections.post(url + "/api/jobs", json=payload)
+        except Exception as e:
+            return None, "%s: %s" % (type(e).__name__, e)
+
+        if not response.ok:
+            return None, response.text
+
+        job = response.json()
+        log.info("Submitted %s: %s" % (payload["JobInfo"]["Name"],
+                                       job.get("_id")))
+
+        return job, None
+
+    connections = session(workers)
+    pool = ThreadPool(workers)
+
+    try:
+        return pool.map(post, payloads)
+    finally:
+        pool.close()
+        pool.join()
+        connections.close()
+
+
+def iter_frames(frames):
+    """Yield frame numbers of Deadline `frames`
+
+    Example:
+        >>> list(iter_frames("1-5x2,8"))
+        [1, 3, 5, 8]
+
+    """
+
+    for part in frames.replace(" ", "").split(","):
+        if not part:
+            continue
+
+        part, _, step = part.partition("x")
+        start, _, end = part.lstrip("-").partition("-")
+
+        # Negative starting frames, e.g. -5-10
+        start = int(start) * (-1 if part.startswith("-") else 1)
+        end = int(end) if end else start
+
+        for frame in range(start, end + 1, int(step or 1)):
+            yield frame
+
+
+def tasks(url, job):
+    """Return tasks of `job` from the Web Service at `url`"""
+    from avalon.vendor import requests
+
+    response = requests.get(url + "/api/tasks", params={"JobID": job})
+
+    if not response.ok:
+        raise Exception(response.text)
+
+    return response.json()["Tasks"]
+
+
+def _timestamp(date):
+    """Return seconds since epoch of a Web Service `date`
+
+    Time zones are ignored, as both ends of a duration share one.
+
+    """
+
+    import calendar
+    import datetime
+
+    parsed = datetime.datetime.strptime(date[:19], "%Y-%m-%dT%H:%M:%S")
+    return calendar.timegm(parsed.timetuple())
+
+
+def render_time(tasks):
+    """Return "frames" and "seconds" spent rendering completed `tasks`"""
+    frames = 0
+    seconds = 0
+
+    for task in tasks:
+        if task["Stat"] != TASK_COMPLETED:
+            continue
+
+        frames += sum(1 for _ in iter_frames(task["Frames"]))
+        seconds += _timestamp(task["Comp"]) - _timestamp(task["StartRen"])
+
+    return {"frames": frames, "seconds": seconds}
+
+
+def history(renders, layer, count=HISTORY):
+    """Return past seconds per frame of `layer`, or None
+
+    Render times are recorded into the metadata written next to
+    renders upon completion, see IntegrateAvaRenderTime.
+
+    Arguments:
+        renders (str): Absolute path to renders of every scene,
+            e.g. <workspace>/renders
+        layer (str): Name of render layer
+        count (int, optional): Most recent submissions considered
+
+    """
+
+    import json
+
+    try:
+        scenes = os.listdir(renders)
+    except OSError:
+        return None
+
+    candidates = list()
+    for scene in scenes:
+        fname = os.path.join(renders, scene, layer + ".json")
+
+        try:
+            candidates.append((os.path.getmtime(fname), fname))
+        except OSError:
+            continue
+
+    frames = 0
+    seconds = 0
+    found = 0
+
+    for _, fname in sorted(candidates, reverse=True):
+        try:
+            with open(fname) as f:
+                recorded = json.load(f).get("renderTime")
+        except (IOError, OSError, ValueError):
+            continue
+
+        if not recorded or not recorded["frames"]:
+            continue
+
+        frames += recorded["frames"]
+        seconds += recorded["seconds"]
+        found += 1
+
+        if found >= count:
+            break
+
+    return float(seconds) / frames if frames else None
+
+
+def estimate(triangles, pixels):
+    """Return guessed seconds per frame, from scene statistics
+
+    A rough model, for layers without a history.
+
+    Arguments:
+        triangles (int): Number of triangles in the scene
+        pixels (int): Width times height of rendered frames
+
+    """
+
+    return SECONDS_PER_PIXEL * pixels * (1 + triangles / 1e6)
+
+
+def chunk_size(seconds_per_frame, frames, duration=None):
+    """Return number of frames per task, for tasks of about `duration`
+
+    Example:
+        >>> chunk_size(45, frames=100, duration=600)
+        13
+        >>> chunk_size(1200, frames=100, duration=600)
+        1
+
+    """
+
+    duration = duration or task_duration()
+    size = int(round(duration / max(seconds_per_frame, 1e-3)))
+
+    return max(1, min(size, frames))
+
+
+def plan(renders, layer, frames, statistics, duration=None):
+    """Return chunk size of `layer`, from history or `statistics`
+
+    Arguments:
+        renders (str): Absolute path to renders, see :func:`history`
+        layer (str): Name of render layer
+        frames (int): Number of frames to render
+        statistics (callable): Returning "triangles" and "pixels", see
+            :func:`estimate`. Called for layers without a history only.
+        duration (float, optional): Seconds each task should take
+
+    Returns:
+        plan (tuple): Chunk size, seconds per frame, and
+            their source; either "history" or "estimate"
+
+    """
+
+    seconds = history(renders, layer)
+    source = "history"
+
+    if seconds is None:
+        seconds = estimate(**statistics())
+        source = "estimate"
+
+    return chunk_size(seconds, frames, duration), seconds, source
+
+
+def state(job):
+    """Return name of state of `job`, e.g. "Completed"
+
+    Example:
+        >>> state({"Stat": 3})
+        'Completed'
+
+    """
+
+    return JOB_STATES.get(job["Stat"], "Unknown")
+
+
+class JobStatus(object):
+    """Status of jobs, queried many at a time and reused briefly
+
+    Arguments:
+        url (str): Address of Web Service, e.g. AVALON_DEADLINE
+        ttl (float, optional): Seconds before status is queried anew
+        batch (int, optional): Number of jobs queried per request
+
+    """
+
+    def __init__(self, url, ttl=STATUS_TTL, batch=STATUS_BATCH):
+        self.url = url
+        self.ttl = ttl
+        self.batch = batch
+        self.requests = 0
+
+        # Job and time of query, per id
+        self._cache = dict()
+        self._session = None
+
+    def _query(self, ids):
+        from avalon.vendor import requests
+
+        if self._session is None:
+            self._session = requests.Session()
+
+        now = time.time()
+
+        for start in range(0, len(ids), self.batch):
+            chunk = ids[start:start + self.batch]
+            response = self._session.get(self.url + "/api/jobs",
+                                         params={"JobID": ",".join(chunk)})
+            self.requests += 1
+
+            if not response.ok:
+                raise Exception("Could not determine the current status "
+                                "of jobs: %s" % response.text)
+
+            for job in response.json():
+                self._cache[job["_id"]] = (job, now)
+
+    def get(self, ids):
+        """Return job per id of `ids`, querying those not recently queried
+
+        Jobs unknown to the Web Service are missing from the result.
+
+        """
+
+        now = time.time()
+        stale = [_id for _id in ids
+                 if now - self._cache.get(_id, (None, 0))[1] > self.ttl]
+
+        if stale:
+            # Each job once, in order
+            self._query(sorted(set(stale), key=stale.index))
+
+        return {_id: self._cache[_id][0]
+                for _id in ids if _id in self._cache}
+
+    def wait(self, ids, timeout=None, interval=30.0, log=log):
+        """Return jobs of `ids` once finished, see :data:`FINISHED`
+
+        Arguments:
+            ids (list): Ids of jobs
+            timeout (float, optional): Give up after this many seconds,
+                and return jobs as they are. Wait indefinitely if None.
+            interval (float, optional): Seconds between queries
+
+        """
+
+        started = time.time()
+
+        while True:
+            jobs = self.get(ids)
+            pending = [_id for _id in ids
+                       if _id in jobs and state(jobs[_id]) not in FINISHED]
+
+            if not pending:
+                return jobs
+
+            remaining = None
+            if timeout is not None:
+                remaining = timeout - (time.time() - started)
+
+                if remaining <= 0:
+                    return jobs
+
+            log.info("Waiting for %d of %d job(s).." % (len(pending),
+                                                        len(ids)))
+
+            time.sleep(interval if remaining is None
+                       else min(interval, remaining))
+
+            # Always queried anew, regardless of ttl
+            for _id in pending:
+                self._cache.pop(_id, None)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+def job_status(context, url):
+    """Return status of jobs shared by a publishing `context`"""
+    if "deadlineStatus" not in context.data:
+        context.data["deadlineStatus"] = JobStatus(url)
+
+    return context.data["deadlineStatus"]
+
+
+def wait_timeout():
+    """Return seconds to wait for jobs to finish, from AVALON_DEADLINE_WAIT
+
+    None if unset, and 0 for indefinitely.
+
+    """
+
+    try:
+        return float(os.environ["AVALON_DEADLINE_WAIT"])
+    except (KeyError, ValueError):
+        return None
+
+
+def farm_ttl():
+    """Return configured seconds pools and groups are reused"""
+    try:
+        return float(os.getenv("AVALON_DEADLINE_CACHE_TTL", DEFAULT_FARM_TTL))
+    except ValueError:
+        return DEFAULT_FARM_TTL
+
+
+def _farm_cache():
+    return os.getenv("AVALON_DEADLINE_CACHE",
+                     os.path.join(os.path.expanduser("~"),
+                                  ".avalon", "deadline.json"))
+
+
+def cached_farm(url):
+    """Return last fetched pools and groups of `url`, however old, or None
+
+    Returns:
+        farm (dict): "pools", "groups" and "time" of fetching
+
+    """
+
+    import json
+
+    try:
+        with open(_farm_cache()) as f:
+            return json.load(f).get(url)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def fetch_farm(url):
+    """Fetch pools and groups of `url`, and cache them on disk
+
+    Returns:
+        farm (dict): See :func:`cached_farm`
+
+    """
+
+    import json
+    import tempfile
+
+    from . import transfer
+
+    connection = session(2)
+
+    try:
+        fetched = {"time": time.time()}
+        for key in ("pools", "groups"):
+            response = connection.get(url + "/api/" + key)
+
+            if not response.ok:
+                raise Exception(response.text)
+
+            fetched[key] = response.json()
+
+    finally:
+        connection.close()
+
+    path = _farm_cache()
+    transfer.makedirs(os.path.dirname(path))
+
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        cache = dict()
+
+    cache[url] = fetched
+
+    # Written elsewhere first, such that other
+    # sessions never read a partially written cache.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f, indent=4, sort_keys=True)
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Windows refuses to replace existing files
+        os.remove(path)
+        os.rename(tmp, path)
+
+    return fetched
+
+
+def farm(url, ttl=None):
+    """Return pools and groups of `url`, fetched only if cache has expired
+
+    Arguments:
+        url (str): Address of Web Service, e.g. AVALON_DEADLINE
+        ttl (float, optional): Seconds a cache is valid, defaults
+            to :func:`farm_ttl`
+
+    """
+
+    ttl = farm_ttl() if ttl is None else ttl
+    cached = cached_farm(url)
+
+    if cached is not None and time.time() - cached["time"] < ttl:
+        return cached
+
+    return fetch_farm(url)
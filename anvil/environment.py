@@ -0,0 +1,185 @@
+"""Environment profiles, referenced by render jobs
+
+Rather than passing every variable of the session to each job,
+the environment of a submission is written once to a profile and
+jobs carry only the path to it, alongside the few variables
+required to get a slave as far as installing this config.
+
+Profiles are named by the hash of their content, such that
+identical environments share one profile, and versioned such
+that a slave refuses profiles it does not understand.
+
+    <dirname>/1-ab12cd34ef56ab78.json
+
+Enabled with AVALON_DEADLINE_PROFILE. Profiles are written to
+AVALON_ENVIRONMENT_PROFILES, defaulting to next to renders, and
+hydrated on the slave upon installing this config, see
+:func:`anvil.maya.install`.
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import logging
+
+log = logging.getLogger(__name__)
+
+# Incremented with any change to the layout of profiles
+VERSION = 1
+
+# Variable referencing the profile of a job
+KEY = "AVALON_ENVIRONMENT_PROFILE"
+
+# Variables required by a slave prior to hydrating a profile,
+# passed to each job as-is. Hydrated as this config is installed,
+# after Avalon has connected and validated the session, which
+# requires a project and asset.
+BOOTSTRAP = (
+    "PYTHONPATH",
+    "AVALON_CONFIG",
+    "AVALON_MONGO",
+    "AVALON_DB",
+    "AVALON_PROJECT",
+    "AVALON_ASSET",
+)
+
+
+def enabled():
+    """Return whether jobs should reference a profile"""
+    return bool(os.getenv("AVALON_DEADLINE_PROFILE"))
+
+
+def profiles_dir(default):
+    """Return directory of profiles, unless overridden by environment"""
+    return os.getenv("AVALON_ENVIRONMENT_PROFILES", default)
+
+
+def _serialise(environment):
+    return json.dumps(environment, sort_keys=True, separators=(",", ":"))
+
+
+def profile_id(environment):
+    """Return identifier of `environment`, from its version and content
+
+    Example:
+        >>> profile_id({"AVALON_PROJECT": "hulk"})
+        '1-d0c96d40ea4de6ab'
+
+    """
+
+    digest = hashlib.sha256(_serialise(environment).encode("utf-8"))
+    return "%d-%s" % (VERSION, digest.hexdigest()[:16])
+
+
+def write(environment, dirname):
+    """Write `environment` to a profile in `dirname`, unless already written
+
+    Arguments:
+        environment (dict): Variables of profile
+        dirname (str): Absolute path to directory of profiles
+
+    Returns:
+        path (str): Absolute path to profile
+
+    """
+
+    from . import transfer
+
+    path = os.path.join(dirname, profile_id(environment) + ".json")
+
+    if os.path.exists(path):
+        return path
+
+    transfer.makedirs(dirname)
+
+    # Written elsewhere first, such that slaves
+    # never read a partially written profile.
+    fd, tmp = tempfile.mkstemp(dir=dirname)
+    with os.fdopen(fd, "w") as f:
+        f.write(_serialise({"version": VERSION,
+                            "environment": environment}))
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Windows refuses to replace existing files, written
+        # by another submission in the meantime perhaps.
+        os.remove(tmp)
+
+    return path
+
+
+def load(path):
+    """Return environment of profile at `path`
+
+    Raises:
+        ValueError, on a profile of another version or
+            whose content does not match its name
+
+    """
+
+    with open(path) as f:
+        profile = json.load(f)
+
+    if profile.get("version") != VERSION:
+        raise ValueError("Unsupported version of profile %s: %s"
+                         % (path, profile.get("version")))
+
+    environment = profile["environment"]
+    name, _ = os.path.splitext(os.path.basename(path))
+
+    if profile_id(environment) != name:
+        raise ValueError("Profile %s has been modified" % path)
+
+    return environment
+
+
+def job_environment(path, environment):
+    """Return variables of a job referencing profile at `path`
+
+    Arguments:
+        path (str): Absolute path to profile, see :func:`write`
+        environment (dict): Variables of profile
+
+    """
+
+    variables = dict((key, environment[key])
+                     for key in BOOTSTRAP if key in environment)
+    variables[KEY] = path
+
+    return variables
+
+
+def hydrate(environ=None):
+    """Apply profile referenced by the environment, if any
+
+    Variables required prior to hydrating are left as-is, as they
+    may have been remapped for this machine.
+
+    Arguments:
+        environ (dict, optional): Environment to hydrate,
+            defaults to os.environ
+
+    Returns:
+        environment (dict): Variables applied, or None
+
+    """
+
+    environ = os.environ if environ is None else environ
+    path = environ.get(KEY)
+
+    if not path:
+        return None
+
+    environment = dict(
+        (str(key), str(value))
+        for key, value in load(path).items()
+        if key not in BOOTSTRAP
+    )
+
+    environ.update(environment)
+    log.info("Hydrated %d variable(s) from %s" % (len(environment), path))
+
+    return environment
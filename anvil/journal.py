@@ -0,0 +1,235 @@
+"""Write-ahead journal of integration
+
+Integration of an instance is recorded as it happens; the version
+allocated, documents about to be written and each file transferred.
+Should the host die halfway, publishing the same files of the same
+subset from the same scene again resumes from where it left off,
+reusing the version it had already allocated.
+
+Journals are named by the scene, subset and names of files published
+rather than by the staging directory, as extractors of Maya stage to
+a new directory on each attempt. They are kept outside of the staging
+directory, as it may be collected anew on resuming, such as a directory
+of rendered frames.
+
+Journals default to ~/.avalon/journals, unless otherwise specified via
+the AVALON_JOURNALS environment variable. A journal is removed once its
+documents have been written, and journals of attempts never resumed
+are removed after AVALON_JOURNAL_MAX_AGE seconds.
+
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+# Seconds after which journals of interrupted attempts are removed,
+# unless otherwise specified via the AVALON_JOURNAL_MAX_AGE variable.
+DEFAULT_MAX_AGE = 7 * 24 * 3600.0
+
+
+def journal_dir():
+    """Return configured directory of journals"""
+    return os.getenv("AVALON_JOURNALS",
+                     os.path.join(os.path.expanduser("~"),
+                                  ".avalon", "journals"))
+
+
+def max_age():
+    """Return configured seconds before journals expire"""
+    try:
+        return float(os.getenv("AVALON_JOURNAL_MAX_AGE", DEFAULT_MAX_AGE))
+    except ValueError:
+        return DEFAULT_MAX_AGE
+
+
+def prune(dirname=None, age=None):
+    """Remove journals of attempts not resumed within `age` seconds
+
+    Returns:
+        removed (list): Absolute paths to removed journals
+
+    """
+
+    dirname = dirname or journal_dir()
+    age = max_age() if age is None else age
+
+    removed = list()
+    now = time.time()
+
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        return removed
+
+    for name in names:
+        if not name.endswith(".journal"):
+            continue
+
+        path = os.path.join(dirname, name)
+
+        try:
+            if now - os.path.getmtime(path) > age:
+                os.remove(path)
+                removed.append(path)
+        except OSError:
+            # Removed by another publish
+            continue
+
+    return removed
+
+
+def key(source, subset, files):
+    """Return name of journal, stable across attempts of a publish
+
+    Arguments:
+        source (str): Scene published from, e.g. instance.data["source"]
+        subset (str): Name of subset
+        files (list): Names of files published, as instance.data["files"]
+
+    """
+
+    identity = json.dumps([os.path.normcase(source), subset, files],
+                          sort_keys=True)
+
+    digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+    return "%s.%s" % (digest, subset)
+
+
+class Journal(object):
+    """Append-only record of the integration of a single subset
+
+    Each line is a JSON object with an "op" of either "version",
+    "documents" or "transfer".
+
+    Arguments:
+        path (str): Absolute path to journal file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Recovered from a previous, interrupted integration
+        self.version = None
+        self.documents = list()
+        self.transfers = dict()
+
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def open(cls, source, subset, files):
+        """Return journal of `files` of `subset`, published from `source`
+
+        Entries of an interrupted integration are read back,
+        and appended to hereafter. See :func:`key`
+
+        """
+
+        from . import transfer
+
+        dirname = journal_dir()
+        transfer.makedirs(dirname)
+        prune(dirname)
+
+        path = os.path.join(dirname, key(source, subset, files) + ".journal")
+        journal = cls(path)
+
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line may have been cut short
+                        break
+
+                    journal._replay(entry)
+        except IOError:
+            pass
+
+        journal._file = open(path, "a")
+        return journal
+
+    @property
+    def resumed(self):
+        """Whether there was a previous, interrupted integration"""
+        return self.version is not None
+
+    def _replay(self, entry):
+        op = entry.pop("op")
+
+        if op == "version":
+            self.version = entry
+        elif op == "documents":
+            self.documents.extend(entry["ids"])
+        elif op == "transfer":
+            self.transfers[entry["dst"]] = entry
+
+    def _record(self, op, durable=False, **entry):
+        entry["op"] = op
+        line = json.dumps(entry, sort_keys=True) + "\n"
+
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+            if durable:
+                os.fsync(self._file.fileno())
+
+    def record_version(self, _id, name, subset):
+        """Record allocation of version `name` with `_id`"""
+        self.version = {"_id": str(_id), "name": name, "subset": str(subset)}
+        self._record("version", durable=True, **self.version)
+
+    def record_documents(self, ids):
+        """Record `ids` of documents about to be written"""
+        ids = [str(_id) for _id in ids]
+        self.documents.extend(ids)
+        self._record("documents", durable=True, ids=ids)
+
+    def record_transfer(self, result):
+        """Record completed transfer `result`, see :mod:`anvil.transfer`"""
+        entry = {
+            key: result[key] for key in result
+            if key not in ("error",)
+        }
+
+        self._record("transfer", **entry)
+
+    def completed(self, src, dst):
+        """Return result of previous transfer of `src` to `dst`
+
+        Returns None unless `dst` exists and is of identical size.
+
+        """
+
+        result = self.transfers.get(dst)
+
+        if result is None or result["src"] != src:
+            return None
+
+        try:
+            if os.path.getsize(dst) != os.path.getsize(src):
+                return None
+        except OSError:
+            return None
+
+        return dict(result, error=None)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def commit(self):
+        """Integration finished, the journal is no longer needed"""
+        self.close()
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -7,6 +7,7 @@ from avalon import maya, api as avalon
 from pyblish import api as pyblish
 
 from . import menu
+from .. import environment
 
 PARENT_DIR = os.path.dirname(__file__)
 PACKAGE_DIR = os.path.dirname(PARENT_DIR)
@@ -18,6 +19,14 @@ CREATE_PATH = os.path.join(PLUGINS_DIR, "maya", "create")
 
 
 def install():
+    # Render jobs reference their environment, see anvil.environment
+    hydrated = environment.hydrate()
+    if hydrated:
+        avalon.Session.update(
+            (key, value) for key, value in hydrated.items()
+            if key.startswith("AVALON_")
+        )
+
     pyblish.register_plugin_path(PUBLISH_PATH)
     avalon.register_plugin_path(avalon.Loader, LOAD_PATH)
     avalon.register_plugin_path(avalon.Creator, CREATE_PATH)
@@ -4,13 +4,36 @@ import logging
 from maya import cmds
 
 from avalon import api, maya
-from avalon.vendor import requests
 from avalon.vendor.Qt import QtWidgets, QtCore
 
+from .. import deadline
+
 module = sys.modules[__name__]
 module.log = logging.getLogger(__name__)
 module.window = None
 
+# Outlives the dialog, which is deleted on close
+module.fetcher = None
+
+
+class _FarmFetcher(QtCore.QThread):
+    """Fetch pools and groups off of Maya's main thread"""
+
+    fetched = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+
+    def __init__(self, url, parent=None):
+        super(_FarmFetcher, self).__init__(parent)
+        self.url = url
+
+    def run(self):
+        try:
+            farm = deadline.fetch_farm(self.url)
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.fetched.emit(farm)
+
 
 class _RenderGlobalsEditor(QtWidgets.QDialog):
     def __init__(self, parent=None):
@@ -34,6 +57,7 @@ class _RenderGlobalsEditor(QtWidgets.QDialog):
         self.pools = pools
         self.groups = groups
         self.render_globals = None
+        self.fetcher = None
 
         self.resize(300, 100)
         self.setMinimumWidth(200)
@@ -53,13 +77,6 @@ class _RenderGlobalsEditor(QtWidgets.QDialog):
         cmds.setAttr(self.render_globals + ".group", group, type="string")
 
     def refresh(self, *args):
-        self.pools.blockSignals(True)
-        self.groups.blockSignals(True)
-        self.pools.clear()
-        self.groups.clear()
-        self.pools.blockSignals(False)
-        self.groups.blockSignals(False)
-
         exists = maya.lsattr("id", "avalon.renderglobals")
         assert len(exists) <= 1, (
             "More than one renderglobal exists, this is a bug")
@@ -76,22 +93,39 @@ class _RenderGlobalsEditor(QtWidgets.QDialog):
         # Store reference for editing
         self.render_globals = render_globals
 
-        render_globals = maya.read(render_globals)
+        url = api.Session["AVALON_DEADLINE"]
+
+        # Shown right away, and updated once fetched anew
+        cached = deadline.cached_farm(url)
+        if cached is not None:
+            self.on_fetched(cached, warn=False)
+
+        if module.fetcher is None or not module.fetcher.isRunning():
+            module.log.debug("Requesting pools and groups from %s.." % url)
+            module.fetcher = _FarmFetcher(url)
+            module.fetcher.start()
+
+        # Once per fetch, however often refreshed meanwhile
+        if self.fetcher is not module.fetcher:
+            self.fetcher = module.fetcher
+            self.fetcher.fetched.connect(self.on_fetched)
+            self.fetcher.failed.connect(self.on_failed)
+
+    def on_failed(self, message):
+        cmds.warning("Could not fetch pools and groups: %s" % message)
+
+    def on_fetched(self, farm, warn=True):
+        render_globals = maya.read(self.render_globals)
         current_pool = render_globals["pool"] or "none"
         current_group = render_globals["group"] or "none"
 
-        url = api.Session["AVALON_DEADLINE"] + "/api/pools"
-        module.log.debug("Requesting pools from %s.." % url)
-        response = requests.get(url)
-        pools = response.json()
-
-        url = api.Session["AVALON_DEADLINE"] + "/api/groups"
-        module.log.debug("Requesting groups from %s.." % url)
-        response = requests.get(url)
-        groups = response.json()
+        self.pools.blockSignals(True)
+        self.groups.blockSignals(True)
+        self.pools.clear()
+        self.groups.clear()
 
         valid_pool = False
-        for index, pool in enumerate(pools):
+        for index, pool in enumerate(farm["pools"]):
             self.pools.insertItem(index, pool)
 
             if pool == current_pool:
@@ -99,18 +133,25 @@ class _RenderGlobalsEditor(QtWidgets.QDialog):
                 valid_pool = True
 
         valid_group = False
-        for index, group in enumerate(groups):
+        for index, group in enumerate(farm["groups"]):
             self.groups.insertItem(index, group)
 
             if group == current_group:
                 self.groups.setCurrentIndex(index)
                 valid_group = True
 
+        self.pools.blockSignals(False)
+        self.groups.blockSignals(False)
+
+        # Cached pools and groups may be outdated
+        if not warn:
+            return
+
         if not valid_pool:
             cmds.warning("%s is not a valid pool" % current_pool)
 
         if not valid_group:
-            cmds.warning("%s is not a valid pool" % current_group)
+            cmds.warning("%s is not a valid group" % current_group)
 
 
 def render_globals_editor(*args):
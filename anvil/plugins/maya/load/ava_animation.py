@@ -9,6 +9,9 @@ class AbcLoader(avalon.maya.Loader):
 
     def process(self, name, namespace, context, data):
         from maya import cmds
+        from anvil import worker
+
+        worker.assert_complete(context)
 
         cmds.loadPlugin("AbcImport.mll", quiet=True)
 
@@ -38,6 +41,9 @@ class CurvesLoader(avalon.maya.Loader):
     def process(self, name, namespace, context, data):
         from maya import cmds
         from avalon import maya, api
+        from anvil import worker
+
+        worker.assert_complete(context)
 
         cmds.loadPlugin("atomImportExport.mll", quiet=True)
 
@@ -108,6 +114,7 @@ class CurvesLoader(avalon.maya.Loader):
         import os
         from maya import cmds
         from avalon import maya, io
+        from anvil import database
 
         # Task-dependent post-process
         if os.getenv("AVALON_TASK") != "animate":
@@ -121,8 +128,10 @@ class CurvesLoader(avalon.maya.Loader):
         except (KeyError, IndexError):
             return self.log.warning("No dependencies found for %s" % name)
 
-        dependency = io.find_one({"_id": io.ObjectId(dependency)})
-        _, _, dependency, _ = io.parenthood(dependency)
+        # Per load, such that documents are never stale
+        cache = database.document_cache()
+        dependency = cache.find_one({"_id": io.ObjectId(dependency)})
+        _, _, dependency, _ = cache.parenthood(dependency)
 
         # TODO(marcus): We are hardcoding the name "out_SET" here.
         #   Better register this keyword, so that it can be used
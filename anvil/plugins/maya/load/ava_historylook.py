@@ -9,6 +9,9 @@ class HistoryLookLoader(avalon.maya.Loader):
 
     def process(self, name, namespace, context, data):
         from maya import cmds
+        from anvil import worker
+
+        worker.assert_complete(context)
 
         nodes = cmds.file(
             self.fname,
@@ -12,8 +12,11 @@ class LookLoader(avalon.maya.Loader):
         import json
 
         from maya import cmds
+        from anvil import worker
         from anvil.maya import lib
 
+        worker.assert_complete(context)
+
         try:
             existing_reference = cmds.file(self.fname,
                                            query=True,
@@ -13,6 +13,9 @@ class ModelLoader(avalon.maya.Loader):
 
     def process(self, name, namespace, context, data):
         from maya import cmds
+        from anvil import worker
+
+        worker.assert_complete(context)
 
         print("felix here")
         print(self.fname)
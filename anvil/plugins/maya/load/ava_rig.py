@@ -14,6 +14,9 @@ class RigLoader(avalon.maya.Loader):
     def process(self, name, namespace, context, data):
         from maya import cmds
         from avalon import api
+        from anvil import worker
+
+        worker.assert_complete(context)
 
         nodes = cmds.file(self.fname,
                           namespace=namespace,
@@ -1,51 +1,103 @@
-import pyblish.api
-
+import os
 
-class AvaSubmitDeadline(pyblish.api.InstancePlugin):
-    """Submit available render layers to Deadline
-
-    Renders are submitted to a Deadline Web Service as
-    supplied via the environment variable AVALON_DEADLINE
+import pyblish.api
 
-    """
 
-    label = "Submit to Deadline"
-    order = pyblish.api.IntegratorOrder
-    hosts = ["maya"]
-    families = ["anvil.renderlayer"]
+class _Submission(object):
+    """Payloads of render layers, shared by both submitters below"""
 
-    def process(self, instance):
-        import os
-        import json
-        import shutil
+    def settings(self, context):
+        """Return settings common to every render layer of `context`"""
         import getpass
 
         from maya import cmds
 
         from avalon import api
-        from avalon.vendor import requests
+        from anvil import environment as profiles
 
         assert "AVALON_DEADLINE" in api.Session, (
             "Environment variable missing: 'AVALON_DEADLINE"
         )
 
-        AVALON_DEADLINE = api.Session["AVALON_DEADLINE"]
-
-        context = instance.context
         workspace = context.data["workspaceDir"]
         fpath = context.data["currentFile"]
         fname = os.path.basename(fpath)
         name, ext = os.path.splitext(fname)
-        comment = context.data.get("comment", "")
-        dirname = os.path.join(workspace, "renders", name)
 
-        try:
-            os.makedirs(dirname)
-        except OSError:
-            pass
+        # Include critical variables with submission
+        environment = dict({
+            # This will trigger `userSetup.py` on the slave
+            # such that proper initialisation happens the same
+            # way as it does on a local machine.
+            # TODO(marcus): This won't work if the slaves don't
+            # have accesss to these paths, such as if slaves are
+            # running Linux and the submitter is on Windows.
+            "PYTHONPATH": os.getenv("PYTHONPATH", ""),
 
-        # E.g. http://192.168.0.1:8082/api/jobs
-        url = "{}/api/jobs?JobID=%s".format(AVALON_DEADLINE)
+        }, **api.Session)
+
+        # Written once per publish, and referenced by every job
+        profile = None
+        if profiles.enabled():
+            profile = context.data.get("environmentProfile")
+
+            if profile is None:
+                profile = profiles.write(environment, profiles.profiles_dir(
+                    os.path.join(workspace, "renders", ".environments")))
+                context.data["environmentProfile"] = profile
+
+                self.log.info("Environment profile @ %s" % profile)
+
+            environment = profiles.job_environment(profile, environment)
+
+        return {
+            "url": api.Session["AVALON_DEADLINE"],
+            "workspace": workspace,
+            "fpath": fpath,
+            "fname": fname,
+            "comment": context.data.get("comment", ""),
+            "dirname": os.path.join(workspace, "renders", name),
+            "user": getpass.getuser(),
+            "version": cmds.about(version=True),
+            "environment": environment,
+            "profile": profile,
+            "renders": os.path.join(workspace, "renders"),
+        }
+
+    def statistics(self, context):
+        """Return statistics of the scene, for layers without a history
+
+        Computed once per publish, and only when needed, as
+        counting triangles of a large scene takes a while.
+
+        """
+
+        from maya import cmds
+
+        if "sceneStatistics" in context.data:
+            return context.data["sceneStatistics"]
+
+        triangles = 0
+        for mesh in cmds.ls(type="mesh", noIntermediate=True):
+            count = cmds.polyEvaluate(mesh, triangle=True)
+
+            # A message, rather than a count, for empty meshes
+            if isinstance(count, int):
+                triangles += count
+
+        pixels = (cmds.getAttr("defaultResolution.width") *
+                  cmds.getAttr("defaultResolution.height"))
+
+        context.data["sceneStatistics"] = {
+            "triangles": triangles,
+            "pixels": pixels,
+        }
+
+        return context.data["sceneStatistics"]
+
+    def payload(self, instance, settings):
+        """Return submission of `instance`"""
+        from anvil import checksums
 
         # Documentation for keys available at:
         # https://docs.thinkboxsoftware.com
@@ -54,13 +106,13 @@ class AvaSubmitDeadline(pyblish.api.InstancePlugin):
         payload = {
             "JobInfo": {
                 # Top-level group name
-                "BatchName": fname,
+                "BatchName": settings["fname"],
 
                 # Job name, as seen in Monitor
-                "Name": "%s - %s" % (fname, instance.name),
+                "Name": "%s - %s" % (settings["fname"], instance.name),
 
                 # Arbitrary username, for visualisation in Monitor
-                "UserName": getpass.getuser(),
+                "UserName": settings["user"],
 
                 "Plugin": "MayaBatch",
                 "Frames": "{start}-{end}x{step}".format(
@@ -69,7 +121,7 @@ class AvaSubmitDeadline(pyblish.api.InstancePlugin):
                     step=int(instance.data["byFrameStep"]),
                 ),
 
-                "Comment": comment,
+                "Comment": settings["comment"],
 
                 # Optional, enable double-click to preview rendered
                 # frames from Deadline Monitor
@@ -77,14 +129,14 @@ class AvaSubmitDeadline(pyblish.api.InstancePlugin):
             },
             "PluginInfo": {
                 # Input
-                "SceneFile": fpath,
+                "SceneFile": settings["fpath"],
 
                 # Output directory and filename
-                "OutputFilePath": dirname,
+                "OutputFilePath": settings["dirname"],
                 "OutputFilePrefix": "<RenderLayer>/<RenderLayer>",
 
                 # Mandatory for Deadline
-                "Version": cmds.about(version=True),
+                "Version": settings["version"],
 
                 # Only render layers are considered renderable in this pipeline
                 "UsingRenderLayers": True,
@@ -96,25 +148,14 @@ class AvaSubmitDeadline(pyblish.api.InstancePlugin):
                 "Renderer": "file",
 
                 # Resolve relative references
-                "ProjectPath": workspace,
+                "ProjectPath": settings["workspace"],
             },
 
             # Mandatory for Deadline, may be empty
             "AuxFiles": []
         }
 
-        # Include critical variables with submission
-        environment = dict({
-            # This will trigger `userSetup.py` on the slave
-            # such that proper initialisation happens the same
-            # way as it does on a local machine.
-            # TODO(marcus): This won't work if the slaves don't
-            # have accesss to these paths, such as if slaves are
-            # running Linux and the submitter is on Windows.
-            "PYTHONPATH": os.getenv("PYTHONPATH", ""),
-
-        }, **api.Session)
-
+        environment = settings["environment"]
         payload["JobInfo"].update({
             "EnvironmentKeyValue%d" % index: "{key}={value}".format(
                 key=key,
@@ -122,43 +163,97 @@ class AvaSubmitDeadline(pyblish.api.InstancePlugin):
             ) for index, key in enumerate(environment)
         })
 
+        if checksums.enabled():
+            # Frames are hashed by each task once rendered,
+            # next to the metadata of this layer.
+            payload["JobInfo"].update({
+                "PostTaskScript": checksums.script(),
+                "ExtraInfoKeyValue0": "%s=%s" % (
+                    checksums.KEY,
+                    os.path.join(settings["dirname"], instance.name)),
+            })
+
         # Include optional render globals
         payload["JobInfo"].update(
             instance.data.get("renderGlobals", {})
         )
 
+        self.validate_farm(payload["JobInfo"], settings)
+
+        if "ChunkSize" not in payload["JobInfo"]:
+            payload["JobInfo"]["ChunkSize"] = self.chunk_size(
+                instance, settings, payload["JobInfo"]["Frames"])
+
         self.preflight_check(instance)
 
-        self.log.info("Submitting..")
-        self.log.info(json.dumps(
-            payload, indent=4, sort_keys=True)
+        return payload
+
+    def validate_farm(self, job_info, settings):
+        """Ensure pool and group exist, as cached by the Render Globals"""
+        from anvil import deadline
+
+        url = settings["url"]
+
+        try:
+            farm = deadline.farm(url)
+
+            if any(job_info.get(key, "none") not in farm[key.lower() + "s"]
+                   for key in ("Pool", "Group")):
+                # Added since cached, perhaps
+                farm = deadline.farm(url, ttl=0)
+
+        except Exception as e:
+            return self.log.warning("Could not validate pool and group: %s"
+                                    % e)
+
+        for key in ("Pool", "Group"):
+            value = job_info.get(key, "none")
+            available = farm[key.lower() + "s"]
+
+            assert value in available, (
+                "%s '%s' does not exist, pick one of: %s"
+                % (key, value, ", ".join(available))
+            )
+
+    def chunk_size(self, instance, settings, frames):
+        """Return frames per task, from past render times of this layer"""
+        from anvil import deadline
+
+        size, seconds, source = deadline.plan(
+            settings["renders"],
+            instance.name,
+            frames=sum(1 for _ in deadline.iter_frames(frames)),
+            statistics=lambda: self.statistics(instance.context),
         )
 
-        response = requests.post(url, json=payload)
+        self.log.info("%s: %d frame(s) per task, at %.1fs per frame (%s)"
+                      % (instance.name, size, seconds, source))
 
-        if response.ok:
-            # Write metadata for publish
-            fname = os.path.join(dirname, instance.name + ".json")
-            data = {
-                "submission": payload,
-                "session": api.Session,
-                "instance": instance.data,
-                "jobs": [
-                    response.json()
-                ],
-            }
-
-            with open(fname, "w") as f:
-                json.dump(data, f, indent=4, sort_keys=True)
+        return size
+
+    def write_metadata(self, instance, settings, payload, job):
+        """Write metadata for publish, see CollectAvaImageSequences"""
+        import json
 
+        from avalon import api
+
+        fname = os.path.join(settings["dirname"], instance.name + ".json")
+        data = {
+            "submission": payload,
+            "instance": instance.data,
+            "jobs": [
+                job
+            ],
+        }
+
+        # The session is referenced, rather than repeated per layer
+        if settings["profile"] is not None:
+            data["profile"] = settings["profile"]
         else:
-            try:
-                shutil.rmtree(dirname)
-            except OSError:
-                # This is nice-to-have, but not critical to the operation
-                pass
+            data["session"] = api.Session
 
-            raise Exception(response.text)
+        with open(fname, "w") as f:
+            json.dump(data, f, sort_keys=True, separators=(",", ":"))
 
     def preview_fname(self, instance):
         """Return outputted filename with #### for padding
@@ -208,3 +303,118 @@ class AvaSubmitDeadline(pyblish.api.InstancePlugin):
                 "%f=%d was rounded off to nearest integer"
                 % (value, int(value))
             )
+
+
+class AvaSubmitDeadline(_Submission, pyblish.api.InstancePlugin):
+    """Submit available render layers to Deadline
+
+    Renders are submitted to a Deadline Web Service as
+    supplied via the environment variable AVALON_DEADLINE
+
+    With AVALON_DEADLINE_BATCH set, layers are instead
+    submitted together, see AvaSubmitDeadlineBatch.
+
+    With AVALON_DEADLINE_PROFILE set, jobs reference the session
+    written to a profile, see :mod:`anvil.environment`.
+
+    """
+
+    label = "Submit to Deadline"
+    order = pyblish.api.IntegratorOrder
+    hosts = ["maya"]
+    families = ["anvil.renderlayer"]
+
+    active = not os.getenv("AVALON_DEADLINE_BATCH")
+
+    def process(self, instance):
+        import json
+        import shutil
+
+        from avalon.vendor import requests
+
+        settings = self.settings(instance.context)
+        dirname = settings["dirname"]
+
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            pass
+
+        # E.g. http://192.168.0.1:8082/api/jobs
+        url = "{}/api/jobs".format(settings["url"])
+
+        payload = self.payload(instance, settings)
+        body = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+
+        self.log.info("Submitting %s (%d bytes).."
+                      % (payload["JobInfo"]["Name"], len(body)))
+        self.log.debug(body)
+
+        response = requests.post(
+            url, data=body, headers={"Content-Type": "application/json"})
+
+        if response.ok:
+            self.write_metadata(instance, settings, payload, response.json())
+
+        else:
+            try:
+                shutil.rmtree(dirname)
+            except OSError:
+                # This is nice-to-have, but not critical to the operation
+                pass
+
+            raise Exception(response.text)
+
+
+class AvaSubmitDeadlineBatch(_Submission, pyblish.api.ContextPlugin):
+    """Submit all render layers to Deadline at once
+
+    Payloads of every layer are built first, and posted concurrently
+    over a pool of connections; see :mod:`anvil.deadline`. Enabled
+    with AVALON_DEADLINE_BATCH.
+
+    """
+
+    label = "Submit to Deadline (Batch)"
+    order = pyblish.api.IntegratorOrder
+    hosts = ["maya"]
+    families = ["anvil.renderlayer"]
+
+    active = bool(os.getenv("AVALON_DEADLINE_BATCH"))
+
+    def process(self, context):
+        from anvil import deadline
+
+        instances = [
+            instance for instance in context
+            if instance.data.get("publish", True) and
+            instance.data["family"] in self.families
+        ]
+
+        settings = self.settings(context)
+
+        try:
+            os.makedirs(settings["dirname"])
+        except OSError:
+            pass
+
+        payloads = [self.payload(instance, settings)
+                    for instance in instances]
+
+        self.log.info("Submitting %d render layer(s).." % len(payloads))
+        results = deadline.submit(settings["url"], payloads, log=self.log)
+
+        errors = list()
+        for instance, payload, (job, error) in zip(instances,
+                                                   payloads,
+                                                   results):
+            if error is not None:
+                errors.append((instance.name, error))
+                continue
+
+            self.write_metadata(instance, settings, payload, job)
+
+        if errors:
+            raise deadline.SubmissionError(errors)
+
+        self.log.info("Submitted %d render layer(s)" % len(payloads))
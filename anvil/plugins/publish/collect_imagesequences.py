@@ -11,27 +11,30 @@ class CollectAvaImageSequences(pyblish.api.ContextPlugin):
     def process(self, context):
         import os
         import json
-        from avalon.vendor import clique
+        from anvil import checksums, deadline, progressive, scan
 
         workspace = context.data["workspaceDir"]
 
-        base, dirs, _ = next(os.walk(workspace))
-        for renderlayer in dirs:
-            abspath = os.path.join(base, renderlayer)
-            files = os.listdir(abspath)
-            collections, remainder = clique.assemble(files, minimum_items=1)
+        # Layers are listed concurrently, and only
+        # if changed since last collected.
+        layers = scan.scan_layers(workspace, log=self.log)
+
+        for renderlayer, collections, remainder in layers:
+            abspath = os.path.join(workspace, renderlayer)
             assert not remainder, (
                 "There shouldn't have been a remainder for '%s': "
                 "%s" % (renderlayer, remainder))
 
             # Maya 2017 compatibility, it inexplicably prefixes layers
             # with "rs_" without warning.
-            compatpath = os.path.join(base, renderlayer.split("rs_", 1)[-1])
+            compatpath = os.path.join(workspace,
+                                      renderlayer.split("rs_", 1)[-1])
 
             for fname in (abspath, compatpath):
                 try:
                     with open(fname + ".json") as f:
                         metadata = json.load(f)
+                    metadata_path = fname + ".json"
                     break
 
                 except OSError:
@@ -41,6 +44,15 @@ class CollectAvaImageSequences(pyblish.api.ContextPlugin):
                 raise Exception("%s was not published correctly "
                                 "(missing metadata)" % renderlayer)
 
+            if progressive.enabled():
+                # Including frames yet to be rendered
+                frames = metadata["submission"]["JobInfo"]["Frames"]
+                for collection in collections:
+                    collection.indexes.update(deadline.iter_frames(frames))
+
+            # Written by each render task, see anvil.checksums
+            manifest = checksums.load(os.path.splitext(metadata_path)[0])
+
             for collection in collections:
                 instance = context.create_instance(str(collection))
 
@@ -51,7 +63,12 @@ class CollectAvaImageSequences(pyblish.api.ContextPlugin):
                     "subset": collection.head[:-1],
                     "stagingDir": os.path.join(workspace, renderlayer),
                     "files": [list(collection)],
-                    "metadata": metadata
+                    "metadata": metadata,
+                    "metadataPath": metadata_path,
+                    "checksums": dict(
+                        (fname, manifest[fname])
+                        for fname in collection if fname in manifest
+                    ),
                 })
 
                 instance.data.update(data)
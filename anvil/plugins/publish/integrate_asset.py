@@ -24,12 +24,22 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
 
     def process(self, instance):
         import os
-        import errno
-        import shutil
+        import functools
         from pprint import pformat
 
         from avalon import api, io
-        from avalon.vendor import filelink
+        from anvil import (
+            transfer,
+            database,
+            store,
+            sequence,
+            template,
+            worker,
+            progressive,
+            checksums,
+            upload,
+        )
+        from anvil.journal import Journal
 
         # Required environment variables
         PROJECT = api.Session["AVALON_PROJECT"]
@@ -40,6 +50,11 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
 
         context = instance.context
 
+        # Documents are written once all instances have been integrated,
+        # see IntegrateAvalonFlush.
+        buffer = database.write_buffer(context)
+        cache = database.document_cache(context)
+
         # Atomicity
         #
         # Guarantee atomic publishes - each asset contains
@@ -68,15 +83,15 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
 
         self.log.debug("Establishing staging directory @ %s" % stagingdir)
 
-        project = io.find_one({"type": "project"})
-        asset = io.find_one({"name": ASSET})
+        project = cache.find_one({"type": "project"})
+        asset = cache.find_one({"name": ASSET})
 
         assert all([project, asset]), ("Could not find current project or "
                                        "asset '%s'" % ASSET)
 
-        subset = io.find_one({"type": "subset",
-                              "parent": asset["_id"],
-                              "name": instance.data["subset"]})
+        subset = cache.find_one({"type": "subset",
+                                 "parent": asset["_id"],
+                                 "name": instance.data["subset"]})
 
         if subset is None:
             subset_name = instance.data["subset"]
@@ -90,20 +105,41 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
                 "parent": asset["_id"]
             }).inserted_id
 
-            subset = io.find_one({"_id": _id})
+            buffer.created_immediately(_id)
+            cache.invalidate("subset")
+
+            subset = cache.find_one({"_id": _id})
+
+        # Resume
+        #
+        # Pick up where an interrupted integration of
+        # these files of this subset, from this scene, left off.
+        #
+        source = instance.data.get("source", context.data["currentFile"])
+        journal = Journal.open(source, subset["name"], instance.data["files"])
+
+        if journal.resumed and journal.version["subset"] == str(subset["_id"]):
+            version_id = io.ObjectId(journal.version["_id"])
+            next_version = journal.version["name"]
 
-        latest_version = io.find_one({"type": "version",
-                                      "parent": subset["_id"]},
-                                     {"name": True},
-                                     sort=[("name", -1)])
+            self.log.info("Resuming interrupted integration "
+                          "of version %i" % next_version)
 
-        next_version = 1
-        if latest_version is not None:
-            next_version += latest_version["name"]
+            # Documents may have been partially written
+            if journal.documents:
+                io.delete_many({"_id": {"$in": [
+                    io.ObjectId(_id) for _id in journal.documents
+                ]}})
+
+        else:
+            version_id = io.ObjectId()
+            next_version = database.next_version(subset["_id"])
+            journal.record_version(version_id, next_version, subset["_id"])
 
         self.log.debug("Next version: %i" % next_version)
 
         version = {
+            "_id": version_id,
             "schema": "avalon-core:version-2.0",
             "type": "version",
             "parent": subset["_id"],
@@ -118,8 +154,7 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
                 # Enable overriding with current information from instance
                 "time": instance.data.get("time", context.data["time"]),
                 "author": instance.data.get("user", context.data["user"]),
-                "source": instance.data.get(
-                    "source", context.data["currentFile"]).replace(
+                "source": source.replace(
                     api.registered_root(), "{root}"
                 ).replace("\\", "/"),
 
@@ -127,8 +162,24 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
             }
         }
 
+        # Frames are transferred as they are rendered
+        renders = None
+        if progressive.enabled():
+            renders = progressive.renders(instance,
+                                          api.Session.get("AVALON_DEADLINE"))
+
+        background = worker.enabled() or renders is not None
+
+        if background:
+            # Flipped once files are in place, see anvil.worker
+            version["data"]["status"] = worker.PENDING
+
+            if api.Session.get("AVALON_UPLOAD"):
+                # Uploaded by the worker, failing now rather than then
+                upload.credentials()
+
         self.log.debug("Creating version: %s" % pformat(version))
-        version_id = io.insert_one(version).inserted_id
+        buffer.insert(version)
 
         # Write to disk
         #          _
@@ -150,32 +201,22 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
             "version": version["name"],
         }
 
-        template_publish = project["config"]["template"]["publish"]
+        # Read once per publish, and shared amongst instances
+        template_publish = template.templates(context, project)["publish"]
 
         if "output" not in instance.data:
             instance.data["output"] = list()
 
-        def copy(src, dst):
-            dirname = os.path.dirname(dst)
-            try:
-                os.makedirs(dirname)
-            except OSError as e:
-                if e.errno == errno.EEXIST:
-                    pass
-                else:
-                    self.log.critical("An unexpected error occurred.")
-                    raise
-
-            try:
-                filelink.create(src, dst)
-                self.log.info("Linking %s -> %s" % (src, dst))
-            except Exception:
-                # Revert to a normal copy
-                # TODO(marcus): Once filelink is proven stable,
-                # improve upon or remove this fallback.
-                shutil.copy(src, dst)
-                self.log.info("Linking failed, copying %s -> %s"
-                              % (src, dst))
+        # Transfers are gathered up-front and performed all at once,
+        # such that large collections may be written concurrently.
+        transfers = list()
+        representations = list()
+
+        # Index of representation per transfer
+        owners = list()
+
+        # Published paths or sequence pattern, per representation
+        outputs = list()
 
         for _ in instance.data["files"]:
 
@@ -199,17 +240,25 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
                 )
 
                 template_data["representation"] = ext[1:]
+                dirname = template_publish.format(**template_data)
 
                 for fname in collection:
                     src = os.path.join(stagingdir, fname)
-                    dst = os.path.join(
-                        template_publish.format(**template_data),
-                        fname
-                    )
+                    dst = os.path.join(dirname, fname)
 
-                    copy(src, dst)
+                    transfers.append((src, dst))
+                    owners.append(len(representations))
 
-                    instance.data["output"].append(dst)
+                # Stored as pattern and frame ranges, as opposed
+                # to one path per frame.
+                pattern = sequence.compact(collection)
+
+                if pattern is not None:
+                    self.log.info("Sequence: %s" % sequence.format(pattern))
+                    output = dict(pattern, dirname=dirname)
+                else:
+                    output = [os.path.join(dirname, fname)
+                              for fname in collection]
 
             else:
                 # Single file
@@ -229,16 +278,19 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
                 src = os.path.join(stagingdir, fname)
                 dst = template_publish.format(**template_data)
 
-                copy(src, dst)
+                transfers.append((src, dst))
+                owners.append(len(representations))
 
-                instance.data["output"].append(dst)
+                pattern = None
+                output = [dst]
 
-            representation = {
+            outputs.append(output)
+            representations.append({
                 "schema": "avalon-core:representation-2.0",
                 "type": "representation",
                 "parent": version_id,
                 "name": template_data["representation"],
-                "data": {},
+                "data": {"sequence": pattern} if pattern else {},
                 "dependencies": instance.data.get("dependencies", "").split(),
 
                 # Imprint shortcut to context for performance reasons.
@@ -250,11 +302,129 @@ class IntegrateAvalonAsset(pyblish.api.InstancePlugin):
                     "version": version["name"],
                     "representation": template_data["representation"]
                 }
-            }
+            })
+
+        for representation in representations:
+            buffer.insert(representation)
 
-            io.insert_one(representation)
+        journal.record_documents(
+            [version_id] + [doc["_id"] for doc in representations]
+        )
 
+        # Discarded once written, see IntegrateAvalonFlush
+        instance.data["journal"] = journal.path
+        instance.data["versionId"] = str(version_id)
         context.data["published_version"] = str(version_id)
 
+        for output in outputs:
+            if isinstance(output, dict):
+                instance.data["output"].append(output)
+            else:
+                instance.data["output"].extend(output)
+
+        if background:
+            # Enqueued once documents are written, see IntegrateAvalonFlush
+            instance.data["backgroundJob"] = {
+                "project": PROJECT,
+                "version": str(version_id),
+                "family": instance.data["family"],
+                "renders": renders,
+                "transfers": [
+                    [src, dst, str(representations[owner]["_id"])]
+                    for (src, dst), owner in zip(transfers, owners)
+                ],
+                "blobstore": store.BlobStore.from_project(
+                    api.registered_root(), PROJECT).root
+                if store.enabled() else None,
+                "output": instance.data["output"],
+                "upload": bool(api.Session.get("AVALON_UPLOAD")),
+
+                # Metadata of render layer, see anvil.checksums
+                "checksums": os.path.splitext(
+                    instance.data["metadataPath"])[0]
+                if "metadataPath" in instance.data else None,
+                "root": api.registered_root(),
+                "location": LOCATION,
+            }
+
+            journal.close()
+
+            return self.log.info("Transferring %d file(s) in the background"
+                                 % len(transfers))
+
+        for _, dst in transfers:
+            buffer.wrote(dst)
+
+        # Created once per publish, rather than once per file
+        directories = transfer.directories(context)
+
+        function = functools.partial(transfer.copy, directories=directories)
+        if store.enabled():
+            blobs = store.BlobStore.from_project(api.registered_root(),
+                                                 PROJECT,
+                                                 directories)
+            self.log.info("Deduplicating through %s" % blobs.root)
+            function = blobs.put
+
+        elif instance.data.get("checksums"):
+            # Hashed as linked, or as copied where it can't link
+            function = functools.partial(transfer.copy,
+                                         directories=directories,
+                                         hashed=True)
+
+        if instance.data.get("checksums"):
+            self.log.info("Verifying %d file(s) against checksums "
+                          "written at render time"
+                          % len(instance.data["checksums"]))
+            function = checksums.verified(function,
+                                          instance.data["checksums"])
+
+        def journaled(src, dst, function=function):
+            result = function(src, dst)
+            journal.record_transfer(dict(result,
+                                         src=src,
+                                         dst=dst,
+                                         size=os.path.getsize(dst)))
+            return result
+
+        # Skip files transferred prior to an interruption
+        results = [journal.completed(src, dst) for src, dst in transfers]
+        pending = [pair for pair, result in zip(transfers, results)
+                   if result is None]
+
+        if len(pending) < len(transfers):
+            self.log.info("%d of %d file(s) already transferred" % (
+                len(transfers) - len(pending), len(transfers)))
+
+        self.log.info("Transferring %d file(s).." % len(pending))
+        transferred, stats = transfer.transfer(pending, function=journaled)
+
+        transferred = iter(transferred)
+        results = [result or next(transferred) for result in results]
+
+        # Summarised, as opposed to one message per file
+        methods = dict()
+
+        for owner, result in zip(owners, results):
+            methods[result["method"]] = methods.get(result["method"], 0) + 1
+
+            if "hash" in result:
+                data = representations[owner]["data"]
+                data.setdefault("hashes", dict())[
+                    os.path.basename(result["dst"])] = result["hash"]
+
+                # Spares the uploader from hashing anew
+                instance.data.setdefault("hashes", dict())[
+                    result["dst"]] = result["hash"]
+
+        self.log.info("Transferred %s" % transfer.format_rate(stats))
+        self.log.info("Methods used: %s" % ", ".join(
+            "%s (%d)" % (method, methods[method])
+            for method in sorted(methods)))
+
+        journal.close()
+
+        self.log.debug("Document cache: %s" % cache)
+
         self.log.info("Successfully integrated \"%s\" to \"%s\"" % (
             instance, dst))
@@ -0,0 +1,49 @@
+import pyblish.api
+
+
+class IntegrateAvalonFlush(pyblish.api.ContextPlugin):
+    """Write versions and representations of all instances at once
+
+    Documents are buffered by IntegrateAvalonAsset and written here,
+    in a single ordered batch. Should any instance have failed to
+    integrate, nothing is written and partial results are removed.
+
+    """
+
+    label = "Write to Database"
+    order = pyblish.api.IntegratorOrder + 0.05
+
+    def process(self, context):
+        from anvil import database, worker
+        from anvil.journal import Journal
+
+        if "writeBuffer" not in context.data:
+            return self.log.info("Nothing to write")
+
+        buffer = database.write_buffer(context)
+
+        if not all(result["success"] for result in context.data["results"]):
+            buffer.rollback()
+            raise Exception("Integration failed, changes were rolled back")
+
+        count = buffer.flush()
+        self.log.info("Wrote %d document(s)" % count)
+
+        for instance in context:
+            if "journal" in instance.data:
+                Journal(instance.data["journal"]).commit()
+
+        # Files of versions now written are
+        # transferred in the background.
+        jobs = [instance.data["backgroundJob"] for instance in context
+                if "backgroundJob" in instance.data]
+
+        for job in jobs:
+            self.log.info("Queued %s" % worker.enqueue(job))
+
+        if jobs:
+            worker.spawn()
+
+        if "documentCache" in context.data:
+            self.log.info("Document cache: %s"
+                          % database.document_cache(context))
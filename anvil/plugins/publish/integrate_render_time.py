@@ -0,0 +1,61 @@
+import pyblish.api
+
+
+class IntegrateAvaRenderTime(pyblish.api.InstancePlugin):
+    """Store time spent rendering, for planning later submissions
+
+    Written to the metadata of each render layer found rendered by
+    ValidateAvaDeadlineDone, see :func:`anvil.deadline.plan`
+
+    """
+
+    label = "Record Render Time"
+    order = pyblish.api.IntegratorOrder + 0.2
+    hosts = ["shell"]
+    families = ["anvil.imagesequence"]
+
+    def process(self, instance):
+        if not instance.data.get("rendered"):
+            return self.log.info("%s is rendering, skipping" % instance)
+
+        try:
+            self.record_render_time(instance)
+        except Exception as e:
+            # This is nice-to-have, but not critical to the operation
+            self.log.warning("Could not record render time: %s" % e)
+
+    def record_render_time(self, instance):
+        import os
+        import json
+        import tempfile
+
+        from avalon import api
+        from anvil import deadline
+
+        metadata = instance.data["metadata"]
+        if "renderTime" in metadata:
+            return
+
+        url = api.Session["AVALON_DEADLINE"]
+
+        tasks = list()
+        for job in metadata["jobs"]:
+            tasks.extend(deadline.tasks(url, job["_id"]))
+
+        metadata["renderTime"] = deadline.render_time(tasks)
+
+        # Written elsewhere first, such that submissions
+        # never read partially written metadata.
+        path = instance.data["metadataPath"]
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(metadata, f, sort_keys=True, separators=(",", ":"))
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Windows refuses to replace existing files
+            os.remove(path)
+            os.rename(tmp, path)
+
+        self.log.info("Recorded render time of %s" % instance)
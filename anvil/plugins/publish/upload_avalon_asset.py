@@ -29,36 +29,32 @@ class UploadAvalonAsset(api.InstancePlugin):
 
     def process(self, instance):
         from avalon import api
-        from avalon.vendor import requests
+        from anvil import sequence, upload, scheduler
+
+        if "backgroundJob" in instance.data:
+            return self.log.info("Uploading in the background")
 
         # Dependencies
         AVALON_LOCATION = api.Session["AVALON_LOCATION"]
-        AVALON_USERNAME = api.Session["AVALON_USERNAME"]
-        AVALON_PASSWORD = api.Session["AVALON_PASSWORD"]
-
-        for src in instance.data["output"]:
-            assert src.startswith(api.registered_root()), (
-                "Output didn't reside on root, this is a bug"
-            )
 
-            dst = src.replace(
-                api.registered_root(),
-                AVALON_LOCATION + "/upload"
-            ).replace("\\", "/")
+        if scheduler.enabled():
+            path = scheduler.enqueue(instance.data["output"],
+                                     family=instance.data["family"],
+                                     root=api.registered_root(),
+                                     location=AVALON_LOCATION,
+                                     version=instance.data["versionId"],
+                                     hashes=instance.data.get("hashes"))
+            scheduler.spawn()
 
-            self.log.info("Uploading %s -> %s" % (src, dst))
+            return self.log.info("Scheduled upload: %s" % path)
 
-            auth = requests.auth.HTTPBasicAuth(
-                AVALON_USERNAME, AVALON_PASSWORD
-            )
-
-            with open(src) as f:
-                response = requests.put(
-                    dst,
-                    data=f,
-                    auth=auth,
-                    headers={"Content-Type": "application/octet-stream"}
-                )
+        AVALON_USERNAME = api.Session["AVALON_USERNAME"]
+        AVALON_PASSWORD = api.Session["AVALON_PASSWORD"]
 
-                if not response.ok:
-                    raise Exception(response.text)
+        upload.upload(sequence.iter_outputs(instance.data["output"]),
+                      root=api.registered_root(),
+                      location=AVALON_LOCATION,
+                      username=AVALON_USERNAME,
+                      password=AVALON_PASSWORD,
+                      hashes=instance.data.get("hashes"),
+                      log=self.log)
@@ -2,7 +2,13 @@ import pyblish.api
 
 
 class ValidateAvaDeadlineDone(pyblish.api.InstancePlugin):
-    """Ensure render is finished before publishing the resulting images"""
+    """Ensure render is finished before publishing the resulting images
+
+    With AVALON_DEADLINE_WAIT set, wait for renders to finish for up
+    to that many seconds, or indefinitely if 0. With
+    AVALON_PUBLISH_PROGRESSIVE set, renders still in progress pass.
+
+    """
 
     label = "Rendered Successfully"
     order = pyblish.api.ValidatorOrder
@@ -12,52 +18,68 @@ class ValidateAvaDeadlineDone(pyblish.api.InstancePlugin):
 
     def process(self, instance):
         from avalon import api
-        from avalon.vendor import requests
-
-        # From Deadline documentation
-        # https://docs.thinkboxsoftware.com/products/deadline/8.0/
-        # 1_User%20Manual/manual/rest-jobs.html#job-property-values
-        states = {
-            0: "Unknown",
-            1: "Active",
-            2: "Suspended",
-            3: "Completed",
-            4: "Failed",
-            6: "Pending",
-        }
+        from anvil import deadline, progressive
 
         assert "AVALON_DEADLINE" in api.Session, ("Environment variable "
                                                   "missing: 'AVALON_DEADLINE")
         AVALON_DEADLINE = api.Session["AVALON_DEADLINE"]
-        url = "{}/api/jobs?JobID=%s".format(AVALON_DEADLINE)
 
-        for job in instance.data["metadata"]["jobs"]:
-            response = requests.get(url % job["_id"])
+        # Shared by every instance, such that jobs of all
+        # renders are queried together, rather than one by one.
+        status = deadline.job_status(instance.context, AVALON_DEADLINE)
+
+        context_ids = [
+            job["_id"]
+            for other in instance.context
+            if "metadata" in other.data
+            for job in other.data["metadata"]["jobs"]
+        ]
+
+        ids = [job["_id"] for job in instance.data["metadata"]["jobs"]]
+
+        # For automated publishing, once rendered
+        timeout = deadline.wait_timeout()
+        if timeout is not None:
+            jobs = status.wait(context_ids, timeout=timeout or None,
+                               log=self.log)
+        else:
+            jobs = status.get(context_ids)
+
+        # Published while rendering, see anvil.progressive
+        rendering = progressive.enabled()
+        states = list()
+
+        for _id in ids:
+            assert _id in jobs, ValueError("Can't find information about "
+                                           "this Deadline job: "
+                                           "{}".format(_id))
+
+            state = deadline.state(jobs[_id])
+            states.append(state)
+
+            if rendering and state in ("Active", "Pending"):
+                continue
+
+            if state == "Unknown":
+                raise Exception("State of this render is unknown")
 
-            if response.ok:
-                data = response.json()
-                assert data, ValueError("Can't find information about "
-                                        "this Deadline job: "
-                                        "{}".format(job["_id"]))
+            elif state == "Active":
+                raise Exception("This render is still currently active")
 
-                state = states.get(data[0]["Stat"])
-                if state in (None, "Unknown"):
-                    raise Exception("State of this render is unknown")
+            elif state == "Suspended":
+                raise Exception("This render is suspended")
 
-                elif state == "Active":
-                    raise Exception("This render is still currently active")
+            elif state == "Failed":
+                raise Exception("This render was not successful")
 
-                elif state == "Suspended":
-                    raise Exception("This render is suspended")
+            elif state == "Pending":
+                raise Exception("This render is pending")
 
-                elif state == "Failed":
-                    raise Exception("This render was not successful")
+        if any(state != "Completed" for state in states):
+            return self.log.info("%s is rendering, and published "
+                                 "progressively" % instance)
 
-                elif state == "Pending":
-                    raise Exception("This render is pending")
-                else:
-                    self.log.info("%s was rendered successfully" % instance)
+        self.log.info("%s was rendered successfully" % instance)
 
-            else:
-                raise Exception("Could not determine the current status "
-                                " of this render")
+        # Render time is recorded once integrated, see IntegrateAvaRenderTime
+        instance.data["rendered"] = True
@@ -0,0 +1,48 @@
+import pyblish.api
+
+
+class ValidateAvaImageIntegrity(pyblish.api.InstancePlugin):
+    """Ensure no rendered image is empty or truncated
+
+    Headers of every frame are probed in a pool of processes, see
+    :mod:`anvil.probe`. Frames of unusual size are reported as
+    warnings, as some, such as black frames, are legitimately small.
+
+    """
+
+    label = "Image Integrity"
+    order = pyblish.api.ValidatorOrder
+    hosts = ["shell"]
+    families = ["anvil.imagesequence"]
+
+    def process(self, instance):
+        import os
+
+        from anvil import probe, progressive
+
+        stagingdir = instance.data["stagingDir"]
+        paths = [os.path.join(stagingdir, fname)
+                 for fname in instance.data["files"][0]]
+
+        results = probe.probe_all(paths)
+
+        if progressive.enabled():
+            # Frames yet to be rendered
+            results = [result for result in results
+                       if result["error"] != "Missing"]
+
+        for index in probe.outliers([result["size"]
+                                     for result in results]):
+            self.log.warning("%s is of unusual size: %d bytes"
+                             % (results[index]["path"],
+                                results[index]["size"]))
+
+        errors = [result for result in results
+                  if result["error"] is not None]
+
+        for result in errors:
+            self.log.error("%s: %s" % (os.path.basename(result["path"]),
+                                       result["error"]))
+
+        assert not errors, ("%d of %d frame(s) of %s are damaged"
+                            % (len(errors), len(results), instance))
@@ -0,0 +1,58 @@
+import pyblish.api
+
+
+class ValidateAvaSequenceFrames(pyblish.api.InstancePlugin):
+    """Ensure every frame of the submitted frame range was rendered
+
+    Frames rendered at differing padding count as duplicates. With
+    AVALON_PUBLISH_PROGRESSIVE set, frames yet to be rendered pass.
+
+    """
+
+    label = "Frames Complete"
+    order = pyblish.api.ValidatorOrder
+    hosts = ["shell"]
+    families = ["anvil.imagesequence"]
+
+    def process(self, instance):
+        from anvil import progressive, scan, sequence
+
+        try:
+            start = int(instance.data["startFrame"])
+            end = int(instance.data["endFrame"])
+            step = int(instance.data.get("byFrameStep", 1))
+        except KeyError:
+            return self.log.warning("No frame range submitted with %s, "
+                                    "skipping" % instance)
+
+        collection = instance.data["files"][0]
+        pattern = sequence.compact(collection[:1])
+
+        # As found on disk, including sequences of other padding
+        collections, _ = scan.scan(instance.data["stagingDir"])
+        frames = [
+            index
+            for other in collections
+            if other.head == pattern["head"] and
+            other.tail == pattern["tail"]
+            for index in other.indexes
+        ]
+
+        found = sequence.discrepancies(frames, start, end, step)
+
+        if progressive.enabled():
+            found["missing"] = []
+
+        errors = [
+            "%s: %s" % (label, sequence.format_ranges(found[key]))
+            for key, label in (("missing", "Missing"),
+                               ("duplicate", "Duplicate"),
+                               ("outOfRange", "Out of range"))
+            if found[key]
+        ]
+
+        for error in errors:
+            self.log.error(error)
+
+        assert not errors, ("%s does not match frames %d-%dx%d"
+                            % (instance, start, end, step))
@@ -0,0 +1,457 @@
+"""Integrity of rendered images, from their size and header alone
+
+Each file is probed by a pool of processes, reading no more than its
+header and, for OpenEXR, its table of chunk offsets. Truncated and
+empty files, such as those left behind by a crashed render task, are
+found without reading or decoding any pixels.
+
+    $ python -m anvil.probe /path/to/renders/scene/beauty
+
+Sizes of a sequence are additionally compared with each other, as
+frames far smaller or larger than the rest hint at a partial render.
+
+"""
+
+import os
+import sys
+import struct
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+# Number of simultaneous probes, unless otherwise specified
+# via the AVALON_PROBE_WORKERS environment variable.
+DEFAULT_WORKERS = 8
+
+# Frames per task handed to each process
+CHUNK_SIZE = 64
+
+# Deviations from the median size beyond which a frame is an outlier,
+# in units of the median absolute deviation.
+THRESHOLD = 6.0
+
+EXR_MAGIC = b"\x76\x2f\x31\x01"
+
+# Flags of the version field of an OpenEXR file
+EXR_TILED = 0x200
+EXR_DEEP = 0x800
+EXR_MULTIPART = 0x1000
+
+# Scanlines per chunk, per compression
+EXR_LINES = {
+    0: 1,    # NONE
+    1: 1,    # RLE
+    2: 1,    # ZIPS
+    3: 16,   # ZIP
+    4: 32,   # PIZ
+    5: 16,   # PXR24
+    6: 32,   # B44
+    7: 32,   # B44A
+    8: 32,   # DWAA
+    9: 256,  # DWAB
+}
+
+
+class ProbeError(Exception):
+    """File is damaged or truncated"""
+
+
+def max_workers():
+    """Return configured number of concurrent probes"""
+    try:
+        count = int(os.getenv("AVALON_PROBE_WORKERS", DEFAULT_WORKERS))
+    except ValueError:
+        count = DEFAULT_WORKERS
+
+    return max(1, count)
+
+
+def _exr_attributes(f, size):
+    """Return attributes of one header of an EXR, read from `f`"""
+
+    attributes = dict()
+
+    while True:
+        name = _exr_string(f)
+        if not name:
+            return attributes
+
+        type_ = _exr_string(f)
+
+        length, = struct.unpack("<i", _read(f, 4))
+
+        if length < 0 or f.tell() + length > size:
+            raise ProbeError("Header attribute '%s' out of bounds" % name)
+
+        value = _read(f, length)
+
+        if type_ == "box2i":
+            attributes[name] = struct.unpack("<4i", value)
+        elif type_ == "compression":
+            attributes[name] = ord(value[:1])
+        elif type_ == "tiledesc":
+            attributes[name] = struct.unpack("<IIB", value)
+        elif type_ == "int":
+            attributes[name] = struct.unpack("<i", value)[0]
+        elif type_ == "string":
+            attributes[name] = value.decode("utf-8", "replace")
+
+
+def _exr_string(f):
+    chars = list()
+    while True:
+        char = _read(f, 1)
+        if char == b"\x00":
+            return b"".join(chars).decode("utf-8", "replace")
+
+        chars.append(char)
+        if len(chars) > 255:
+            raise ProbeError("Header attribute name too long")
+
+
+def _read(f, size, message="Truncated header"):
+    data = f.read(size)
+    if len(data) != size:
+        raise ProbeError(message)
+    return data
+
+
+def _ceil(a, b):
+    return -(-a // b)
+
+
+def _exr_levels(size, rounding):
+    """Return number of mipmap levels of an edge of `size` pixels"""
+    levels, value = 1, size
+    while value > 1:
+        value = _ceil(value, 2) if rounding else value // 2
+        levels += 1
+
+    return levels
+
+
+def _exr_chunks(attributes, tiled):
+    """Return number of chunks of a part with `attributes`"""
+
+    if "chunkCount" in attributes:
+        return attributes["chunkCount"]
+
+    if "dataWindow" not in attributes:
+        raise ProbeError("Missing dataWindow")
+
+    xmin, ymin, xmax, ymax = attributes["dataWindow"]
+    width, height = xmax - xmin + 1, ymax - ymin + 1
+
+    if width < 1 or height < 1:
+        raise ProbeError("Invalid data window")
+
+    if not tiled:
+        lines = EXR_LINES.get(attributes.get("compression", 0))
+        if lines is None:
+            raise ProbeError("Unknown compression")
+
+        return _ceil(height, lines)
+
+    if "tiles" not in attributes:
+        raise ProbeError("Missing tiles")
+
+    tile_x, tile_y, mode = attributes["tiles"]
+    level_mode, rounding = mode & 0xf, mode >> 4
+
+    if not (tile_x and tile_y) or level_mode > 2:
+        raise ProbeError("Invalid tile description")
+
+    def level_size(size, level):
+        divisor = 2 ** level
+        size = _ceil(size, divisor) if rounding else size // divisor
+        return max(size, 1)
+
+    if level_mode == 1:
+        # Mipmap, one level per halving of the larger dimension
+        levels = _exr_levels(max(width, height), rounding)
+        return sum(
+            _ceil(level_size(width, level), tile_x) *
+            _ceil(level_size(height, level), tile_y)
+            for level in range(levels)
+        )
+
+    # One level, or ripmap of each halving of either dimension
+    levels_x = _exr_levels(width, rounding) if level_mode else 1
+    levels_y = _exr_levels(height, rounding) if level_mode else 1
+
+    return sum(
+        _ceil(level_size(width, x), tile_x) *
+        _ceil(level_size(height, y), tile_y)
+        for x in range(levels_x)
+        for y in range(levels_y)
+    )
+
+
+def probe_exr(f, size):
+    """Verify header and offsets of an OpenEXR file `f` of `size` bytes
+
+    Raises:
+        ProbeError, on a file damaged or truncated
+
+    """
+
+    if _read(f, 4) != EXR_MAGIC:
+        raise ProbeError("Not an OpenEXR file")
+
+    version, = struct.unpack("<I", _read(f, 4))
+    tiled = bool(version & EXR_TILED)
+    deep = bool(version & EXR_DEEP)
+    multipart = bool(version & EXR_MULTIPART)
+
+    parts = list()
+    while True:
+        attributes = _exr_attributes(f, size)
+
+        if not attributes:
+            # Empty header, terminating those of a multi-part file
+            break
+
+        parts.append(attributes)
+
+        if not multipart:
+            break
+
+    if not parts:
+        raise ProbeError("No parts")
+
+    chunks = 0
+    for attributes in parts:
+        part_tiled = tiled or "tiled" in attributes.get("type", "")
+        chunks += _exr_chunks(attributes, part_tiled)
+
+    table = f.tell()
+    end = table + chunks * 8
+
+    if end > size:
+        raise ProbeError("Truncated offset table")
+
+    f.seek(table)
+    offsets = struct.unpack("<%dQ" % chunks, f.read(chunks * 8))
+
+    if any(offset < end or offset >= size for offset in offsets):
+        raise ProbeError("Chunk offset out of bounds, file is "
+                         "likely truncated")
+
+    if not offsets:
+        return
+
+    # The last chunk must fit within the file
+    last = max(offsets)
+    f.seek(last)
+
+    attributes = parts[0]
+    if multipart:
+        part, = struct.unpack("<i", _read(f, 4, "Truncated chunk"))
+
+        if not 0 <= part < len(parts):
+            raise ProbeError("Chunk of unknown part")
+
+        attributes = parts[part]
+
+    type_ = attributes.get("type", "")
+    if deep or "deep" in type_:
+        # Chunks of deep data are laid out differently
+        return
+
+    # Coordinates of tile, or first scanline
+    f.seek(16 if tiled or "tiled" in type_ else 4, os.SEEK_CUR)
+
+    length, = struct.unpack("<i", _read(f, 4, "Truncated chunk"))
+    if length < 0 or f.tell() + length > size:
+        raise ProbeError("Truncated chunk")
+
+
+def probe_png(f, size):
+    if f.read(8) != b"\x89PNG\r\n\x1a\n":
+        raise ProbeError("Not a PNG file")
+
+    f.seek(max(size - 12, 0))
+    if f.read(12)[4:8] != b"IEND":
+        raise ProbeError("Truncated, missing IEND")
+
+
+def probe_jpeg(f, size):
+    if f.read(2) != b"\xff\xd8":
+        raise ProbeError("Not a JPEG file")
+
+    f.seek(max(size - 2, 0))
+    if f.read(2) != b"\xff\xd9":
+        raise ProbeError("Truncated, missing end of image")
+
+
+def probe_tiff(f, size):
+    if f.read(4) not in (b"II*\x00", b"MM\x00*"):
+        raise ProbeError("Not a TIFF file")
+
+
+PROBES = {
+    ".exr": probe_exr,
+    ".png": probe_png,
+    ".jpg": probe_jpeg,
+    ".jpeg": probe_jpeg,
+    ".tif": probe_tiff,
+    ".tiff": probe_tiff,
+}
+
+
+def probe(path):
+    """Return size of `path` and what, if anything, is wrong with it
+
+    Importable, such that it may be run in another process.
+
+    Returns:
+        result (dict): "path", "size" and "error", the
+            latter None for files found intact
+
+    """
+
+    result = {"path": path, "size": 0, "error": None}
+
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        result["error"] = "Missing"
+        return result
+
+    result["size"] = size
+
+    if size == 0:
+        result["error"] = "Empty"
+        return result
+
+    function = PROBES.get(os.path.splitext(path)[1].lower())
+    if function is None:
+        return result
+
+    try:
+        with open(path, "rb") as f:
+            function(f, size)
+
+    except ProbeError as e:
+        result["error"] = str(e)
+
+    except (IOError, OSError, struct.error) as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+
+    return result
+
+
+def probe_all(paths, workers=None):
+    """Probe each of `paths` concurrently, in a pool of processes
+
+    Arguments:
+        paths (list): Absolute paths to files
+        workers (int, optional): Maximum number of processes,
+            defaults to :func:`max_workers`
+
+    Returns:
+        results (list): One dictionary per path, in order, see :func:`probe`
+
+    """
+
+    import multiprocessing
+
+    paths = list(paths)
+    workers = min(workers or max_workers(),
+                  _ceil(len(paths), CHUNK_SIZE)) or 1
+
+    if workers == 1:
+        # Not worth the processes
+        return [probe(path) for path in paths]
+
+    if sys.platform == "win32":
+        # Processes are started anew, with mayapy in place of maya
+        from . import worker
+        multiprocessing.set_executable(worker._python())
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(probe, paths, chunksize=CHUNK_SIZE)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def outliers(sizes, threshold=THRESHOLD):
+    """Return indexes of `sizes` far from the median of all sizes
+
+    Deviation is measured in median absolute deviations, such that a
+    handful of outliers don't affect what is considered typical.
+
+    Example:
+        >>> outliers([100, 101, 99, 100, 102, 3, 100])
+        [5]
+
+    """
+
+    if len(sizes) < 3:
+        return []
+
+    if numpy is not None:
+        sizes = numpy.asarray(sizes, dtype=numpy.float64)
+        median = numpy.median(sizes)
+        deviations = numpy.abs(sizes - median)
+        mad = max(numpy.median(deviations), 1.0, median * 0.001)
+        return numpy.flatnonzero(deviations / mad > threshold).tolist()
+
+    def median_of(values):
+        values = sorted(values)
+        middle = len(values) // 2
+        if len(values) % 2:
+            return float(values[middle])
+        return (values[middle - 1] + values[middle]) / 2.0
+
+    median = median_of(sizes)
+    deviations = [abs(size - median) for size in sizes]
+    mad = max(median_of(deviations), 1.0, median * 0.001)
+
+    return [index for index, deviation in enumerate(deviations)
+            if deviation / mad > threshold]
+
+
+def _main():
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m anvil.probe")
+    parser.add_argument("paths", nargs="+",
+                        help="Files, or directories of files")
+    parser.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args()
+
+    paths = list()
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, name)
+                         for name in sorted(os.listdir(path)))
+        else:
+            paths.append(path)
+
+    started = time.time()
+    results = probe_all(paths, args.workers)
+    elapsed = time.time() - started
+
+    for result in results:
+        if result["error"] is not None:
+            print("%s: %s" % (result["path"], result["error"]))
+
+    for index in outliers([result["size"] for result in results]):
+        print("%s: Outlier of %d bytes" % (results[index]["path"],
+                                           results[index]["size"]))
+
+    print("Probed %d file(s) in %.2fs" % (len(results), elapsed))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,179 @@
+"""Integrate renders as they are rendered
+
+With AVALON_PUBLISH_PROGRESSIVE set, image sequences may be published
+from the shell as soon as the first frames of a render have landed,
+rather than once the render has finished.
+
+Frames not yet rendered are collected from the frame range of the
+submission, and the version is written as "pending" like any other
+integrated in the background, see :mod:`anvil.worker`. The worker then
+transfers frames of each Deadline task as it completes, checking every
+AVALON_PROGRESSIVE_INTERVAL seconds, and completes the version once the
+render has finished. Publishing at the end of a render is then limited
+to the last few frames.
+
+"""
+
+import os
+import logging
+
+from . import deadline, sequence, transfer
+
+log = logging.getLogger(__name__)
+
+# Seconds between checking on renders, unless otherwise
+# specified via the AVALON_PROGRESSIVE_INTERVAL environment variable.
+DEFAULT_INTERVAL = 30.0
+
+
+def enabled():
+    """Return whether renders should be published progressively"""
+    return bool(os.getenv("AVALON_PUBLISH_PROGRESSIVE"))
+
+
+def interval():
+    """Return configured seconds between checking on renders"""
+    try:
+        seconds = float(os.getenv("AVALON_PROGRESSIVE_INTERVAL",
+                                  DEFAULT_INTERVAL))
+    except ValueError:
+        seconds = DEFAULT_INTERVAL
+
+    return max(1.0, seconds)
+
+
+def renders(instance, url):
+    """Return Deadline jobs rendering `instance`, or None
+
+    Arguments:
+        instance (pyblish.api.Instance): Collected image sequence
+        url (str): Address of Web Service, e.g. AVALON_DEADLINE
+
+    """
+
+    metadata = instance.data.get("metadata")
+    if not metadata:
+        return None
+
+    return {
+        "url": url,
+        "jobs": [job["_id"] for job in metadata["jobs"]],
+    }
+
+
+def frame_of(name, patterns):
+    """Return frame number of file `name` of any of `patterns`, or None
+
+    Example:
+        >>> pattern = {"head": "a.", "padding": 4, "tail": ".exr"}
+        >>> frame_of("a.0012.exr", [pattern])
+        12
+        >>> frame_of("b.exr", [pattern]) is None
+        True
+
+    """
+
+    for pattern in patterns:
+        head, tail = pattern["head"], pattern["tail"]
+
+        if not (name.startswith(head) and name.endswith(tail)):
+            continue
+
+        try:
+            return int(name[len(head):len(name) - len(tail)])
+        except ValueError:
+            continue
+
+    return None
+
+
+class RenderError(Exception):
+    """Render will not finish by itself"""
+
+
+def rendered(url, jobs):
+    """Return frames rendered thus far, and whether rendering has finished
+
+    Raises:
+        RenderError, should any job have failed, been suspended or
+            deleted, such that the version is failed rather than
+            waited upon indefinitely
+
+    """
+
+    status = deadline.JobStatus(url, ttl=0)
+    found = status.get(jobs)
+    status.close()
+
+    for _id in jobs:
+        if _id not in found:
+            raise RenderError("Render job %s no longer exists" % _id)
+
+        state = deadline.state(found[_id])
+        if state in ("Failed", "Suspended", "Unknown"):
+            raise RenderError("Render job %s is %s, not all frames "
+                              "were rendered" % (_id, state.lower()))
+
+    states = [deadline.state(found[_id]) for _id in jobs]
+
+    frames = set()
+    for job in jobs:
+        for task in deadline.tasks(url, job):
+            if task["Stat"] == deadline.TASK_COMPLETED:
+                frames.update(deadline.iter_frames(task["Frames"]))
+
+    finished = all(state == "Completed" for state in states)
+
+    return frames, finished
+
+
+def integrate(job, function, log=log):
+    """Transfer files of `job` rendered since last time
+
+    Indexes of transfers done are stored in job["done"], as ranges,
+    such that the job may be passed again once more has been rendered.
+    Files other than frames are transferred once rendering has finished.
+
+    Arguments:
+        job (dict): Queued job, see :func:`anvil.worker.enqueue`
+        function (callable): Transfer function, see :func:`transfer.transfer`
+
+    Returns:
+        results (list): (transfer, result) per file transferred
+        finished (bool): Whether every file has been transferred
+
+    """
+
+    frames, finished = rendered(job["renders"]["url"],
+                                job["renders"]["jobs"])
+
+    patterns = [output for output in job["output"]
+                if isinstance(output, dict)]
+
+    done = set(sequence.iter_indexes({"indexes": job.get("done", [])}))
+
+    ready = [
+        index for index, (_, dst, _) in enumerate(job["transfers"])
+        if index not in done and (
+            finished or
+            frame_of(os.path.basename(dst), patterns) in frames
+        )
+    ]
+
+    transfers = [job["transfers"][index] for index in ready]
+    results, stats = transfer.transfer(
+        [(src, dst) for src, dst, _ in transfers],
+        function=function
+    )
+
+    if ready:
+        log.info("Transferred %s" % transfer.format_rate(stats))
+
+    done.update(ready)
+    job["done"] = sequence.ranges(done)
+
+    log.info("%d of %d file(s) transferred, rendering %s"
+             % (len(done), len(job["transfers"]),
+                "finished" if finished else "in progress"))
+
+    return list(zip(transfers, results)), finished
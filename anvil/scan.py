@@ -0,0 +1,210 @@
+"""Scanning of render directories
+
+Each render layer directory of a workspace is listed by a bounded
+pool of threads, and its files assembled into sequences. Listings
+are kept for the remainder of the session, and reused for as long
+as the modification time of their directory is unchanged, such that
+collecting anew only lists directories that have since changed.
+
+    $ python -m anvil.scan /path/to/workspace/renders/scene
+
+"""
+
+import os
+import time
+import logging
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    # Python 2, provided by the scandir package
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+log = logging.getLogger(__name__)
+
+# Number of simultaneous listings, unless otherwise specified
+# via the AVALON_SCAN_WORKERS environment variable.
+DEFAULT_WORKERS = 16
+
+# Seconds within which a modification time is too recent to be
+# trusted, as files may be added within its resolution.
+SETTLE = 2.0
+
+# Listings per directory, as path -> (mtime, collections, remainder)
+_index = dict()
+_lock = threading.Lock()
+
+
+def max_workers():
+    """Return configured number of concurrent listings"""
+    try:
+        count = int(os.getenv("AVALON_SCAN_WORKERS", DEFAULT_WORKERS))
+    except ValueError:
+        count = DEFAULT_WORKERS
+
+    return max(1, count)
+
+
+def listdir(dirname):
+    """Return names of files and directories in `dirname`
+
+    Hidden files and directories, starting with a dot, are excluded.
+
+    Returns:
+        files (list): Names of files, sorted
+        dirs (list): Names of directories, sorted
+
+    """
+
+    files, dirs = list(), list()
+
+    if scandir is None:
+        for name in os.listdir(dirname):
+            if name.startswith("."):
+                continue
+
+            isdir = os.path.isdir(os.path.join(dirname, name))
+            (dirs if isdir else files).append(name)
+
+    else:
+        for entry in scandir(dirname):
+            if entry.name.startswith("."):
+                continue
+
+            (dirs if entry.is_dir() else files).append(entry.name)
+
+    return sorted(files), sorted(dirs)
+
+
+def _copy(collections):
+    from avalon.vendor import clique
+
+    return [
+        clique.Collection(collection.head,
+                          collection.tail,
+                          collection.padding,
+                          indexes=set(collection.indexes))
+        for collection in collections
+    ]
+
+
+def scan(dirname):
+    """Return sequences of files in `dirname`, listed only if changed
+
+    Collections are copies, and may be modified by the caller.
+
+    Returns:
+        collections (list): clique.Collection per sequence
+        remainder (list): Names of files not part of any sequence
+
+    """
+
+    from avalon.vendor import clique
+
+    mtime = os.stat(dirname).st_mtime
+
+    with _lock:
+        cached = _index.get(dirname)
+
+    if cached is not None and cached[0] == mtime:
+        _, collections, remainder = cached
+        return _copy(collections), list(remainder)
+
+    names, _ = listdir(dirname)
+    collections, remainder = clique.assemble(names, minimum_items=1)
+
+    if time.time() - mtime > SETTLE:
+        with _lock:
+            _index[dirname] = (mtime, collections, remainder)
+
+    return _copy(collections), list(remainder)
+
+
+def _scan_one(dirname):
+    try:
+        return scan(dirname) + (None,)
+    except Exception as e:
+        return None, None, "%s: %s" % (type(e).__name__, e)
+
+
+def scan_layers(workspace, workers=None, log=log):
+    """Return sequences of each layer directory in `workspace`, concurrently
+
+    Arguments:
+        workspace (str): Absolute path to renders of a scene
+        workers (int, optional): Maximum number of simultaneous
+            listings, defaults to :func:`max_workers`
+
+    Returns:
+        layers (list): (layer, collections, remainder) per
+            directory, sorted by name
+
+    Raises:
+        OSError, on any directory failing to be listed
+
+    """
+
+    _, layers = listdir(workspace)
+
+    workers = min(workers or max_workers(), len(layers)) or 1
+    started = time.time()
+
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(_scan_one, [os.path.join(workspace, layer)
+                                       for layer in layers])
+    finally:
+        pool.close()
+        pool.join()
+
+    errors = [(layer, error)
+              for layer, (_, _, error) in zip(layers, results)
+              if error is not None]
+
+    if errors:
+        raise OSError("%d director(ies) failed to scan:\n%s" % (
+            len(errors),
+            "\n".join("  %s: %s" % error for error in errors)))
+
+    log.debug("Scanned %d layer(s) in %.2fs"
+              % (len(layers), time.time() - started))
+
+    return [(layer, collections, remainder)
+            for layer, (collections, remainder, _) in zip(layers, results)]
+
+
+def clear():
+    """Forget every listing, such that all directories are listed anew"""
+    with _lock:
+        _index.clear()
+
+
+def _main():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m anvil.scan")
+    parser.add_argument("workspace", nargs="?", default=os.getcwd())
+    parser.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args()
+
+    for attempt in ("Initial", "Repeated"):
+        started = time.time()
+        layers = scan_layers(args.workspace, args.workers)
+        print("%s scan: %d layer(s), %d file(s) in %.3fs" % (
+            attempt,
+            len(layers),
+            sum(sum(len(collection.indexes) for collection in collections) +
+                len(remainder)
+                for _, collections, remainder in layers),
+            time.time() - started))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,589 @@
+"""Schedule uploads of concurrent publishes
+
+With AVALON_UPLOAD_SCHEDULER set, UploadAvalonAsset leaves uploading
+to a daemon shared by every publish, rather than competing for the
+uplink on its own. The daemon uploads one file at a time per worker,
+choosing the next file by
+
+    1. Priority, derived from family; rigs and models first
+    2. Weighted fair share of bytes uploaded, per user
+
+Such that small publishes aren't left waiting behind large renders, and
+no one artist monopolises the uplink. Shares default to 1, and are set
+per user with e.g. AVALON_UPLOAD_WEIGHTS="marcus=2,roy=1". Uploads
+altogether are capped at AVALON_UPLOAD_RATE megabytes/second, if set.
+
+Jobs are JSON files in a queue directory, defaulting to
+~/.avalon/uploads/queue, and processed by
+
+    $ python -m anvil.scheduler run
+
+Which is started automatically on publish, and exits once the queue
+has been empty for a minute. For a site, point AVALON_UPLOAD_QUEUE at
+a shared directory and keep one daemon running with --idle 0.
+
+Queue depth and throughput are written to metrics.json of the
+queue directory every second, and printed with
+
+    $ python -m anvil.scheduler status
+
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import getpass
+import logging
+import tempfile
+import threading
+import collections
+
+from . import transfer, worker
+
+log = logging.getLogger(__name__)
+
+self = sys.modules[__name__]
+
+# Most recently spawned daemon, see spawn()
+self._daemon = None
+
+# Higher first, families not listed are of DEFAULT_PRIORITY
+PRIORITIES = {
+    "anvil.rig": 3,
+    "anvil.model": 3,
+    "anvil.lookdev": 2,
+    "anvil.historyLookdev": 2,
+    "anvil.animation": 2,
+    "anvil.group": 2,
+    "anvil.imagesequence": 1,
+}
+
+DEFAULT_PRIORITY = 2
+
+# Seconds of uploads averaged into reported throughput
+WINDOW = 10.0
+
+
+def enabled():
+    """Return whether uploads should go through the scheduler"""
+    return bool(os.getenv("AVALON_UPLOAD_SCHEDULER"))
+
+
+def priority(family):
+    """Return priority of `family`, higher is uploaded first"""
+    return PRIORITIES.get(family, DEFAULT_PRIORITY)
+
+
+def queue_dir():
+    return os.getenv("AVALON_UPLOAD_QUEUE",
+                     os.path.join(os.path.expanduser("~"),
+                                  ".avalon", "uploads", "queue"))
+
+
+def rate_limit():
+    """Return configured cap of bytes/second, or None"""
+    try:
+        rate = float(os.getenv("AVALON_UPLOAD_RATE", 0))
+    except ValueError:
+        rate = 0
+
+    return rate * 1024 * 1024 or None
+
+
+def weights():
+    """Return configured share per user, e.g. {"marcus": 2.0}"""
+    shares = dict()
+
+    for pair in os.getenv("AVALON_UPLOAD_WEIGHTS", "").split(","):
+        user, _, weight = pair.partition("=")
+
+        try:
+            shares[user.strip()] = float(weight)
+        except ValueError:
+            continue
+
+    return {user: weight for user, weight in shares.items() if weight > 0}
+
+
+def enqueue(output, family, root, location, version,
+            hashes=None, user=None, queue=None):
+    """Add upload of `output` to the queue
+
+    Arguments:
+        output (list): Published files and sequences, see
+            :func:`anvil.sequence.iter_outputs`
+        family (str): Family of publish, see :func:`priority`
+        root (str): Registered root, e.g. api.registered_root()
+        location (str): Remote location, e.g. AVALON_LOCATION
+        version (str): Id of published version
+        hashes (dict, optional): Known content hash per absolute path
+        user (str, optional): Publishing user, defaults to current user
+        queue (str, optional): Queue directory, see :func:`queue_dir`
+
+    Returns:
+        path (str): Absolute path to queued job
+
+    """
+
+    from . import upload
+
+    # Read by the daemon, see Scheduler._uploader
+    upload.credentials()
+
+    return worker.enqueue({
+        "version": version,
+        "user": user or getpass.getuser(),
+        "family": family,
+        "priority": priority(family),
+        "output": output,
+        "hashes": hashes or {},
+        "root": root,
+        "location": location,
+    }, queue or queue_dir())
+
+
+def running(root=None):
+    """Return whether a daemon holds the lock of queue `root`
+
+    Daemons of other hosts are assumed to be running.
+
+    """
+
+    path = os.path.join(root or queue_dir(), "daemon.lock")
+
+    try:
+        with open(path) as f:
+            host, pid = f.read().rsplit("@", 1)
+    except (IOError, OSError):
+        return os.path.exists(path)
+    except ValueError:
+        # Being written by a daemon starting up
+        return True
+
+    return host != socket.gethostname() or worker._alive(int(pid))
+
+
+def spawn():
+    """Start a daemon, unless one is running already
+
+    Checked here, rather than by each daemon once started, such that
+    queueing many uploads at once starts no more than one process.
+
+    Returns:
+        process (subprocess.Popen): Daemon started, or None
+
+    """
+
+    if running():
+        return None
+
+    if self._daemon is not None and self._daemon.poll() is None:
+        # Started, but yet to lock the queue
+        return None
+
+    self._daemon = worker.spawn(module="anvil.scheduler")
+    return self._daemon
+
+
+class _Job(object):
+    def __init__(self, path, data):
+        from . import sequence
+
+        self.path = path
+        self.data = data
+        self.user = data["user"]
+        self.priority = data["priority"]
+        self.queued = os.path.getmtime(path)
+        self.remaining = collections.deque(
+            sequence.iter_outputs(data["output"]))
+        self.active = 0
+        self.files = 0
+        self.bytes = 0
+        self.errors = list()
+
+
+class Scheduler(object):
+    """Choose the next file to upload, across jobs of every user
+
+    Files of jobs of the highest priority go first. Among those, files
+    of the user with the fewest bytes uploaded relative to their weight.
+
+    Arguments:
+        weights (dict, optional): Share per user, defaulting to 1
+
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights or dict()
+        self.jobs = list()
+
+        # Bytes scheduled per user, divided by their weight
+        self.served = dict()
+
+        self._condition = threading.Condition()
+
+    def add(self, job):
+        with self._condition:
+            busy = set(other.user for other in self.jobs)
+
+            if job.user not in busy:
+                # Those returning, or new, start level with those uploading
+                # rather than catching up on bandwidth left unused.
+                level = min([self.served[user] for user in busy] or [0])
+                self.served[job.user] = max(
+                    self.served.get(job.user, 0), level)
+
+            self.jobs.append(job)
+            self._condition.notify_all()
+
+    def next(self, timeout=None):
+        """Return next (job, path) to upload, or None if there is none
+
+        Arguments:
+            timeout (float, optional): Seconds to wait for a file
+
+        """
+
+        with self._condition:
+            candidates = [job for job in self.jobs if job.remaining]
+
+            if not candidates and timeout:
+                self._condition.wait(timeout)
+                candidates = [job for job in self.jobs if job.remaining]
+
+            if not candidates:
+                return None
+
+            highest = max(job.priority for job in candidates)
+            job = min((job for job in candidates if job.priority == highest),
+                      key=lambda job: (self.served[job.user], job.queued))
+
+            path = job.remaining.popleft()
+            job.active += 1
+
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+
+            # Charged up-front, such that a large file
+            # in progress counts towards its user's share.
+            self.served[job.user] += size / self.weights.get(job.user, 1.0)
+
+            return job, path
+
+    def done(self, job, size, error=None):
+        """Record upload of a file of `job`
+
+        Returns:
+            finished (bool): Whether every file of `job` is done
+
+        """
+
+        with self._condition:
+            job.active -= 1
+            job.files += 1
+            job.bytes += size
+
+            if error is not None:
+                job.errors.append(error)
+
+            finished = not job.remaining and not job.active
+            if finished:
+                self.jobs.remove(job)
+
+            return finished
+
+
+class Daemon(object):
+    """Upload queued jobs, as chosen by a :class:`Scheduler`
+
+    Arguments:
+        root (str, optional): Queue directory, see :func:`queue_dir`
+        workers (int, optional): Simultaneous uploads, defaults
+            to :func:`anvil.upload.max_workers`
+        rate (float, optional): Cap of bytes/second, defaults
+            to :func:`rate_limit`
+        weights (dict, optional): Share per user, see :func:`weights`
+
+    """
+
+    def __init__(self, root=None, workers=None, rate=None, weights=None,
+                 log=log):
+        from . import upload
+
+        self.root = root or queue_dir()
+        self.dirs = worker._dirs(self.root)
+        self.workers = workers or upload.max_workers()
+        self.rate_limit = upload.RateLimit(rate) if rate else None
+        self.scheduler = Scheduler(weights)
+        self.log = log
+
+        self._uploaders = dict()
+        self._uploaded = collections.deque()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _uploader(self, job):
+        from . import upload
+
+        key = (job.data["root"], job.data["location"])
+
+        with self._lock:
+            if key not in self._uploaders:
+                username, password = upload.credentials()
+                self._uploaders[key] = upload.Uploader(
+                    job.data["root"],
+                    job.data["location"],
+                    username=username,
+                    password=password,
+                    workers=self.workers,
+                    rate_limit=self.rate_limit,
+                    log=self.log
+                )
+
+            return self._uploaders[key]
+
+    def _work(self):
+        while not self._stopped.is_set():
+            item = self.scheduler.next(timeout=0.5)
+
+            if item is None:
+                continue
+
+            job, path = item
+            error = None
+            size = 0
+
+            try:
+                uploader = self._uploader(job)
+                size, _ = uploader.upload_one(path,
+                                              job.data["hashes"].get(path))
+            except Exception as e:
+                error = (path, "%s: %s" % (type(e).__name__, e))
+
+            with self._lock:
+                self._uploaded.append((time.time(), size))
+
+            if self.scheduler.done(job, size, error):
+                self._finish(job)
+
+    def _finish(self, job):
+        if job.errors:
+            self.log.error("%d of %d file(s) of version %s failed to upload"
+                           % (len(job.errors), job.files, job.data["version"]))
+
+            job.data["errors"] = job.errors
+            with open(job.path, "w") as f:
+                json.dump(job.data, f)
+
+            os.rename(job.path, os.path.join(self.dirs["failed"],
+                                             os.path.basename(job.path)))
+
+        else:
+            self.log.info("Uploaded version %s of %s, %d file(s), %d bytes"
+                          % (job.data["version"], job.user,
+                             job.files, job.bytes))
+            os.remove(job.path)
+
+    def _claim(self):
+        while True:
+            path = worker._claim(self.dirs)
+            if path is None:
+                break
+
+            try:
+                with open(path) as f:
+                    job = _Job(path, json.load(f))
+
+            except ValueError:
+                self.log.exception("Malformed job %s" % path)
+                os.rename(path, os.path.join(self.dirs["failed"],
+                                             os.path.basename(path)))
+                continue
+
+            self.log.info("Queued version %s of %s, priority %d"
+                          % (job.data["version"], job.user, job.priority))
+
+            self.scheduler.add(job)
+
+    def metrics(self):
+        """Return queue depth and throughput"""
+        now = time.time()
+
+        with self._lock:
+            while self._uploaded and self._uploaded[0][0] < now - WINDOW:
+                self._uploaded.popleft()
+
+            uploaded = sum(size for _, size in self._uploaded)
+
+        users = dict()
+        priorities = dict()
+
+        for job in list(self.scheduler.jobs):
+            user = users.setdefault(job.user, {"jobs": 0,
+                                               "queued": 0,
+                                               "active": 0})
+            user["jobs"] += 1
+            user["queued"] += len(job.remaining)
+            user["active"] += job.active
+
+            priorities[str(job.priority)] = (
+                priorities.get(str(job.priority), 0) + len(job.remaining))
+
+        return {
+            "time": now,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "jobs": sum(user["jobs"] for user in users.values()),
+            "queued": sum(user["queued"] for user in users.values()),
+            "active": sum(user["active"] for user in users.values()),
+            "throughput": uploaded / WINDOW,
+            "rateLimit": self.rate_limit.rate if self.rate_limit else None,
+            "users": users,
+            "priorities": priorities,
+        }
+
+    def _write_metrics(self):
+        fd, tmp = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.metrics(), f, indent=4)
+
+        path = os.path.join(self.root, "metrics.json")
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Windows refuses to replace existing files
+            os.remove(path)
+            os.rename(tmp, path)
+
+    def _lock_queue(self):
+        """Return whether this is the only daemon of the queue"""
+        path = os.path.join(self.root, "daemon.lock")
+        hostname = socket.gethostname()
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            if running(self.root):
+                return False
+
+            self.log.warning("Replacing daemon, no longer running")
+
+            try:
+                os.remove(path)
+            except OSError:
+                # Replaced by another daemon
+                pass
+
+            return self._lock_queue()
+
+        with os.fdopen(fd, "w") as f:
+            f.write("%s@%d" % (hostname, os.getpid()))
+
+        return True
+
+    def run(self, idle=60.0):
+        """Upload queued jobs, until idle for `idle` seconds
+
+        Arguments:
+            idle (float, optional): Keep running indefinitely if 0
+
+        Returns:
+            ran (bool): False if another daemon is running
+
+        """
+
+        for dirname in self.dirs.values():
+            transfer.makedirs(dirname)
+
+        if not self._lock_queue():
+            self.log.info("Another daemon is running, exiting")
+            return False
+
+        worker._recover(self.dirs)
+
+        threads = [threading.Thread(target=self._work)
+                   for _ in range(self.workers)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        last = time.time()
+
+        try:
+            while not self._stopped.is_set():
+                self._claim()
+
+                if self.scheduler.jobs:
+                    last = time.time()
+
+                elif idle and time.time() - last > idle:
+                    break
+
+                self._write_metrics()
+                self._stopped.wait(1.0)
+
+        finally:
+            self._stopped.set()
+
+            for thread in threads:
+                thread.join()
+
+            for uploader in self._uploaders.values():
+                uploader.close()
+
+            os.remove(os.path.join(self.root, "daemon.lock"))
+
+        return True
+
+    def stop(self):
+        self._stopped.set()
+
+
+def status(root=None):
+    """Return last written metrics, see :meth:`Daemon.metrics`"""
+    with open(os.path.join(root or queue_dir(), "metrics.json")) as f:
+        return json.load(f)
+
+
+def _main():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m anvil.scheduler")
+    parser.add_argument("command", nargs="?", default="run",
+                        choices=["run", "status"])
+    parser.add_argument("--idle", type=float, default=60.0,
+                        help="Exit once idle for this many seconds, "
+                             "never if 0")
+
+    args = parser.parse_args()
+
+    if args.command == "status":
+        metrics = status()
+        print("%d job(s), %d file(s) queued, %d uploading at %.1f MB/s"
+              % (metrics["jobs"], metrics["queued"], metrics["active"],
+                 metrics["throughput"] / 1024.0 / 1024.0))
+
+        for user, queued in sorted(metrics["users"].items()):
+            print("  %-16s %d job(s), %d file(s) queued"
+                  % (user, queued["jobs"], queued["queued"]))
+
+        return
+
+    transfer.makedirs(queue_dir())
+    logging.basicConfig(
+        filename=os.path.join(queue_dir(), "scheduler.log"),
+        level=logging.INFO,
+        format="%(asctime)s %(process)d %(levelname)s %(message)s"
+    )
+
+    Daemon(rate=rate_limit(), weights=weights()).run(args.idle)
+
+
+if __name__ == "__main__":
+    _main()
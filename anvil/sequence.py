@@ -0,0 +1,233 @@
+"""Compact representation of image sequences
+
+A sequence is stored as a pattern along with the ranges of frames
+it contains, as opposed to one path per frame.
+
+    {
+        "head": "beauty.",
+        "padding": 4,
+        "tail": ".exr",
+        "indexes": [[1001, 1100, 1], [1102, 1200, 2]]
+    }
+
+Each range is inclusive and carries its own step. Paths are
+generated lazily from the pattern when needed.
+
+"""
+
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def ranges(indexes):
+    """Return sorted `indexes` as inclusive [start, end, step] ranges
+
+    Example:
+        >>> ranges([1, 2, 3, 5, 7, 9, 10])
+        [[1, 3, 1], [5, 9, 2], [10, 10, 1]]
+
+    """
+
+    result = list()
+    indexes = sorted(set(indexes))
+
+    first = 0
+    while first < len(indexes):
+        start = indexes[first]
+
+        if first + 1 == len(indexes):
+            result.append([start, start, 1])
+            break
+
+        step = indexes[first + 1] - start
+        last = first + 1
+        while (last + 1 < len(indexes) and
+               indexes[last + 1] - indexes[last] == step):
+            last += 1
+
+        if last == first + 1 and step != 1:
+            # Two frames far apart don't make a range
+            result.append([start, start, 1])
+            first += 1
+            continue
+
+        result.append([start, indexes[last], step])
+        first = last + 1
+
+    return result
+
+
+def iter_indexes(pattern):
+    """Yield each frame number of `pattern`, in order"""
+    for start, end, step in pattern["indexes"]:
+        for index in range(start, end + 1, step):
+            yield index
+
+
+def count(pattern):
+    """Return number of frames in `pattern`, without iterating them"""
+    return sum((end - start) // step + 1
+               for start, end, step in pattern["indexes"])
+
+
+def iter_names(pattern):
+    """Yield the file name of each frame of `pattern`, in order
+
+    Example:
+        >>> pattern = {"head": "a.", "padding": 4, "tail": ".exr",
+        ...            "indexes": [[1, 2, 1]]}
+        >>> list(iter_names(pattern))
+        ['a.0001.exr', 'a.0002.exr']
+
+    """
+
+    template = "%s%%0%dd%s" % (
+        pattern["head"].replace("%", "%%"),
+        pattern["padding"],
+        pattern["tail"].replace("%", "%%"),
+    )
+
+    for index in iter_indexes(pattern):
+        yield template % index
+
+
+def iter_paths(pattern, dirname=None):
+    """Yield absolute path of each frame of `pattern`
+
+    Arguments:
+        pattern (dict): Sequence pattern
+        dirname (str, optional): Parent directory of frames,
+            defaults to pattern["dirname"]
+
+    """
+
+    dirname = dirname or pattern["dirname"]
+    for name in iter_names(pattern):
+        yield os.path.join(dirname, name)
+
+
+def compact(names):
+    """Return pattern of file `names`, or None if not a single sequence
+
+    Example:
+        >>> pattern = compact(["a.0001.exr", "a.0002.exr", "a.0004.exr"])
+        >>> pattern["head"], pattern["padding"], pattern["indexes"]
+        ('a.', 4, [[1, 2, 1], [4, 4, 1]])
+
+    """
+
+    from avalon.vendor import clique
+
+    collections, remainder = clique.assemble(names, minimum_items=1)
+
+    if remainder or len(collections) != 1:
+        return None
+
+    collection = collections[0]
+
+    return {
+        "head": collection.head,
+        "padding": collection.padding,
+        "tail": collection.tail,
+        "indexes": ranges(collection.indexes),
+    }
+
+
+def format_ranges(ranges):
+    """Return human-readable `ranges`, e.g. 1-10, 12-20x2
+
+    Example:
+        >>> format_ranges([[1, 10, 1], [12, 20, 2], [30, 30, 1]])
+        '1-10, 12-20x2, 30'
+
+    """
+
+    return ", ".join(
+        "%d-%d" % (start, end) + ("x%d" % step if step != 1 else "")
+        if start != end else "%d" % start
+        for start, end, step in ranges
+    )
+
+
+def format(pattern):
+    """Return human-readable `pattern`, e.g. a.####.exr [1-100]"""
+    return "%s%s%s [%s]" % (pattern["head"],
+                            "#" * max(pattern["padding"], 1),
+                            pattern["tail"],
+                            format_ranges(pattern["indexes"]))
+
+
+def discrepancies(frames, start, end, step=1):
+    """Return frames missing from, repeated in and outside of a frame range
+
+    Computed in one vectorised pass where NumPy is available.
+
+    Arguments:
+        frames (iterable): Frame numbers found, in any order
+        start (int): First frame expected
+        end (int): Last frame expected, inclusive
+        step (int, optional): Frames between each expected frame
+
+    Returns:
+        discrepancies (dict): "missing", "duplicate" and "outOfRange"
+            frames, each as ranges, see :func:`ranges`
+
+    Example:
+        >>> found = discrepancies([1, 2, 2, 5, 6, 11], 1, 10)
+        >>> found["missing"], found["duplicate"], found["outOfRange"]
+        ([[3, 4, 1], [7, 10, 1]], [[2, 2, 1]], [[11, 11, 1]])
+
+    """
+
+    if numpy is None:
+        frames = list(frames)
+        expected = set(range(start, end + 1, step))
+        unique = set(frames)
+
+        seen = set()
+        duplicate = set()
+        for frame in frames:
+            if frame in seen:
+                duplicate.add(frame)
+            seen.add(frame)
+
+        missing = expected - unique
+        outside = unique - expected
+
+    else:
+        frames = numpy.fromiter(frames, dtype=numpy.int64)
+        expected = numpy.arange(start, end + 1, step, dtype=numpy.int64)
+        unique, counts = numpy.unique(frames, return_counts=True)
+
+        duplicate = unique[counts > 1].tolist()
+        missing = numpy.setdiff1d(expected, unique,
+                                  assume_unique=True).tolist()
+        outside = numpy.setdiff1d(unique, expected,
+                                  assume_unique=True).tolist()
+
+    return {
+        "missing": ranges(missing),
+        "duplicate": ranges(duplicate),
+        "outOfRange": ranges(outside),
+    }
+
+
+def iter_outputs(outputs):
+    """Yield absolute paths of `outputs`, expanding sequences lazily
+
+    Arguments:
+        outputs (list): Paths and sequence patterns, as
+            found in instance.data["output"]
+
+    """
+
+    for output in outputs:
+        if isinstance(output, dict):
+            for path in iter_paths(output):
+                yield path
+        else:
+            yield output
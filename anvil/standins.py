@@ -0,0 +1,538 @@
+"""Local stand-ins for remote services, for testing
+
+Example:
+    >>> server = UploadServer.start()
+    >>> server.url.startswith("http://127.0.0.1:")
+    True
+    >>> server.stop()
+
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import shutil
+import base64
+import hashlib
+import tempfile
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+from . import upload, deadline
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    @classmethod
+    def start(cls, *args, **kwargs):
+        """Serve on a free port of localhost, from a background thread"""
+        server = cls(("127.0.0.1", 0), *args, **kwargs)
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return server
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Enables keep-alive
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _UploadHandler(_Handler):
+    def _authorised(self):
+        if self.server.credentials is None:
+            return True
+
+        expected = "Basic " + base64.b64encode(
+            ("%s:%s" % self.server.credentials).encode("utf-8")
+        ).decode("ascii")
+
+        return self.headers.get("Authorization") == expected
+
+    def _path(self):
+        relpath = self.path.split("?", 1)[0].lstrip("/")
+        return os.path.join(self.server.root, *relpath.split("/"))
+
+    def _blob(self, hash):
+        algorithm, hexdigest = hash.split(":", 1)
+        return os.path.join(self.server.root, "blobs", algorithm, hexdigest)
+
+    def _index(self, path):
+        """Make `path` available by reference, if of its claimed hash"""
+        hash = self.headers.get("X-Content-Hash")
+        if not hash:
+            return
+
+        algorithm, hexdigest = hash.split(":", 1)
+        with open(path, "rb") as f:
+            if hashlib.new(algorithm, f.read()).hexdigest() != hexdigest:
+                return
+
+        blob = self._blob(hash)
+        if os.path.exists(blob):
+            return
+
+        try:
+            os.makedirs(os.path.dirname(blob))
+        except OSError:
+            pass
+
+        shutil.copyfile(path, blob)
+
+    def _read(self, length):
+        """Read `length` bytes, no faster than the server's bandwidth"""
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            return self.rfile.read(length)
+
+        data = list()
+        while length > 0:
+            chunk = self.rfile.read(min(length, 64 * 1024))
+            if not chunk:
+                break
+
+            time.sleep(len(chunk) / float(bandwidth))
+            data.append(chunk)
+            length -= len(chunk)
+
+        return b"".join(data)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            body = self._read(int(self.headers.get("Content-Length", 0)))
+
+        else:
+            chunks = list()
+            while True:
+                length = int(self.rfile.readline().split(b";")[0], 16)
+                if not length:
+                    break
+
+                chunks.append(self._read(length))
+                self.rfile.readline()
+
+            # Trailers, if any
+            while self.rfile.readline().strip():
+                pass
+
+            body = b"".join(chunks)
+
+        with self.server.lock:
+            self.server.received += len(body)
+
+        return body
+
+    def _decode(self, body):
+        """Return `body` decoded, or None if of an unsupported encoding"""
+        encoding = self.headers.get("Content-Encoding", "identity")
+
+        if encoding == "identity":
+            return body
+
+        if encoding not in self.server.encodings:
+            return None
+
+        if encoding == "gzip":
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        if self.server.encodings:
+            self.send_header("Accept-Encoding",
+                             ", ".join(self.server.encodings))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        with self.server.lock:
+            self.server.queries += 1
+
+        if not self._authorised():
+            return self._respond(401)
+
+        self._respond(200 if os.path.isfile(self._path()) else 404)
+
+    def do_PUT(self):
+        body = self._read_body()
+
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.connections.add(self.client_address)
+
+            failing = self.server.fail > 0
+            if failing:
+                self.server.fail -= 1
+
+            limit = self.server.limit
+            if limit is not None and self.server.requests > limit:
+                failing = True
+
+        if not self._authorised():
+            return self._respond(401, b"Unauthorised")
+
+        if failing:
+            return self._respond(503, b"Deliberately unavailable")
+
+        body = self._decode(body)
+        if body is None:
+            self.send_response(415)
+            self.send_header("Accept-Encoding",
+                             ", ".join(self.server.encodings))
+            self.send_header("Content-Length", "0")
+            return self.end_headers()
+
+        path = self._path()
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+
+        reference = self.headers.get("X-Reference")
+        if reference:
+            blob = self._blob(reference)
+            if not os.path.isfile(blob):
+                return self._respond(404, b"No such content")
+
+            shutil.copyfile(blob, path)
+            return self._respond(201)
+
+        content_range = self.headers.get("Content-Range")
+        if content_range:
+            return self._put_range(path, content_range, body)
+
+        with open(path, "wb") as f:
+            f.write(body)
+
+        self._index(path)
+        self._respond(201)
+
+    def _acknowledge(self, status, received):
+        self.send_response(status)
+        if received:
+            self.send_header("Range", "bytes=0-%d" % (received - 1))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _put_range(self, path, content_range, body):
+        """Receive a chunk, see :mod:`anvil.upload`"""
+        partial = path + ".part"
+
+        try:
+            received = os.path.getsize(partial)
+        except OSError:
+            received = 0
+
+        query = re.match(r"bytes \*/(\d+)$", content_range)
+        if query:
+            size = int(query.group(1))
+
+            if not received and os.path.isfile(path) and (
+                    os.path.getsize(path) == size):
+                return self._respond(200)
+
+            return self._acknowledge(308, received)
+
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+)$", content_range)
+        if not match:
+            return self._respond(400, b"Malformed Content-Range")
+
+        start, end, size = (int(group) for group in match.groups())
+
+        if start != received or end - start + 1 != len(body):
+            return self._acknowledge(416, received)
+
+        with open(partial, "ab") as f:
+            f.write(body)
+
+        received += len(body)
+
+        if received < size:
+            return self._acknowledge(308, received)
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        os.rename(partial, path)
+        self._index(path)
+        self._respond(201)
+
+
+class UploadServer(_Server):
+    """Stand-in for the AVALON_LOCATION upload service
+
+    Files PUT are written beneath `root`.
+
+    Arguments:
+        root (str, optional): Destination of uploaded files,
+            defaults to a temporary directory
+        credentials (tuple, optional): Required (username, password)
+
+    Files PUT with a Content-Range are received in chunks, and
+    content already received may be referenced by hash, as described
+    in :mod:`anvil.upload`.
+
+    Bodies may be compressed with any of `encodings`, advertised
+    in response to OPTIONS.
+
+    Attributes:
+        encodings (list): Accepted Content-Encoding, e.g. ["gzip"]
+        bandwidth (int): Bytes/second received, unlimited if None
+        received (int): Bytes received, prior to decoding
+        fail (int): Respond with 503 to this many upcoming PUTs
+        limit (int): Respond with 503 to every PUT beyond this many
+        requests (int): Number of PUTs received
+        queries (int): Number of HEADs received
+        connections (set): Distinct client addresses seen
+
+    """
+
+    def __init__(self, address, root=None, credentials=None):
+        _Server.__init__(self, address, _UploadHandler)
+
+        self._tempdir = root is None
+        self.root = root or tempfile.mkdtemp()
+        self.credentials = credentials
+        self.lock = threading.Lock()
+        self.encodings = upload.encodings()
+        self.bandwidth = None
+        self.received = 0
+        self.fail = 0
+        self.limit = None
+        self.requests = 0
+        self.queries = 0
+        self.connections = set()
+
+    def stop(self):
+        _Server.stop(self)
+
+        if self._tempdir:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+class _DeadlineHandler(_Handler):
+    def _begin(self):
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.connections.add(self.client_address)
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+
+        # Latency of a busy Web Service
+        time.sleep(self.server.delay)
+
+    def _end(self):
+        with self.server.lock:
+            self.server.active -= 1
+
+    def do_POST(self):
+        self._begin()
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+
+            if self.path.split("?", 1)[0] != "/api/jobs":
+                return self._respond(404, b"Not found")
+
+            with self.server.lock:
+                failing = self.server.fail > 0
+                if failing:
+                    self.server.fail -= 1
+
+            if failing:
+                return self._respond(500, b"Deliberately failed")
+
+            self._respond_json(self.server.submit(payload))
+
+        finally:
+            self._end()
+
+    def do_GET(self):
+        self._begin()
+
+        try:
+            path, _, query = self.path.partition("?")
+
+            if path == "/api/pools":
+                return self._respond_json(self.server.pools)
+
+            if path == "/api/groups":
+                return self._respond_json(self.server.groups)
+
+            ids = [_id
+                   for value in parse_qs(query).get("JobID", [])
+                   for _id in value.split(",")]
+
+            if path == "/api/tasks":
+                with self.server.lock:
+                    tasks = self.server.tasks.get(ids[0] if ids else None)
+
+                if tasks is None:
+                    return self._respond(404, b"No such job")
+
+                return self._respond_json({"JobID": ids[0], "Tasks": tasks})
+
+            if path != "/api/jobs":
+                return self._respond(404, b"Not found")
+
+            with self.server.lock:
+                jobs = [self.server.jobs[_id]
+                        for _id in ids if _id in self.server.jobs]
+
+            self._respond_json(jobs)
+
+        finally:
+            self._end()
+
+
+class DeadlineServer(_Server):
+    """Stand-in for the AVALON_DEADLINE Web Service
+
+    Jobs submitted are kept in memory, and queried by id. Tasks
+    of jobs never start, until completed with :meth:`complete`.
+
+    Attributes:
+        jobs (dict): Submitted jobs, by id
+        tasks (dict): Tasks of each job, by job id
+        pools (list): Pools available, e.g. ["none", "maya"]
+        groups (list): Groups available
+        delay (float): Seconds to wait prior to responding
+        fail (int): Respond with 500 to this many upcoming submissions
+        requests (int): Number of requests received
+        connections (set): Distinct client addresses seen
+        peak (int): Most requests handled at once
+
+    """
+
+    def __init__(self, address):
+        _Server.__init__(self, address, _DeadlineHandler)
+
+        self.lock = threading.Lock()
+        self.jobs = dict()
+        self.tasks = dict()
+        self.pools = ["none"]
+        self.groups = ["none"]
+        self.delay = 0.0
+        self.fail = 0
+        self.requests = 0
+        self.connections = set()
+        self.active = 0
+        self.peak = 0
+
+    def submit(self, payload):
+        with self.lock:
+            _id = "%024x" % (len(self.jobs) + 1)
+
+            job = {
+                "_id": _id,
+                "Props": {
+                    "Name": payload["JobInfo"].get("Name"),
+                    "Batch": payload["JobInfo"].get("BatchName"),
+                    "User": payload["JobInfo"].get("UserName"),
+                    "Frames": payload["JobInfo"].get("Frames"),
+                },
+                # Queued
+                "Stat": 1,
+            }
+
+            self.jobs[_id] = job
+
+            info = payload["JobInfo"]
+            frames = list(deadline.iter_frames(info.get("Frames", "1")))
+            size = int(info.get("ChunkSize", 1))
+
+            self.tasks[_id] = [
+                {
+                    "TaskID": index,
+                    "Frames": "%d-%d" % (chunk[0], chunk[-1]),
+                    # Queued
+                    "Stat": 2,
+                    "StartRen": "",
+                    "Comp": "",
+                }
+                for index, chunk in enumerate(
+                    frames[start:start + size]
+                    for start in range(0, len(frames), size)
+                )
+            ]
+
+        return job
+
+    def complete(self, _id, tasks=None, seconds_per_frame=1.0):
+        """Complete `tasks` of job `_id`, defaulting to all
+
+        Arguments:
+            _id (str): Id of job
+            tasks (list, optional): Indexes of tasks
+            seconds_per_frame (float, optional): Recorded render time
+
+        """
+
+        with self.lock:
+            started = time.time()
+
+            for task in self.tasks[_id]:
+                if tasks is not None and task["TaskID"] not in tasks:
+                    continue
+
+                frames = sum(1 for _ in deadline.iter_frames(task["Frames"]))
+                finished = started + frames * seconds_per_frame
+
+                task["Stat"] = deadline.TASK_COMPLETED
+                task["StartRen"] = _date(started)
+                task["Comp"] = _date(finished)
+
+            if all(task["Stat"] == deadline.TASK_COMPLETED
+                   for task in self.tasks[_id]):
+                # Completed
+                self.jobs[_id]["Stat"] = 3
+
+
+def _date(seconds):
+    """Return `seconds` since epoch formatted as by the Web Service"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000+00:00",
+                         time.gmtime(seconds))
@@ -0,0 +1,341 @@
+"""Content-addressed storage of published files
+
+Published files are written once per unique content to a store
+under the project root, and each versioned path is a hardlink, or
+reflink, to its blob. Republishing identical content costs no
+additional storage.
+
+Enabled by setting AVALON_BLOBSTORE, e.g.
+
+    $ export AVALON_BLOBSTORE=1
+
+Blobs no longer referenced by any representation are removed with
+
+    $ python -m anvil.store gc --project hulk
+
+Except for those stored or reused within AVALON_BLOBSTORE_GRACE seconds,
+a day by default, which may be in the midst of being published.
+
+"""
+
+import os
+import time
+import errno
+import hashlib
+import tempfile
+import logging
+
+from . import transfer
+
+log = logging.getLogger(__name__)
+
+ALGORITHM = "sha256"
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds since a blob was last stored or reused before it may be
+# collected, unless otherwise specified via AVALON_BLOBSTORE_GRACE.
+DEFAULT_GRACE = 24 * 3600.0
+
+
+def enabled():
+    """Return whether published files should go through the store"""
+    return bool(os.getenv("AVALON_BLOBSTORE"))
+
+
+def grace_period():
+    """Return configured seconds before unreferenced blobs are collected"""
+    try:
+        return float(os.getenv("AVALON_BLOBSTORE_GRACE", DEFAULT_GRACE))
+    except ValueError:
+        return DEFAULT_GRACE
+
+
+def hash_file(path):
+    """Return content hash of `path`, e.g. "sha256:ab12.."
+
+    Compatible with :meth:`BlobStore.put`.
+
+    """
+
+    digest = hashlib.new(ALGORITHM)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return "%s:%s" % (ALGORITHM, digest.hexdigest())
+
+
+class BlobStore(object):
+    """Files stored by the hash of their content
+
+    Blobs are read-only, and shared by every published file of
+    identical content. Layout on disk is
+
+        <root>/<algorithm>/<ab>/<cd>/<hexdigest>
+
+    Arguments:
+        root (str): Absolute path to directory of blobs
+        directories (transfer.Directories, optional): Known directories
+
+    """
+
+    def __init__(self, root, directories=None):
+        self.root = root
+        self.directories = directories or transfer.Directories()
+
+    @classmethod
+    def from_project(cls, root, project, directories=None):
+        """Return store of `project` beneath `root`"""
+        return cls(os.path.join(root, project, ".blobs"), directories)
+
+    def path(self, hash):
+        """Return absolute path to blob of `hash`"""
+        algorithm, hexdigest = hash.split(":", 1)
+        return os.path.join(self.root,
+                            algorithm,
+                            hexdigest[:2],
+                            hexdigest[2:4],
+                            hexdigest)
+
+    def put(self, src, dst):
+        """Store `src` and make `dst` a link to the resulting blob
+
+        `src` is hashed first, and only copied into the store should
+        no identical blob exist already. A blob collected as garbage
+        before `dst` could link to it is stored anew.
+
+        Returns:
+            result (dict): With "hash" and "method", the latter
+                followed by " (existing)" for content already stored
+
+        """
+
+        hash = hash_file(src)
+
+        for attempt in range(3):
+            existing = self._touch(hash)
+
+            if not existing:
+                hash = self._store(src)
+
+            try:
+                method = self.link(self.path(hash), dst)
+                break
+
+            except OSError as e:
+                if e.errno != errno.ENOENT or attempt == 2:
+                    raise
+
+                log.warning("%s was collected while being published, "
+                            "storing anew" % self.path(hash))
+
+        if existing:
+            method += " (existing)"
+
+        return {"method": method, "hash": hash}
+
+    def _touch(self, hash):
+        """Return whether blob of `hash` exists, and mark it as in use
+
+        Blobs modified recently are never collected as garbage,
+        see :meth:`collect_garbage`.
+
+        """
+
+        try:
+            os.utime(self.path(hash), None)
+        except OSError:
+            return False
+
+        return True
+
+    def _store(self, src):
+        """Copy `src` into the store, and return its hash
+
+        Hashed while copied, such that the blob is named by
+        what was actually written.
+
+        """
+
+        tmpdir = os.path.join(self.root, "tmp")
+        self.directories.makedirs(tmpdir)
+
+        digest = hashlib.new(ALGORITHM)
+        fd, tmp = tempfile.mkstemp(dir=tmpdir)
+
+        try:
+            with open(src, "rb") as fsrc, os.fdopen(fd, "wb") as fdst:
+                for chunk in iter(lambda: fsrc.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    fdst.write(chunk)
+
+            hash = "%s:%s" % (ALGORITHM, digest.hexdigest())
+            blob = self.path(hash)
+
+            self.directories.makedirs(os.path.dirname(blob))
+            os.chmod(tmp, 0o444)
+
+            try:
+                # Atomic, a simultaneous publish of identical
+                # content results in an identical blob.
+                os.rename(tmp, blob)
+
+            except OSError:
+                # Windows refuses to replace an existing blob,
+                # stored by a simultaneous publish.
+                if not os.path.exists(blob):
+                    raise
+
+        finally:
+            try:
+                os.chmod(tmp, 0o644)
+                os.remove(tmp)
+            except OSError:
+                pass
+
+        return hash
+
+    def link(self, blob, dst):
+        """Make `dst` share the content of `blob`
+
+        Returns:
+            method (str): "link", or the strategy used to copy,
+                see :func:`anvil.transfer.zero_copy`
+
+        Raises:
+            OSError with ENOENT, should `blob` not exist
+
+        """
+
+        self.directories.makedirs(os.path.dirname(dst))
+
+        try:
+            os.remove(dst)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        try:
+            os.link(blob, dst)
+            return "link"
+        except AttributeError:
+            # Unavailable on this platform
+            pass
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise
+
+            # E.g. crossing devices
+
+        return transfer.zero_copy(blob, dst)
+
+    def blobs(self):
+        """Yield (hash, path) of every stored blob"""
+        for algorithm in os.listdir(self.root):
+            if algorithm == "tmp":
+                continue
+
+            base = os.path.join(self.root, algorithm)
+            for dirpath, _, fnames in os.walk(base):
+                for fname in fnames:
+                    yield ("%s:%s" % (algorithm, fname),
+                           os.path.join(dirpath, fname))
+
+    def collect_garbage(self, references, dry_run=False, grace=None):
+        """Remove blobs without references
+
+        A blob is referenced when either its hash is counted in
+        `references`, or when it has hardlinks other than itself.
+        Blobs stored or reused recently are kept regardless, as they
+        may be in the midst of being published.
+
+        Arguments:
+            references (dict): Number of references per hash
+            dry_run (bool, optional): Only report what would be removed
+            grace (float, optional): Seconds since last stored or
+                reused before a blob may be removed, see :func:`grace_period`
+
+        Returns:
+            removed (list): Paths to removed blobs
+
+        """
+
+        removed = list()
+        grace = grace_period() if grace is None else grace
+
+        if not os.path.isdir(self.root):
+            return removed
+
+        now = time.time()
+
+        for hash, path in self.blobs():
+            if references.get(hash, 0) > 0:
+                continue
+
+            stat = os.stat(path)
+
+            if now - stat.st_mtime < grace:
+                continue
+
+            if stat.st_nlink > 1:
+                log.warning("%s is linked, but unreferenced" % path)
+                continue
+
+            if not dry_run:
+                os.chmod(path, 0o644)
+                os.remove(path)
+
+            removed.append(path)
+
+        return removed
+
+
+def count_references():
+    """Return number of representations referencing each hash
+
+    Only files of the active project are considered.
+
+    """
+
+    from avalon import io
+
+    references = dict()
+    for representation in io.find({"type": "representation",
+                                   "data.hashes": {"$exists": True}},
+                                  {"data.hashes": True}):
+        for hash in representation["data"]["hashes"].values():
+            references[hash] = references.get(hash, 0) + 1
+
+    return references
+
+
+def _main():
+    import argparse
+
+    from avalon import api, io
+
+    parser = argparse.ArgumentParser(prog="python -m anvil.store")
+    parser.add_argument("command", choices=["gc"])
+    parser.add_argument("--project", default=os.getenv("AVALON_PROJECT"),
+                        help="Defaults to $AVALON_PROJECT")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only list what would be removed")
+
+    args = parser.parse_args()
+    assert args.project, "No project specified"
+
+    io.install()
+    io.activate_project(args.project)
+
+    store = BlobStore.from_project(api.registered_root(), args.project)
+    removed = store.collect_garbage(count_references(), args.dry_run)
+
+    for path in removed:
+        print(path)
+
+    print("%s %d unreferenced blob(s)"
+          % ("Found" if args.dry_run else "Removed", len(removed)))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,25 @@
+"""Path templates, shared amongst instances of a publish
+
+Templates of a project, such as project["config"]["template"]["publish"],
+are read once per publish, such that every instance is formatted with
+the same templates, even should the project change meanwhile.
+
+"""
+
+
+def templates(context, project):
+    """Return templates of `project`, per publishing `context`
+
+    Arguments:
+        context (pyblish.api.Context): Publishing context
+        project (dict): Project document
+
+    Returns:
+        templates (dict): Template per name, e.g. "publish"
+
+    """
+
+    if "templates" not in context.data:
+        context.data["templates"] = dict(project["config"]["template"])
+
+    return context.data["templates"]
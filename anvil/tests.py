@@ -6,9 +6,11 @@ the integration between them.
 """
 
 import os
+import json
 import sys
 import shutil
 import tempfile
+import time
 
 from maya import cmds
 
@@ -388,3 +390,1607 @@ def test_modeling_to_rigging():
     nodes = cmds.sets(container, query=True)
     assembly = cmds.ls(nodes, assemblies=True)[0]
     assert_equals(assembly, "Bruce_01_:rigDefault")
+
+
+def test_upload():
+    """Uploading reuses connections and retries transient failures"""
+    from anvil import upload, standins
+
+    server = standins.UploadServer.start(credentials=("user", "pass"))
+    root = tempfile.mkdtemp()
+
+    try:
+        paths = list()
+        for frame in range(20):
+            path = os.path.join(root, PROJECT_NAME, "image.%04d.exr" % frame)
+            paths.append(path)
+
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            with open(path, "wb") as f:
+                f.write(os.urandom(1024))
+
+        server.fail = 2
+        stats = upload.upload(paths, root, server.url, "user", "pass",
+                              workers=4, backoff=0.01)
+
+        assert_equals(stats["files"], 20)
+        assert_equals(server.requests, 22)
+        assert len(server.connections) <= 4, server.connections
+
+        for path in paths:
+            uploaded = os.path.join(server.root, "upload",
+                                    os.path.relpath(path, root))
+
+            with open(path, "rb") as a, open(uploaded, "rb") as b:
+                assert a.read() == b.read(), "%s differs" % uploaded
+
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+
+
+def test_upload_resume():
+    """Interrupted chunked uploads resume from the last chunk"""
+    from anvil import upload, standins
+
+    server = standins.UploadServer.start()
+    root = tempfile.mkdtemp()
+    manifest = upload.Manifest(tempfile.mkdtemp())
+
+    try:
+        path = os.path.join(root, "cache.abc")
+        data = os.urandom(10 * 1024 + 7)
+
+        with open(path, "wb") as f:
+            f.write(data)
+
+        # Connection "drops" after the fourth chunk
+        server.limit = 4
+
+        try:
+            upload.upload([path], root, server.url, "user", "pass",
+                          chunk_size=1024, manifest=manifest,
+                          retries=1, backoff=0.01)
+        except upload.UploadError:
+            pass
+        else:
+            raise AssertionError("Upload should have failed")
+
+        server.limit = None
+        stats = upload.upload([path], root, server.url, "user", "pass",
+                              chunk_size=1024, manifest=manifest)
+
+        assert_equals(stats["bytes"], len(data) - 4 * 1024)
+
+        with open(os.path.join(server.root, "upload", "cache.abc"),
+                  "rb") as f:
+            assert f.read() == data, "Resumed upload differs"
+
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+        shutil.rmtree(manifest.root)
+
+
+def test_upload_delta():
+    """Content already uploaded is registered by reference"""
+    from anvil import upload, standins
+
+    server = standins.UploadServer.start()
+    root = tempfile.mkdtemp()
+
+    try:
+        paths = list()
+        for version in (1, 2):
+            for frame in range(10):
+                path = os.path.join(root, "v%03d" % version,
+                                    "image.%04d.exr" % frame)
+                paths.append(path)
+
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+
+                # One frame changed between versions
+                with open(path, "wb") as f:
+                    f.write(b"%d" % (frame if frame or version < 2 else 99))
+
+        stats = upload.upload(paths[:10], root, server.url, "user", "pass",
+                              delta=True)
+        assert_equals(stats["referenced"], 0)
+
+        stats = upload.upload(paths[10:], root, server.url, "user", "pass",
+                              delta=True)
+        assert_equals(stats["referenced"], 9)
+        assert_equals(stats["bytes"], 2)
+
+        for path in paths:
+            uploaded = os.path.join(server.root, "upload",
+                                    os.path.relpath(path, root))
+
+            with open(path, "rb") as a, open(uploaded, "rb") as b:
+                assert a.read() == b.read(), "%s differs" % uploaded
+
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+
+
+def test_upload_compressed():
+    """Text is compressed on upload, where the remote accepts it"""
+    from anvil import upload, standins
+
+    server = standins.UploadServer.start()
+    root = tempfile.mkdtemp()
+    manifest = upload.Manifest(tempfile.mkdtemp())
+
+    try:
+        text = os.path.join(root, "model.ma")
+        with open(text, "w") as f:
+            f.write("createNode transform -n \"pCube1\";\n" * 2000)
+
+        image = os.path.join(root, "image.exr")
+        with open(image, "wb") as f:
+            f.write(os.urandom(1024))
+
+        size = os.path.getsize(text) + os.path.getsize(image)
+
+        # Streamed whole, and in compressed chunks
+        for chunk_size in (None, 8 * 1024):
+            server.received = 0
+            upload.upload([text, image], root, server.url, "user", "pass",
+                          chunk_size=chunk_size, manifest=manifest)
+            assert server.received < size / 2, server.received
+
+        # Remotes accepting no encoding are sent files as-is
+        server.encodings = []
+        server.received = 0
+        upload.upload([text, image], root, server.url, "user", "pass")
+        assert_equals(server.received, size)
+
+        for path in (text, image):
+            with open(path, "rb") as a, open(
+                    os.path.join(server.root, "upload",
+                                 os.path.basename(path)), "rb") as b:
+                assert a.read() == b.read(), "%s differs" % path
+
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+        shutil.rmtree(manifest.root)
+
+
+def test_upload_scheduler():
+    """Uploads are ordered by priority, then fair share per user"""
+    from anvil import scheduler
+
+    root = tempfile.mkdtemp()
+
+    try:
+        def job(user, family, count, size):
+            paths = list()
+            for index in range(count):
+                path = os.path.join(root, "%s.%s.%d" % (user, family, index))
+                with open(path, "wb") as f:
+                    f.write(b"0" * size)
+                paths.append(path)
+
+            return scheduler._Job(paths[0], {
+                "user": user,
+                "priority": scheduler.priority(family),
+                "output": paths,
+            })
+
+        schedule = scheduler.Scheduler(weights={"roy": 2})
+        schedule.add(job("marcus", "anvil.imagesequence", 2, 100))
+        schedule.add(job("marcus", "anvil.model", 4, 10))
+        schedule.add(job("roy", "anvil.rig", 4, 10))
+
+        order = list()
+        while True:
+            item = schedule.next()
+            if item is None:
+                break
+
+            job, path = item
+            order.append(os.path.basename(path).rsplit(".", 1)[0])
+            schedule.done(job, os.path.getsize(path))
+
+        # Roy, of twice the share, is given two files for every one
+        assert_equals(order, [
+            "marcus.anvil.model",
+            "roy.anvil.rig",
+            "roy.anvil.rig",
+            "marcus.anvil.model",
+            "roy.anvil.rig",
+            "roy.anvil.rig",
+            "marcus.anvil.model",
+            "marcus.anvil.model",
+            "marcus.anvil.imagesequence",
+            "marcus.anvil.imagesequence",
+        ])
+        assert_equals(schedule.jobs, [])
+
+    finally:
+        shutil.rmtree(root)
+
+
+def test_scheduler_spawn():
+    """A daemon is spawned only when none is running"""
+    import socket
+    import subprocess
+    from anvil import scheduler, worker
+
+    root = tempfile.mkdtemp()
+    queue = os.environ.get("AVALON_UPLOAD_QUEUE")
+    os.environ["AVALON_UPLOAD_QUEUE"] = root
+
+    spawned = list()
+
+    class Process(object):
+        def poll(self):
+            # Still running
+            return None
+
+    def spawn(module):
+        spawned.append(module)
+        return Process()
+
+    original = worker.spawn
+    worker.spawn = spawn
+
+    try:
+        lock = os.path.join(root, "daemon.lock")
+
+        # Held by this process
+        with open(lock, "w") as f:
+            f.write("%s@%d" % (socket.gethostname(), os.getpid()))
+
+        assert scheduler.running(root)
+        assert_equals(scheduler.spawn(), None)
+        assert_equals(spawned, [])
+
+        # Held by a process since exited
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+
+        with open(lock, "w") as f:
+            f.write("%s@%d" % (socket.gethostname(), process.pid))
+
+        assert not scheduler.running(root)
+        scheduler.spawn()
+        assert_equals(spawned, ["anvil.scheduler"])
+
+        # Spawned, but yet to lock the queue
+        assert_equals(scheduler.spawn(), None)
+        assert_equals(spawned, ["anvil.scheduler"])
+
+        os.remove(lock)
+        assert not scheduler.running(root)
+
+    finally:
+        worker.spawn = original
+        scheduler._daemon = None
+
+        if queue is None:
+            os.environ.pop("AVALON_UPLOAD_QUEUE")
+        else:
+            os.environ["AVALON_UPLOAD_QUEUE"] = queue
+
+        shutil.rmtree(root)
+
+
+def test_deadline_submit():
+    """Render layers are submitted concurrently, over pooled connections"""
+    from anvil import deadline, standins
+
+    server = standins.DeadlineServer.start()
+    server.delay = 0.05
+    server.fail = 1
+
+    try:
+        payloads = [
+            {"JobInfo": {"Name": "scene.ma - layer%d" % index},
+             "PluginInfo": {},
+             "AuxFiles": []}
+            for index in range(20)
+        ]
+
+        results = deadline.submit(server.url, payloads, workers=4)
+
+        errors = [error for _, error in results if error is not None]
+        assert_equals(len(errors), 1)
+
+        names = [job["Props"]["Name"] for job, _ in results if job]
+        assert_equals(names, [payload["JobInfo"]["Name"]
+                              for payload, (job, _) in zip(payloads, results)
+                              if job])
+
+        assert_equals(len(server.jobs), 19)
+        assert 1 < server.peak <= 4, server.peak
+        assert len(server.connections) <= 4, server.connections
+
+    finally:
+        server.stop()
+
+
+def test_deadline_chunk_size():
+    """Chunk size is planned from past render times of a layer"""
+    import json
+    from anvil import deadline, standins
+
+    server = standins.DeadlineServer.start()
+    renders = tempfile.mkdtemp()
+
+    try:
+        counted = list()
+
+        def statistics():
+            counted.append(True)
+            return {"triangles": 0, "pixels": 1920 * 1080}
+
+        size, _, source = deadline.plan(renders, "beauty", 100,
+                                        statistics, duration=600)
+        assert_equals(source, "estimate")
+        assert_equals(size, 19)
+
+        (job, _), = deadline.submit(server.url, [{
+            "JobInfo": {"Name": "shot_v001.ma - beauty",
+                        "Frames": "1-10",
+                        "ChunkSize": 2}
+        }])
+
+        server.complete(job["_id"], seconds_per_frame=30)
+
+        tasks = deadline.tasks(server.url, job["_id"])
+        assert_equals(len(tasks), 5)
+
+        os.makedirs(os.path.join(renders, "shot_v001"))
+        with open(os.path.join(renders, "shot_v001", "beauty.json"),
+                  "w") as f:
+            json.dump({"jobs": [job],
+                       "renderTime": deadline.render_time(tasks)}, f)
+
+        size, seconds, source = deadline.plan(renders, "beauty", 100,
+                                              statistics, duration=600)
+        assert_equals(source, "history")
+        assert_equals(seconds, 30)
+        assert_equals(size, 20)
+
+        # Statistics are only gathered without a history
+        assert_equals(len(counted), 1)
+
+    finally:
+        server.stop()
+        shutil.rmtree(renders)
+
+
+def test_deadline_status():
+    """Job status is queried in batches, and reused briefly"""
+    import threading
+    from anvil import deadline, standins
+
+    server = standins.DeadlineServer.start()
+
+    try:
+        results = deadline.submit(server.url, [
+            {"JobInfo": {"Name": "layer%d" % index, "Frames": "1-2"}}
+            for index in range(5)
+        ])
+        ids = [job["_id"] for job, _ in results]
+
+        status = deadline.JobStatus(server.url, ttl=60, batch=2)
+        jobs = status.get(ids)
+        assert_equals(sorted(jobs), sorted(ids))
+        assert_equals(status.requests, 3)
+
+        # Reused
+        status.get(ids[:1])
+        assert_equals(status.requests, 3)
+
+        for _id in ids[1:]:
+            server.complete(_id)
+
+        timer = threading.Timer(0.2, server.complete, args=[ids[0]])
+        timer.start()
+
+        jobs = status.wait(ids, timeout=5, interval=0.05)
+        assert_equals(set(deadline.state(job) for job in jobs.values()),
+                      set(["Completed"]))
+
+    finally:
+        server.stop()
+
+
+def test_record_render_time():
+    """Render time is recorded once integrated, replacing metadata whole"""
+    from anvil import deadline, standins
+
+    server = standins.DeadlineServer.start()
+    renders = tempfile.mkdtemp()
+    url = api.Session.get("AVALON_DEADLINE")
+    api.Session["AVALON_DEADLINE"] = server.url
+
+    try:
+        (job, _), = deadline.submit(server.url, [{
+            "JobInfo": {"Name": "shot_v001.ma - beauty", "Frames": "1-4"}
+        }])
+        server.complete(job["_id"], seconds_per_frame=10)
+
+        path = os.path.join(renders, "beauty.json")
+        metadata = {"jobs": [job]}
+        with open(path, "w") as f:
+            json.dump(metadata, f)
+
+        context = pyblish.api.Context()
+        instance = context.create_instance("beauty")
+        instance.data.update({
+            "metadata": metadata,
+            "metadataPath": path,
+        })
+
+        plugin = _plugins()["IntegrateAvaRenderTime"]()
+
+        # Still rendering
+        plugin.process(instance)
+        assert "renderTime" not in metadata
+
+        instance.data["rendered"] = True
+        plugin.process(instance)
+
+        with open(path) as f:
+            recorded = json.load(f)
+
+        assert_equals(recorded["renderTime"]["frames"], 4)
+        assert_equals(os.listdir(renders), ["beauty.json"])
+
+    finally:
+        if url is None:
+            api.Session.pop("AVALON_DEADLINE")
+        else:
+            api.Session["AVALON_DEADLINE"] = url
+
+        server.stop()
+        shutil.rmtree(renders)
+
+
+def test_progressive_integration():
+    """Frames are transferred as their tasks complete"""
+    from anvil import deadline, progressive, standins, transfer
+
+    server = standins.DeadlineServer.start()
+    root = tempfile.mkdtemp()
+
+    try:
+        (job, _), = deadline.submit(server.url, [{
+            "JobInfo": {"Name": "shot_v001.ma - beauty",
+                        "Frames": "1-4",
+                        "ChunkSize": 2}
+        }])
+
+        staging = os.path.join(root, "staging")
+        publish = os.path.join(root, "publish")
+        os.makedirs(staging)
+        os.makedirs(publish)
+
+        names = ["beauty.%04d.exr" % frame for frame in range(1, 5)]
+        for name in names:
+            with open(os.path.join(staging, name), "w") as f:
+                f.write(name)
+
+        queued = {
+            "transfers": [[os.path.join(staging, name),
+                           os.path.join(publish, name),
+                           "representation"] for name in names],
+            "output": [{"head": "beauty.", "padding": 4, "tail": ".exr",
+                        "indexes": [[1, 4, 1]], "dirname": publish}],
+            "renders": {"url": server.url, "jobs": [job["_id"]]},
+        }
+
+        transferred, finished = progressive.integrate(queued, transfer.copy)
+        assert_equals((len(transferred), finished), (0, False))
+
+        server.complete(job["_id"], tasks=[0])
+        transferred, finished = progressive.integrate(queued, transfer.copy)
+        assert_equals((len(transferred), finished), (2, False))
+        assert_equals(sorted(os.listdir(publish)), names[:2])
+
+        server.complete(job["_id"])
+        transferred, finished = progressive.integrate(queued, transfer.copy)
+        assert_equals((len(transferred), finished), (2, True))
+        assert_equals(sorted(os.listdir(publish)), names)
+        assert_equals(queued["done"], [[0, 3, 1]])
+
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+
+
+def test_progressive_abandoned():
+    """Renders that won't finish by themselves fail the version"""
+    from anvil import deadline, progressive, standins
+
+    server = standins.DeadlineServer.start()
+
+    try:
+        results = deadline.submit(server.url, [
+            {"JobInfo": {"Name": "layer%d" % index, "Frames": "1-2"}}
+            for index in range(4)
+        ])
+        failed, suspended, unknown, deleted = [job["_id"]
+                                               for job, _ in results]
+
+        server.jobs[failed]["Stat"] = 4
+        server.jobs[suspended]["Stat"] = 2
+        server.jobs[unknown]["Stat"] = 0
+        server.jobs.pop(deleted)
+
+        for _id, message in ((failed, "failed"),
+                             (suspended, "suspended"),
+                             (unknown, "unknown"),
+                             (deleted, "no longer exists")):
+            try:
+                progressive.rendered(server.url, [_id])
+            except progressive.RenderError as e:
+                assert message in str(e), e
+            else:
+                raise AssertionError("%s should have failed" % message)
+
+    finally:
+        server.stop()
+
+
+def test_deadline_farm_cache():
+    """Pools and groups are cached on disk"""
+    from anvil import deadline, standins
+
+    server = standins.DeadlineServer.start()
+    server.pools = ["none", "maya"]
+    cache = tempfile.mkdtemp()
+    os.environ["AVALON_DEADLINE_CACHE"] = os.path.join(cache, "farm.json")
+
+    try:
+        assert deadline.cached_farm(server.url) is None
+
+        farm = deadline.farm(server.url)
+        assert_equals(farm["pools"], ["none", "maya"])
+        assert_equals(server.requests, 2)
+
+        deadline.farm(server.url)
+        assert_equals(server.requests, 2)
+
+        server.pools.append("houdini")
+        farm = deadline.farm(server.url, ttl=0)
+        assert_equals(farm["pools"], ["none", "maya", "houdini"])
+        assert_equals(deadline.cached_farm(server.url)["pools"],
+                      farm["pools"])
+
+    finally:
+        os.environ.pop("AVALON_DEADLINE_CACHE")
+        server.stop()
+        shutil.rmtree(cache)
+
+
+def test_environment_profile():
+    """Jobs reference an environment written once"""
+    from anvil import environment
+
+    dirname = tempfile.mkdtemp()
+    session = {
+        "PYTHONPATH": "/path/to/setup",
+        "AVALON_CONFIG": "anvil",
+        "AVALON_PROJECT": "hulk",
+        "AVALON_ASSET": "bruce",
+    }
+
+    try:
+        path = environment.write(session, dirname)
+        assert_equals(environment.write(dict(session), dirname), path)
+        assert_equals(os.listdir(dirname), [os.path.basename(path)])
+
+        variables = environment.job_environment(path, session)
+        assert_equals(sorted(variables), ["AVALON_ASSET",
+                                          "AVALON_CONFIG",
+                                          "AVALON_ENVIRONMENT_PROFILE",
+                                          "AVALON_PROJECT",
+                                          "PYTHONPATH"])
+
+        # Remapped on the slave, and left as-is
+        variables["PYTHONPATH"] = "/mnt/setup"
+        environment.hydrate(variables)
+
+        assert_equals(variables["AVALON_PROJECT"], "hulk")
+        assert_equals(variables["AVALON_ASSET"], "bruce")
+        assert_equals(variables["PYTHONPATH"], "/mnt/setup")
+
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_environment_install():
+    """A slave installs with no more than the variables of its job"""
+    from anvil import environment
+
+    dirname = tempfile.mkdtemp()
+    environ = os.environ.copy()
+    session = api.Session.copy()
+
+    full = dict((key, value) for key, value in environ.items()
+                if key.startswith("AVALON_") or key == "PYTHONPATH")
+
+    try:
+        path = environment.write(full, dirname)
+        variables = environment.job_environment(path, full)
+
+        api.uninstall()
+
+        # As on a slave, given nothing but the variables of its job
+        for key in list(os.environ):
+            if key in full:
+                os.environ.pop(key)
+
+        for key in list(api.Session):
+            if key.startswith("AVALON_"):
+                api.Session.pop(key)
+
+        os.environ.update(variables)
+        api.install(maya)
+
+        assert_equals(os.environ["AVALON_TASK"], TASK_NAME)
+        assert_equals(api.Session["AVALON_SILO"], "assets")
+
+    finally:
+        api.uninstall()
+
+        os.environ.clear()
+        os.environ.update(environ)
+        api.Session.clear()
+        api.Session.update(session)
+
+        api.install(maya)
+        shutil.rmtree(dirname)
+
+
+def test_scan_incremental():
+    """Only render layers changed since last scanned are listed anew"""
+    from anvil import scan
+
+    workspace = tempfile.mkdtemp()
+
+    try:
+        for layer in ("beauty", "shadow"):
+            os.makedirs(os.path.join(workspace, layer))
+            for frame in range(1, 11):
+                fname = "%s.%04d.exr" % (layer, frame)
+                open(os.path.join(workspace, layer, fname), "w").close()
+
+        # Older than the listing, as though rendered earlier
+        past = time.time() - 60
+        for layer in ("beauty", "shadow"):
+            os.utime(os.path.join(workspace, layer), (past, past))
+
+        layers = scan.scan_layers(workspace, workers=2)
+        assert_equals([layer for layer, _, _ in layers],
+                      ["beauty", "shadow"])
+        assert_equals(len(layers[0][1][0].indexes), 10)
+
+        # Collections are copies, unaffected by the caller
+        layers[0][1][0].indexes.add(11)
+
+        listed = list()
+        listdir = scan.listdir
+
+        def counted(dirname):
+            listed.append(os.path.basename(dirname))
+            return listdir(dirname)
+
+        scan.listdir = counted
+
+        try:
+            fname = os.path.join(workspace, "shadow", "shadow.0011.exr")
+            open(fname, "w").close()
+            os.utime(os.path.dirname(fname), (past + 1, past + 1))
+
+            layers = scan.scan_layers(workspace, workers=2)
+
+        finally:
+            scan.listdir = listdir
+
+        assert_equals(sorted(listed),
+                      sorted([os.path.basename(workspace), "shadow"]))
+        assert_equals(len(layers[0][1][0].indexes), 10)
+        assert_equals(len(layers[1][1][0].indexes), 11)
+
+    finally:
+        scan.clear()
+        shutil.rmtree(workspace)
+
+
+def test_sequence_patterns():
+    """Sequences are compacted into ranges, and expanded back to paths"""
+    from anvil import sequence
+
+    # Stepped
+    names = ["a.%04d.exr" % index for index in range(1001, 1100, 2)]
+    pattern = sequence.compact(names)
+    assert_equals(pattern["indexes"], [[1001, 1099, 2]])
+    assert_equals(list(sequence.iter_names(pattern)), names)
+
+    # Gaps, each a range of its own
+    indexes = [1, 2, 3, 10, 11, 20, 30, 40, 41]
+    names = ["a.%04d.exr" % index for index in indexes]
+    pattern = sequence.compact(names)
+    assert_equals(pattern["indexes"],
+                  [[1, 3, 1], [10, 11, 1], [20, 40, 10], [41, 41, 1]])
+    assert_equals(sequence.count(pattern), len(indexes))
+    assert_equals(list(sequence.iter_indexes(pattern)), indexes)
+
+    # Mixed padding, not a single sequence
+    assert_equals(sequence.compact(["a.0001.exr", "a.002.exr"]), None)
+    assert_equals(sequence.compact(["a.0001.exr", "b.0002.exr"]), None)
+
+    # Outputs round-trip to a path per frame
+    dirname = os.path.join(self._tempdir, "v001")
+    paths = [os.path.join(dirname, name) for name in names]
+    pattern["dirname"] = dirname
+
+    outputs = [pattern, os.path.join(dirname, "a.ma")]
+    assert_equals(list(sequence.iter_outputs(outputs)),
+                  paths + [os.path.join(dirname, "a.ma")])
+
+
+def test_sequence_discrepancies():
+    """Missing, duplicate and surplus frames are reported as ranges"""
+    from anvil import sequence
+
+    frames = list(range(1, 100001))
+    del frames[499:600]
+    frames.extend([7, 8, 100005])
+
+    found = sequence.discrepancies(frames, 1, 100000)
+
+    assert_equals(found["missing"], [[500, 600, 1]])
+    assert_equals(found["duplicate"], [[7, 8, 1]])
+    assert_equals(found["outOfRange"], [[100005, 100005, 1]])
+
+    found = sequence.discrepancies([1, 3, 4, 5, 7], 1, 9, 2)
+    assert_equals(found["missing"], [[9, 9, 1]])
+    assert_equals(found["outOfRange"], [[4, 4, 1]])
+
+
+def test_probe_images():
+    """Empty and truncated images are found from their headers"""
+    import struct
+    from anvil import probe
+
+    def attribute(name, type_, value):
+        return b"%s\x00%s\x00" % (name, type_) + (
+            struct.pack("<i", len(value)) + value)
+
+    # Scanline image of 2x2 pixels of a single, half channel
+    header = probe.EXR_MAGIC + struct.pack("<I", 2) + b"".join([
+        attribute(b"channels", b"chlist",
+                  b"Y\x00" + struct.pack("<iB3xii", 1, 0, 1, 1) + b"\x00"),
+        attribute(b"compression", b"compression", b"\x00"),
+        attribute(b"dataWindow", b"box2i", struct.pack("<4i", 0, 0, 1, 1)),
+        attribute(b"displayWindow", b"box2i",
+                  struct.pack("<4i", 0, 0, 1, 1)),
+        attribute(b"lineOrder", b"lineOrder", b"\x00"),
+    ]) + b"\x00"
+
+    table = len(header) + 2 * 8
+    chunks = b"".join(struct.pack("<ii", y, 4) + b"\x00" * 4
+                      for y in range(2))
+    image = header + struct.pack("<QQ", table, table + 12) + chunks
+
+    dirname = tempfile.mkdtemp()
+
+    try:
+        paths = list()
+        for name, data in (("intact", image),
+                           ("truncated", image[:-2]),
+                           ("headless", image[:20]),
+                           ("empty", b"")):
+            paths.append(os.path.join(dirname, name + ".exr"))
+            with open(paths[-1], "wb") as f:
+                f.write(data)
+
+        results = probe.probe_all(paths, workers=2)
+
+        assert_equals([result["error"] for result in results],
+                      [None, "Truncated chunk", "Truncated header", "Empty"])
+        assert_equals(results[0]["size"], len(image))
+
+    finally:
+        shutil.rmtree(dirname)
+
+    assert_equals(probe.outliers([1000] * 50 + [10]), [50])
+
+
+def test_render_checksums():
+    """Frames are verified against checksums written at render time"""
+    import functools
+    from anvil import checksums, transfer
+
+    renders = tempfile.mkdtemp()
+    base = os.path.join(renders, "beauty")
+    os.makedirs(base)
+
+    try:
+        for frame in range(1, 5):
+            fname = os.path.join(base, "beauty.%04d.exr" % frame)
+            with open(fname, "w") as f:
+                f.write("frame %d" % frame)
+
+        # One manifest per task, of two frames each
+        checksums.write(base, 1, 2)
+        checksums.write(base, 3, 4)
+
+        manifest = checksums.load(base)
+        assert_equals(len(manifest), 4)
+
+        with open(os.path.join(base, "beauty.0004.exr"), "w") as f:
+            f.write("tampered")
+
+        function = checksums.verified(
+            functools.partial(transfer.copy, hashed=True), manifest)
+        transfers = [
+            (os.path.join(base, "beauty.%04d.exr" % frame),
+             os.path.join(renders, "published", "beauty.%04d.exr" % frame))
+            for frame in range(1, 6)
+        ]
+
+        # Rendered after checksums were written
+        with open(transfers[4][0], "w") as f:
+            f.write("frame 5")
+
+        try:
+            transfer.transfer(transfers, function=function)
+        except transfer.TransferError as e:
+            assert_equals([error[0] for error in e.errors],
+                          [transfers[3][0], transfers[4][0]])
+        else:
+            raise AssertionError("Tampered frames should have failed")
+
+        assert not os.path.exists(transfers[3][1])
+        assert not os.path.exists(transfers[4][1])
+
+        shutil.rmtree(os.path.join(renders, "published"))
+
+        results, _ = transfer.transfer(transfers[:3], function=function)
+        assert_equals([result["hash"] for result in results],
+                      [manifest["beauty.%04d.exr" % frame]
+                       for frame in range(1, 4)])
+
+        # Linked where possible, rather than always copied
+        assert_equals(set(result["method"] for result in results),
+                      set(["link"]))
+
+        # Hashed while copied, where it can't link
+        from avalon.vendor import filelink
+
+        def unsupported(src, dst):
+            raise OSError("Unsupported")
+
+        create = filelink.create
+        filelink.create = unsupported
+
+        try:
+            results, _ = transfer.transfer(transfers[:3], function=function)
+        finally:
+            filelink.create = create
+
+        assert_equals(set(result["method"] for result in results),
+                      set(["buffered"]))
+        assert_equals([result["hash"] for result in results],
+                      [manifest["beauty.%04d.exr" % frame]
+                       for frame in range(1, 4)])
+
+    finally:
+        shutil.rmtree(renders)
+
+
+def _plugins():
+    return {plugin.__name__: plugin for plugin in pyblish.api.discover()}
+
+
+def _render_context(workspace):
+    context = pyblish.api.Context()
+    context.data.update({
+        "workspaceDir": workspace,
+        "currentFile": os.path.join(workspace, "shot_v001.ma"),
+        "time": api.time(),
+        "user": "tester",
+        "results": [],
+    })
+
+    return context
+
+
+def test_resume_render_integration():
+    """Integration of renders, interrupted halfway, is resumed"""
+    from anvil import journal, scan, transfer
+
+    plugins = _plugins()
+    workspace = tempfile.mkdtemp()
+    os.environ["AVALON_JOURNALS"] = os.path.join(workspace, ".journals")
+
+    layer = os.path.join(workspace, "beauty")
+    os.makedirs(layer)
+
+    names = ["beauty.%04d.exr" % frame for frame in range(1, 5)]
+    for name in names:
+        with open(os.path.join(layer, name), "w") as f:
+            f.write(name)
+
+    with open(layer + ".json", "w") as f:
+        json.dump({"submission": {}, "instance": {}, "jobs": []}, f)
+
+    copy = transfer.copy
+
+    def interrupted(src, dst, directories=None):
+        if src.endswith("0003.exr"):
+            raise IOError("Interrupted")
+        return copy(src, dst, directories)
+
+    def integrate():
+        context = _render_context(workspace)
+        plugins["CollectAvaImageSequences"]().process(context)
+
+        instance, = list(context)
+        plugins["IntegrateAvalonAsset"]().process(instance)
+
+        return instance
+
+    try:
+        transfer.copy = interrupted
+
+        try:
+            integrate()
+        except transfer.TransferError:
+            pass
+        else:
+            raise AssertionError("Integration should have been interrupted")
+
+        finally:
+            transfer.copy = copy
+
+        # Kept out of the staging directory, which is collected anew
+        assert_equals(sorted(os.listdir(layer)), names)
+
+        first = journal.Journal.open(os.path.join(workspace,
+                                                  "shot_v001.ma"),
+                                     "beauty",
+                                     [names])
+        first.close()
+        assert first.resumed
+
+        scan.clear()
+        instance = integrate()
+
+        version = io.find_one({"_id": io.ObjectId(instance.data["versionId"])})
+        assert version is None, "Documents are written on flush"
+        assert_equals(instance.data["versionId"], first.version["_id"])
+
+    finally:
+        os.environ.pop("AVALON_JOURNALS")
+        shutil.rmtree(workspace)
+
+
+def test_journal_key():
+    """Journals are found across attempts, and expire unless resumed"""
+    from anvil import journal
+
+    dirname = tempfile.mkdtemp()
+    os.environ["AVALON_JOURNALS"] = dirname
+    scene = os.path.join(dirname, "scene.ma")
+
+    try:
+        # Extracted to a new staging directory each attempt
+        first = journal.Journal.open(scene, "modelDefault", ["model.ma"])
+        first.record_version(io.ObjectId(), 3, io.ObjectId())
+        first.close()
+
+        second = journal.Journal.open(scene, "modelDefault", ["model.ma"])
+        second.close()
+        assert second.resumed
+        assert_equals(second.version["name"], 3)
+
+        other = journal.Journal.open(scene, "modelDefault", ["other.ma"])
+        other.close()
+        assert not other.resumed
+
+        assert_equals(journal.prune(dirname), [])
+
+        past = time.time() - journal.max_age() - 60
+        os.utime(first.path, (past, past))
+
+        assert_equals(journal.prune(dirname), [first.path])
+        assert_equals(os.listdir(dirname), [os.path.basename(other.path)])
+
+    finally:
+        os.environ.pop("AVALON_JOURNALS")
+        shutil.rmtree(dirname)
+
+
+def test_store_deduplication():
+    """Identical content is stored once, however often it is put"""
+    from anvil import store
+
+    root = tempfile.mkdtemp()
+
+    try:
+        blobs = store.BlobStore.from_project(root, PROJECT_NAME)
+
+        src = os.path.join(root, "src.txt")
+        with open(src, "w") as f:
+            f.write("Hello")
+
+        first = blobs.put(src, os.path.join(root, "v001", "src.txt"))
+        second = blobs.put(src, os.path.join(root, "v002", "src.txt"))
+
+        assert_equals(first["hash"], store.hash_file(src))
+        assert_equals(second["hash"], first["hash"])
+        assert second["method"].endswith("(existing)"), second
+
+        assert_equals([hash for hash, _ in blobs.blobs()], [first["hash"]])
+
+        # Nothing left behind while storing
+        assert_equals(os.listdir(os.path.join(blobs.root, "tmp")), [])
+
+        with open(os.path.join(root, "v002", "src.txt")) as f:
+            assert_equals(f.read(), "Hello")
+
+    finally:
+        shutil.rmtree(root)
+
+
+def test_store_garbage_collection():
+    """Only blobs without references are collected"""
+    from anvil import store
+
+    root = tempfile.mkdtemp()
+
+    try:
+        blobs = store.BlobStore.from_project(root, PROJECT_NAME)
+
+        hashes = list()
+        for name in ("kept", "removed"):
+            src = os.path.join(root, name)
+            with open(src, "w") as f:
+                f.write(name)
+
+            dst = os.path.join(root, "published", name)
+            hashes.append(blobs.put(src, dst)["hash"])
+
+            # As once the version is deleted
+            os.remove(dst)
+
+        kept, removed = hashes
+        references = {kept: 1, removed: 0}
+
+        # Stored just now, and perhaps about to be linked
+        assert_equals(blobs.collect_garbage(references), [])
+
+        assert_equals(blobs.collect_garbage(references, dry_run=True,
+                                            grace=0),
+                      [blobs.path(removed)])
+        assert os.path.exists(blobs.path(removed))
+
+        assert_equals(blobs.collect_garbage(references, grace=0),
+                      [blobs.path(removed)])
+        assert os.path.exists(blobs.path(kept))
+        assert not os.path.exists(blobs.path(removed))
+
+    finally:
+        shutil.rmtree(root)
+
+
+def test_store_collected_meanwhile():
+    """Blobs collected while being published are stored anew"""
+    from anvil import store
+
+    root = tempfile.mkdtemp()
+
+    try:
+        blobs = store.BlobStore.from_project(root, PROJECT_NAME)
+
+        src = os.path.join(root, "src.txt")
+        with open(src, "w") as f:
+            f.write("Hello")
+
+        hash = blobs.put(src, os.path.join(root, "v001", "src.txt"))["hash"]
+        stored = list()
+        link = blobs.link
+
+        def collected(blob, dst):
+            if not stored:
+                # As by collect_garbage, in between checking and linking
+                stored.append(blob)
+                os.chmod(blob, 0o644)
+                os.remove(blob)
+
+            return link(blob, dst)
+
+        blobs.link = collected
+        result = blobs.put(src, os.path.join(root, "v002", "src.txt"))
+
+        assert_equals(result["hash"], hash)
+        assert os.path.exists(blobs.path(hash))
+
+        with open(os.path.join(root, "v002", "src.txt")) as f:
+            assert_equals(f.read(), "Hello")
+
+    finally:
+        shutil.rmtree(root)
+
+
+def test_templates_shared():
+    """Every instance of a publish formats with the same templates"""
+    import copy
+    from anvil import template
+
+    context = pyblish.api.Context()
+    project = {"config": copy.deepcopy(self._config)}
+
+    first = template.templates(context, project)
+
+    # As read anew by a later instance, after the project changed
+    project["config"]["template"]["publish"] = "{root}/changed"
+    second = template.templates(context, project)
+
+    assert second is first
+    assert_equals(second["publish"], self._config["template"]["publish"])
+
+    # Publishes are independent of each other
+    other = template.templates(pyblish.api.Context(), project)
+    assert_equals(other["publish"], "{root}/changed")
+
+
+def test_transfer_order():
+    """Results are returned in the order requested"""
+    from anvil import transfer
+
+    def slow(src, dst):
+        # Earlier transfers finish last
+        time.sleep(0.01 * (5 - int(src)))
+        return {"method": "slow"}
+
+    pairs = [(str(index), os.devnull) for index in range(5)]
+    results, stats = transfer.transfer(pairs, workers=5, function=slow)
+
+    assert_equals([result["src"] for result in results],
+                  [src for src, _ in pairs])
+    assert_equals(stats["files"], 5)
+
+
+def test_transfer_errors():
+    """Every failure is gathered into a single error"""
+    from anvil import transfer
+
+    attempted = list()
+
+    def failing(src, dst):
+        attempted.append(src)
+        if int(src) % 2:
+            raise IOError("Failed %s" % src)
+        return {"method": "failing"}
+
+    pairs = [(str(index), os.devnull) for index in range(6)]
+
+    try:
+        transfer.transfer(pairs, workers=3, function=failing)
+    except transfer.TransferError as e:
+        assert_equals([src for src, _, _ in e.errors], ["1", "3", "5"])
+    else:
+        raise AssertionError("Transfer should have failed")
+
+    assert_equals(sorted(attempted), [src for src, _ in pairs])
+
+
+def test_transfer_directories():
+    """Each directory is created once, regardless of files written to it"""
+    from anvil import transfer
+
+    created = list()
+    makedirs = transfer.makedirs
+    transfer.makedirs = created.append
+
+    try:
+        directories = transfer.Directories()
+        for dirname in ("/a", "/b", "/a", "/a", "/b"):
+            directories.makedirs(dirname)
+
+    finally:
+        transfer.makedirs = makedirs
+
+    assert_equals(created, ["/a", "/b"])
+
+
+def test_zero_copy_fallback():
+    """Unsupported strategies fall back, and are remembered"""
+    import errno
+    from anvil import transfer
+
+    attempts = list()
+
+    def strategy(name, error):
+        def copy(src, dst):
+            attempts.append(name)
+            if error is not None:
+                raise OSError(error, os.strerror(error))
+            shutil.copyfile(src, dst)
+        return (name, copy)
+
+    src = os.path.join(self._tempdir, "zero_copy_src")
+    with open(src, "w") as f:
+        f.write("Hello")
+
+    strategies = transfer.STRATEGIES
+    unsupported = transfer._unsupported
+    transfer.STRATEGIES = (
+        strategy("unsupported", errno.EXDEV),
+        strategy("supported", None),
+        strategy("buffered", None),
+    )
+    transfer._unsupported = set()
+
+    try:
+        dst = os.path.join(self._tempdir, "zero_copy_dst")
+
+        assert_equals(transfer.zero_copy(src, dst), "supported")
+        assert_equals(transfer.zero_copy(src, dst), "supported")
+        assert_equals(attempts, ["unsupported", "supported", "supported"])
+
+        device = os.stat(src).st_dev
+        assert_equals(transfer._unsupported,
+                      set([("unsupported", device, device)]))
+
+        # Other errors are raised, rather than hidden by a fallback
+        transfer.STRATEGIES = (
+            strategy("full", errno.ENOSPC),
+            strategy("buffered", None),
+        )
+
+        try:
+            transfer.zero_copy(src, dst)
+        except OSError as e:
+            assert_equals(e.errno, errno.ENOSPC)
+        else:
+            raise AssertionError("Copy should have failed")
+
+        assert_equals(len(transfer._unsupported), 1)
+
+    finally:
+        transfer.STRATEGIES = strategies
+        transfer._unsupported = unsupported
+
+
+def test_zero_copy_truncated():
+    """Copies cut short fail, rather than pass as complete"""
+    from anvil import transfer
+
+    src = os.path.join(self._tempdir, "truncated_src")
+    dst = os.path.join(self._tempdir, "truncated_dst")
+
+    with open(src, "wb") as f:
+        f.write(b"0" * 1024)
+
+    sendfile = getattr(os, "sendfile", None)
+
+    def short(out_fd, in_fd, offset, count):
+        # As a filesystem giving up halfway
+        if offset:
+            return 0
+
+        os.write(out_fd, b"0" * 100)
+        return 100
+
+    os.sendfile = short
+
+    try:
+        transfer._sendfile(src, dst)
+    except IOError as e:
+        assert "100 of 1024" in str(e), e
+    else:
+        raise AssertionError("Copy should have failed")
+
+    finally:
+        if sendfile is None:
+            del os.sendfile
+        else:
+            os.sendfile = sendfile
+
+
+def test_write_buffer_rollback():
+    """A failed instance leaves no documents nor files behind"""
+    from anvil import database
+
+    plugins = _plugins()
+    context = _render_context(self._tempdir)
+    buffer = database.write_buffer(context)
+
+    asset = io.find_one({"type": "asset", "name": ASSET_NAME})
+    subset_id = io.insert_one({
+        "schema": "avalon-core:subset-2.0",
+        "type": "subset",
+        "name": "rollbackDefault",
+        "data": {},
+        "parent": asset["_id"],
+    }).inserted_id
+    buffer.created_immediately(subset_id)
+
+    version_id = buffer.insert({"type": "version", "parent": subset_id})
+    representation_id = buffer.insert({"type": "representation",
+                                       "parent": version_id})
+
+    fname = os.path.join(self._tempdir, "rollbackDefault.ma")
+    open(fname, "w").close()
+    buffer.wrote(fname)
+
+    context.data["results"].append({"success": False})
+
+    try:
+        plugins["IntegrateAvalonFlush"]().process(context)
+    except Exception:
+        pass
+    else:
+        raise AssertionError("Flush should have failed")
+
+    for _id in (subset_id, version_id, representation_id):
+        assert_equals(io.find_one({"_id": _id}), None)
+
+    assert not os.path.exists(fname)
+
+
+def test_write_buffer_partial():
+    """Documents written prior to a failing document are removed"""
+    from anvil import database
+
+    buffer = database.WriteBuffer()
+    first = buffer.insert({"type": "version", "name": 1})
+    second = buffer.insert({"type": "version", "name": 2})
+
+    # Refused as a duplicate, once the first two have been written
+    buffer.insert({"_id": first, "type": "version", "name": 3})
+
+    try:
+        buffer.flush()
+    except Exception:
+        pass
+    else:
+        raise AssertionError("Flush should have failed")
+
+    assert_equals(io.find_one({"_id": first}), None)
+    assert_equals(io.find_one({"_id": second}), None)
+    assert_equals(len(buffer), 0)
+
+
+def test_document_cache():
+    """Documents are looked up once, until invalidated"""
+    from anvil import database
+
+    lookups = list()
+
+    def lookup(filter, projection):
+        lookups.append(filter)
+        return dict(filter, name="Bruce")
+
+    cache = database.DocumentCache(lookup)
+
+    asset = cache.find_one({"type": "asset"})
+    asset["name"] = "Hulk"
+
+    # Copies are returned, unaffected by changes to previous ones
+    assert_equals(cache.find_one({"type": "asset"})["name"], "Bruce")
+    cache.find_one({"type": "subset"})
+    assert_equals((cache.hits, cache.misses), (1, 2))
+
+    cache.invalidate("subset")
+    cache.find_one({"type": "asset"})
+    cache.find_one({"type": "subset"})
+    assert_equals((cache.hits, cache.misses), (2, 3))
+    assert_equals([filter["type"] for filter in lookups],
+                  ["asset", "subset", "subset"])
+
+    cache.invalidate()
+    cache.find_one({"type": "asset"})
+    assert_equals((cache.hits, cache.misses), (2, 4))
+
+    # Caches outside of publishing are never shared
+    assert database.document_cache() is not database.document_cache()
+
+
+def test_next_version_concurrent():
+    """Concurrent allocations never receive the same number"""
+    from multiprocessing.pool import ThreadPool
+    from anvil import database
+
+    subset_id = io.ObjectId()
+
+    pool = ThreadPool(8)
+    try:
+        numbers = pool.map(lambda _: database.next_version(subset_id),
+                           range(32))
+    finally:
+        pool.close()
+        pool.join()
+
+    assert_equals(sorted(numbers), list(range(1, 33)))
+
+
+def test_next_version_seeded():
+    """Counters start from the latest existing version"""
+    from anvil import database
+
+    subset_id = io.ObjectId()
+    io.insert_many([{"type": "version", "parent": subset_id, "name": name}
+                    for name in (1, 2, 7)])
+
+    assert_equals(database.next_version(subset_id), 8)
+
+    # Seeding anew never lowers a counter
+    database.seed_counters()
+    assert_equals(database.next_version(subset_id), 9)
+
+    io.delete_many({"parent": subset_id})
+
+
+def test_worker_queue():
+    """Jobs are claimed oldest first, and recovered once abandoned"""
+    import socket
+    import subprocess
+    from anvil import worker
+
+    root = tempfile.mkdtemp()
+    dirs = worker._dirs(root)
+
+    try:
+        first = worker.enqueue({"version": "a"}, root)
+        worker.enqueue({"version": "b"}, root, delay=60)
+
+        claimed = worker._claim(dirs)
+        assert_equals(os.path.basename(claimed),
+                      "%s@%s@%d" % (os.path.basename(first),
+                                    socket.gethostname(),
+                                    os.getpid()))
+
+        # Delayed
+        assert_equals(worker._claim(dirs), None)
+
+        # Claimed by this process, which is still running
+        worker._recover(dirs)
+        assert_equals(os.listdir(dirs["active"]),
+                      [os.path.basename(claimed)])
+
+        # Claimed by a process since exited
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+
+        abandoned = "%s@%s@%d" % (os.path.basename(first),
+                                  socket.gethostname(),
+                                  process.pid)
+        os.rename(claimed, os.path.join(dirs["active"], abandoned))
+
+        worker._recover(dirs)
+        assert_equals(os.listdir(dirs["active"]), [])
+        assert os.path.exists(first)
+
+        # Returned to the queue along with progress, and claimed no more
+        claimed = worker._claim(dirs)
+        worker._requeue(claimed, {"version": "a", "done": [[0, 1, 1]]},
+                        dirs, delay=60)
+
+        assert_equals(os.listdir(dirs["active"]), [])
+
+        requeued = [name for name in os.listdir(dirs["pending"])
+                    if name.endswith("-a.json")]
+        assert_equals(len(requeued), 1)
+
+        with open(os.path.join(dirs["pending"], requeued[0])) as f:
+            assert_equals(json.load(f)["done"], [[0, 1, 1]])
+
+    finally:
+        shutil.rmtree(root)
+
+
+def test_worker_credentials():
+    """Uploads without credentials are refused when queued"""
+    from anvil import worker
+
+    root = tempfile.mkdtemp()
+    username = os.environ.pop("AVALON_USERNAME", None)
+
+    try:
+        try:
+            worker.enqueue({"version": "a", "upload": True}, root)
+        except AssertionError as e:
+            assert "AVALON_USERNAME" in str(e), e
+        else:
+            raise AssertionError("Enqueue should have failed")
+
+        assert not os.path.exists(worker._dirs(root)["pending"])
+
+    finally:
+        if username is not None:
+            os.environ["AVALON_USERNAME"] = username
+
+        shutil.rmtree(root)
+
+
+def test_worker_skip_existing():
+    """Only files identical to their source are skipped"""
+    from anvil import worker
+
+    root = tempfile.mkdtemp()
+    transferred = list()
+
+    def copy(src, dst):
+        transferred.append(src)
+        shutil.copyfile(src, dst)
+        return {"method": "copy"}
+
+    try:
+        src = os.path.join(root, "src")
+        dst = os.path.join(root, "dst")
+
+        with open(src, "w") as f:
+            f.write("first")
+
+        resumable = worker.skip_existing(copy)
+        resumable(src, dst)
+        assert_equals(resumable(src, dst), {"method": "existing"})
+
+        # Rendered anew, of equal size
+        with open(src, "w") as f:
+            f.write("again")
+        os.utime(src, (time.time() + 10, time.time() + 10))
+
+        assert_equals(resumable(src, dst), {"method": "copy"})
+        assert_equals(len(transferred), 2)
+
+        # Of equal size and age, but differing content
+        with open(dst, "w") as f:
+            f.write("other")
+
+        hashed = worker.skip_existing(copy, hashed=True)
+        assert_equals(hashed(src, dst), {"method": "copy"})
+        assert_equals(hashed(src, dst)["method"], "existing")
+
+    finally:
+        shutil.rmtree(root)
+
+
+def test_worker_status():
+    """Versions are flipped from pending to complete once transferred"""
+    from anvil import worker
+
+    root = tempfile.mkdtemp()
+    version_id = io.insert_one({
+        "type": "version",
+        "data": {"status": worker.PENDING},
+    }).inserted_id
+
+    try:
+        src = os.path.join(root, "src.txt")
+        with open(src, "w") as f:
+            f.write("Hello")
+
+        dst = os.path.join(root, "published", "src.txt")
+
+        worker.enqueue({
+            "project": PROJECT_NAME,
+            "version": str(version_id),
+            "transfers": [[src, dst, str(io.ObjectId())]],
+        }, root)
+
+        assert_equals(worker.run(root, idle=0.5), 1)
+        assert os.path.exists(dst)
+
+        version = io.find_one({"_id": version_id})
+        assert_equals(version["data"]["status"], worker.COMPLETE)
+
+    finally:
+        io.delete_many({"_id": version_id})
+        shutil.rmtree(root)
@@ -0,0 +1,557 @@
+"""File transfer engine used during integration
+
+Files are linked, or copied where linking isn't possible, by a bounded
+pool of threads. Results are returned in the order they were requested,
+regardless of the order in which they finish.
+
+"""
+
+import os
+import time
+import errno
+import shutil
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger(__name__)
+
+# Number of simultaneous transfers, unless otherwise specified
+# via the AVALON_TRANSFER_WORKERS environment variable.
+DEFAULT_WORKERS = 8
+
+
+class TransferError(Exception):
+    """One or more files failed to transfer"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(TransferError, self).__init__(
+            "%d file(s) failed to transfer:\n%s" % (
+                len(errors),
+                "\n".join("  %s -> %s: %s" % error for error in errors)
+            )
+        )
+
+
+def max_workers():
+    """Return configured number of concurrent transfers"""
+    try:
+        count = int(os.getenv("AVALON_TRANSFER_WORKERS", DEFAULT_WORKERS))
+    except ValueError:
+        count = DEFAULT_WORKERS
+
+    return max(1, count)
+
+
+def makedirs(dirname):
+    """Create `dirname`, tolerating that it may already exist
+
+    Safe to call from multiple threads at once.
+
+    """
+
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class Directories(object):
+    """Directories known to exist
+
+    Each directory costs at most one call to :func:`os.makedirs`,
+    as opposed to one per file written to it.
+
+    """
+
+    def __init__(self):
+        self._existing = set()
+
+    def makedirs(self, dirname):
+        if dirname in self._existing:
+            return
+
+        makedirs(dirname)
+        self._existing.add(dirname)
+
+
+def directories(context):
+    """Return directories known to exist, per publishing `context`"""
+    if "directories" not in context.data:
+        context.data["directories"] = Directories()
+
+    return context.data["directories"]
+
+
+def copy(src, dst, directories=None, hashed=False):
+    """Link `src` to `dst`, falling back to a copy
+
+    Arguments:
+        src (str): Absolute path to source file
+        dst (str): Absolute path to destination file
+        directories (Directories, optional): Known directories
+        hashed (bool, optional): Also return the content hash of `dst`,
+            computed while copying, see :func:`anvil.checksums.hash_file`
+
+    Returns:
+        result (dict): With "method" being either "link", or the
+            strategy used to copy, see :func:`zero_copy`, and
+            "hash" when `hashed`
+
+    """
+
+    from avalon.vendor import filelink
+
+    if directories is not None:
+        directories.makedirs(os.path.dirname(dst))
+    else:
+        makedirs(os.path.dirname(dst))
+
+    try:
+        filelink.create(src, dst)
+        result = {"method": "link"}
+
+        if hashed:
+            from . import checksums
+
+            # A hardlink is the very same inode as its source,
+            # such that this is the content of `dst` as well.
+            result["hash"] = checksums.hash_file(dst)
+
+        return result
+
+    except Exception:
+        # Revert to a normal copy
+        # TODO(marcus): Once filelink is proven stable,
+        # improve upon or remove this fallback.
+
+        # An existing `dst` may be a link to `src`,
+        # and writing through it would truncate `src`.
+        try:
+            os.remove(dst)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        if hashed:
+            # Read once, hashing what is written as it is written
+            result = {"method": "buffered", "hash": _hashed(src, dst)}
+        else:
+            result = {"method": zero_copy(src, dst)}
+
+        shutil.copymode(src, dst)
+        return result
+
+
+def _hashed(src, dst):
+    """Copy `src` to `dst` in one pass, returning the hash of what was written
+
+    Hashing the stream, as opposed to the source once more, hashes
+    exactly what went into `dst`.
+
+    """
+
+    import hashlib
+
+    from . import checksums
+
+    digest = hashlib.new(checksums.ALGORITHM)
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        for chunk in iter(lambda: fsrc.read(checksums.CHUNK_SIZE), b""):
+            fdst.write(chunk)
+            digest.update(chunk)
+
+    return "%s:%s" % (checksums.ALGORITHM, digest.hexdigest())
+
+
+def reflink(src, dst):
+    """Clone `src` to `dst` sharing its data blocks, Linux only
+
+    Raises:
+        OSError when unsupported by the platform or filesystem
+
+    """
+
+    import fcntl
+
+    # From <linux/fs.h>
+    FICLONE = 0x40049409
+
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except (IOError, OSError):
+                fdst.close()
+                os.remove(dst)
+                raise
+
+
+def _copy_file_range(src, dst):
+    """Copy within the kernel, server-side on NFS 4.2, Python 3.8+"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        remaining = size
+
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(),
+                                        fdst.fileno(),
+                                        remaining)
+            if copied == 0:
+                break
+
+            remaining -= copied
+
+    _assert_copied(dst, size)
+
+
+def _sendfile(src, dst):
+    """Copy within the kernel, Linux 2.6.33+"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        remaining = size
+        offset = 0
+
+        while remaining > 0:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(),
+                               offset, remaining)
+            if sent == 0:
+                break
+
+            offset += sent
+            remaining -= sent
+
+    _assert_copied(dst, size)
+
+
+def _assert_copied(dst, size):
+    """Raise should `dst` be other than `size` bytes, e.g. cut short"""
+    written = os.path.getsize(dst)
+
+    if written != size:
+        raise IOError(errno.EIO, "Copied %d of %d bytes to %s"
+                      % (written, size, dst))
+
+
+def _buffered(src, dst):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+# In order of preference
+STRATEGIES = (
+    ("reflink", reflink),
+    ("copy_file_range", _copy_file_range),
+    ("sendfile", _sendfile),
+    ("buffered", _buffered),
+)
+
+# Strategies found unsupported, per (strategy, device of source,
+# device of destination), as some, such as reflink, depend on both.
+_unsupported = set()
+
+# Errors meaning a strategy is unsupported, as opposed to having failed
+UNSUPPORTED = tuple(
+    getattr(errno, name) for name in ("EXDEV",
+                                      "EOPNOTSUPP",
+                                      "ENOTSUP",
+                                      "ENOSYS",
+                                      "EINVAL",
+                                      "ENOTTY")
+    if hasattr(errno, name)
+)
+
+
+def zero_copy(src, dst):
+    """Copy `src` to `dst` with the cheapest strategy available
+
+    Strategies unsupported by the platform or by the filesystems of
+    `src` and `dst` are remembered, and not attempted again for
+    those filesystems. Any other error is raised.
+
+    Returns:
+        method (str): Name of strategy used, see :data:`STRATEGIES`
+
+    """
+
+    devices = (os.stat(src).st_dev,
+               os.stat(os.path.dirname(dst) or ".").st_dev)
+
+    for name, strategy in STRATEGIES[:-1]:
+        key = (name,) + devices
+
+        if key in _unsupported:
+            continue
+
+        try:
+            strategy(src, dst)
+            return name
+
+        except (ImportError, AttributeError):
+            # Unavailable on this platform or Python
+            _unsupported.add(key)
+
+        except (IOError, OSError) as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+
+            _unsupported.add(key)
+
+    name, strategy = STRATEGIES[-1]
+    strategy(src, dst)
+    return name
+
+
+def _transfer_one(args):
+    function, (src, dst) = args
+    result = {
+        "src": src,
+        "dst": dst,
+        "size": 0,
+        "method": None,
+        "error": None,
+    }
+
+    try:
+        result.update(function(src, dst))
+        result["size"] = os.path.getsize(dst)
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+
+    return result
+
+
+def transfer(transfers, workers=None, function=copy, log=log):
+    """Transfer each (src, dst) pair in `transfers` concurrently
+
+    Every transfer is attempted, failures are gathered and raised
+    together once all transfers have finished.
+
+    Arguments:
+        transfers (list): Pairs of (src, dst) absolute paths
+        workers (int, optional): Maximum number of simultaneous
+            transfers, defaults to :func:`max_workers`
+        function (callable, optional): Called with (src, dst) per
+            transfer, returning a dictionary with at least "method".
+            Defaults to :func:`copy`
+        log (logging.Logger, optional): Destination of progress messages
+
+    Returns:
+        results (list): One dictionary per transfer, in the order
+            of `transfers`, with keys "src", "dst", "size",
+            "method" and "error", along with anything
+            returned by `function`
+        stats (dict): Aggregate "files", "bytes", "seconds"
+            and "rate" in bytes/second
+
+    Raises:
+        TransferError on one or more failed transfers
+
+    """
+
+    transfers = list(transfers)
+    workers = min(workers or max_workers(), len(transfers)) or 1
+
+    results = list()
+    started = time.time()
+
+    pool = ThreadPool(workers)
+    try:
+        jobs = ((function, pair) for pair in transfers)
+        for result in pool.imap(_transfer_one, jobs):
+            if result["error"] is None:
+                log.debug("%s %s -> %s" % (
+                    result["method"].title(),
+                    result["src"],
+                    result["dst"])
+                )
+
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = max(time.time() - started, 1e-6)
+    total = sum(result["size"] for result in results)
+
+    stats = {
+        "files": len(results),
+        "bytes": total,
+        "seconds": elapsed,
+        "rate": total / elapsed,
+    }
+
+    errors = [
+        (result["src"], result["dst"], result["error"])
+        for result in results
+        if result["error"] is not None
+    ]
+
+    if errors:
+        raise TransferError(errors)
+
+    return results, stats
+
+
+def format_rate(stats):
+    """Return human-readable summary of `stats` from :func:`transfer`"""
+    rate = stats["rate"]
+    for unit in ("B", "KB", "MB", "GB"):
+        if rate < 1024.0:
+            break
+        rate /= 1024.0
+    else:
+        unit = "TB"
+
+    return "%d file(s), %d bytes in %.2fs (%.1f %s/s)" % (
+        stats["files"], stats["bytes"], stats["seconds"], rate, unit
+    )
+
+
+def benchmark(size=256, repeats=3, dirname=None):
+    """Compare copy strategies against each other
+
+    Arguments:
+        size (int, optional): Size of file copied, in megabytes
+        repeats (int, optional): Best of this many runs is reported
+        dirname (str, optional): Directory in which to copy,
+            defaults to a temporary directory
+
+    Returns:
+        timings (dict): Best time in seconds per strategy,
+            None for strategies unsupported here
+
+    """
+
+    import tempfile
+
+    tempdir = tempfile.mkdtemp(dir=dirname)
+    src = os.path.join(tempdir, "src")
+
+    try:
+        with open(src, "wb") as f:
+            for _ in range(size):
+                f.write(os.urandom(1024 * 1024))
+
+        timings = dict()
+        for name, strategy in STRATEGIES:
+            dst = os.path.join(tempdir, name)
+            best = None
+
+            for _ in range(repeats):
+                started = time.time()
+
+                try:
+                    strategy(src, dst)
+                except (ImportError, AttributeError, IOError, OSError):
+                    break
+
+                elapsed = time.time() - started
+                best = elapsed if best is None else min(best, elapsed)
+
+                os.remove(dst)
+
+            timings[name] = best
+
+    finally:
+        shutil.rmtree(tempdir)
+
+    return timings
+
+
+def benchmark_directories(frames=5000, repeats=3, dirname=None):
+    """Compare transfers creating directories per file and per publish
+
+    As integrated, with each frame of a sequence transferred
+    to the same directory, see IntegrateAvalonAsset.
+
+    Returns:
+        timings (tuple): Best time in seconds for (per file, per publish)
+
+    """
+
+    import tempfile
+    import functools
+
+    tempdir = tempfile.mkdtemp(dir=dirname)
+    staging = os.path.join(tempdir, "staging")
+    os.makedirs(staging)
+
+    try:
+        names = ["beauty.%04d.exr" % frame for frame in range(frames)]
+        for name in names:
+            with open(os.path.join(staging, name), "wb") as f:
+                f.write(b"0")
+
+        def per_file():
+            return copy
+
+        def per_publish():
+            return functools.partial(copy, directories=Directories())
+
+        timings = list()
+        for function in (per_file, per_publish):
+            best = None
+
+            for index in range(repeats):
+                publish = os.path.join(tempdir, "publish%d" % index,
+                                       "hulk", "assets", "Bruce",
+                                       "publish", "renderBeauty", "v001")
+                transfers = [(os.path.join(staging, name),
+                              os.path.join(publish, name))
+                             for name in names]
+
+                started = time.time()
+                transfer(transfers, function=function())
+                elapsed = time.time() - started
+
+                shutil.rmtree(os.path.join(tempdir, "publish%d" % index))
+                best = elapsed if best is None else min(best, elapsed)
+
+            timings.append(best)
+
+    finally:
+        shutil.rmtree(tempdir)
+
+    return tuple(timings)
+
+
+def _main():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m anvil.transfer")
+    parser.add_argument("command", choices=["benchmark", "directories"])
+    parser.add_argument("--size", type=int, default=256,
+                        help="Size of file in megabytes")
+    parser.add_argument("--frames", type=int, default=5000,
+                        help="Number of frames, for directories")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--dir", help="Directory on filesystem to test")
+
+    args = parser.parse_args()
+
+    if args.command == "directories":
+        per_file, per_publish = benchmark_directories(args.frames,
+                                                      args.repeats,
+                                                      args.dir)
+        print("%-16s %8.3fs" % ("per file", per_file))
+        print("%-16s %8.3fs (%.1fx)" % ("per publish", per_publish,
+                                        per_file / max(per_publish, 1e-9)))
+        return
+
+    timings = benchmark(args.size, args.repeats, args.dir)
+
+    for name, _ in STRATEGIES:
+        seconds = timings[name]
+        if seconds is None:
+            print("%-16s unsupported" % name)
+        else:
+            print("%-16s %8.3fs %10.1f MB/s"
+                  % (name, seconds, args.size / max(seconds, 1e-6)))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,827 @@
+"""Upload published files to AVALON_LOCATION
+
+Files published beneath the registered root are PUT to the
+same relative path at the remote location, concurrently and over
+a pool of persistent connections.
+
+Files larger than a chunk are uploaded one chunk at a time, each
+a PUT with a Content-Range header. The remote responds with
+
+    - 308 and a Range header of bytes acknowledged thus far
+    - 201 once the last chunk has been received
+    - 416 and a Range header, on a chunk not following the last
+
+A PUT of "Content-Range: bytes */<size>" and no body queries the
+bytes acknowledged. Acknowledged offsets are also kept locally, such
+that an interrupted upload resumes from the last acknowledged chunk,
+even in a later session. See :class:`anvil.standins.UploadServer`
+for a reference implementation of the remote.
+
+With AVALON_UPLOAD_DELTA set, files the remote already has are
+registered by reference rather than uploaded. The remote is asked
+for the content hash of each file, see :func:`anvil.store.hash_file`,
+with a HEAD of
+
+    <location>/blobs/<algorithm>/<hexdigest>
+
+Responding with 200 if it has the content, and 404 otherwise. A file
+it has is then registered with a PUT of no body, and an "X-Reference"
+header of the hash. Uploads carry an "X-Content-Hash" header, such that
+the remote may index their content for later versions.
+
+Files of compressible formats, such as Maya ASCII and JSON, are
+compressed on the fly with a Content-Encoding of "zstd", where the
+zstandard package is available, or "gzip". The remote is asked once for
+the encodings it accepts, with an OPTIONS of <location>/upload answered
+by an Accept-Encoding header, and files are sent uncompressed to remotes
+accepting none. Chunks are compressed individually, their Content-Range
+referring to the uncompressed file. Compare wall time with
+
+    $ python -m anvil.upload benchmark
+
+"""
+
+import os
+import re
+import zlib
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger(__name__)
+
+# Number of simultaneous uploads, unless otherwise specified
+# via the AVALON_UPLOAD_WORKERS environment variable.
+DEFAULT_WORKERS = 4
+
+# Size of chunks in megabytes, unless otherwise specified
+# via the AVALON_UPLOAD_CHUNK_SIZE environment variable.
+DEFAULT_CHUNK_SIZE = 64
+
+
+class UploadError(Exception):
+    """One or more files failed to upload"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(UploadError, self).__init__(
+            "%d file(s) failed to upload:\n%s" % (
+                len(errors),
+                "\n".join("  %s -> %s: %s" % error for error in errors)
+            )
+        )
+
+
+class _Retry(Exception):
+    """Transient failure, the upload may be attempted again"""
+
+    def __init__(self, message, progressed=False):
+        super(_Retry, self).__init__(message)
+
+        # Whether any chunk was acknowledged prior to failing
+        self.progressed = progressed
+
+
+def default_chunk_size():
+    """Return configured size of chunks, in bytes"""
+    try:
+        size = int(os.getenv("AVALON_UPLOAD_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        size = DEFAULT_CHUNK_SIZE
+
+    return max(1, size) * 1024 * 1024
+
+
+def max_workers():
+    """Return configured number of concurrent uploads"""
+    try:
+        count = int(os.getenv("AVALON_UPLOAD_WORKERS", DEFAULT_WORKERS))
+    except ValueError:
+        count = DEFAULT_WORKERS
+
+    return max(1, count)
+
+
+# Extensions compressed on upload, unless otherwise specified via
+# the AVALON_UPLOAD_COMPRESS environment variable, e.g. "ma,json".
+# Formats compressed already, such as .exr and .abc, are sent as-is.
+COMPRESSIBLE = (
+    ".ma",
+    ".mel",
+    ".json",
+    ".txt",
+    ".xml",
+    ".obj",
+    ".usda",
+)
+
+IDENTITY = "identity"
+
+
+def compressible():
+    """Return configured extensions to compress, e.g. (".ma", ".json")"""
+    extensions = os.getenv("AVALON_UPLOAD_COMPRESS")
+    if extensions is None:
+        return COMPRESSIBLE
+
+    return tuple("." + extension.strip().lstrip(".").lower()
+                 for extension in extensions.split(",")
+                 if extension.strip())
+
+
+def encodings():
+    """Return content encodings available locally, preferred first"""
+    available = ["gzip"]
+
+    try:
+        import zstandard  # noqa
+    except ImportError:
+        pass
+    else:
+        available.insert(0, "zstd")
+
+    return available
+
+
+def _compressor(encoding):
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    import zstandard
+    return zstandard.ZstdCompressor().compressobj()
+
+
+def encode(data, encoding):
+    """Return `data` compressed with `encoding`"""
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def iter_encoded(f, encoding, chunk_size=1024 * 1024):
+    """Compress file object `f` with `encoding`, one piece at a time"""
+    compressor = _compressor(encoding)
+
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+class RateLimit(object):
+    """Cap bytes/second across concurrent uploads
+
+    A token bucket, holding up to a second worth of bytes. Those
+    consuming more than is available wait for the difference.
+
+    Arguments:
+        rate (float): Bytes per second
+
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        """Wait until `count` bytes may be sent"""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.rate,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            # Borrowed, such that waiting is first come first served
+            self._tokens -= count
+            wait = -self._tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def iter_throttled(self, chunks):
+        for chunk in chunks:
+            self.consume(len(chunk))
+            yield chunk
+
+
+def delta_enabled():
+    """Return whether to skip uploading content the remote already has"""
+    return bool(os.getenv("AVALON_UPLOAD_DELTA"))
+
+
+def remote_path(src, root, location):
+    """Return remote destination of published file `src`"""
+    assert src.startswith(root), (
+        "Output didn't reside on root, this is a bug"
+    )
+
+    return src.replace(root, location + "/upload").replace("\\", "/")
+
+
+class Manifest(object):
+    """Acknowledged offset of chunked uploads, kept on local disk
+
+    State is discarded should the source file change.
+
+    Arguments:
+        root (str, optional): Directory of state, defaults to
+            AVALON_UPLOAD_STATE or ~/.avalon/uploads
+
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv(
+            "AVALON_UPLOAD_STATE",
+            os.path.join(os.path.expanduser("~"), ".avalon", "uploads")
+        )
+
+    def _path(self, dst):
+        name = hashlib.sha1(dst.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, name + ".json")
+
+    @staticmethod
+    def _signature(src):
+        stat = os.stat(src)
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def load(self, src, dst):
+        """Return acknowledged offset of `src` at `dst`, or 0"""
+        try:
+            with open(self._path(dst)) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return 0
+
+        if state["src"] != src or state["signature"] != self._signature(src):
+            return 0
+
+        return state["offset"]
+
+    def save(self, src, dst, offset):
+        from . import transfer
+
+        transfer.makedirs(self.root)
+
+        with open(self._path(dst), "w") as f:
+            json.dump({"src": src,
+                       "dst": dst,
+                       "signature": self._signature(src),
+                       "offset": offset}, f)
+
+    def discard(self, dst):
+        try:
+            os.remove(self._path(dst))
+        except OSError:
+            pass
+
+
+def _acknowledged(response):
+    """Return number of bytes acknowledged by `response`"""
+    match = re.match(r"bytes=0-(\d+)", response.headers.get("Range", ""))
+    return int(match.group(1)) + 1 if match else 0
+
+
+class Uploader(object):
+    """Upload files over a shared pool of keep-alive connections
+
+    Arguments:
+        root (str): Registered root, e.g. api.registered_root()
+        location (str): Remote location, e.g. AVALON_LOCATION
+        username (str): Username of remote location
+        password (str): Password of remote location
+        workers (int, optional): Maximum number of simultaneous
+            uploads, defaults to :func:`max_workers`
+        retries (int, optional): Attempts per file beyond the first,
+            on connection errors and 5xx responses
+        backoff (float, optional): Seconds to wait before the first
+            retry, doubled for each retry thereafter
+        chunk_size (int, optional): Files larger than this many bytes
+            are uploaded in chunks, defaults to :func:`default_chunk_size`
+        manifest (Manifest, optional): State of chunked uploads
+        delta (bool, optional): Register content the remote already
+            has by reference, defaults to :func:`delta_enabled`
+        hashes (dict, optional): Known content hash per absolute path,
+            computed where missing
+        compress (tuple, optional): Extensions to compress where the
+            remote accepts it, defaults to :func:`compressible`
+        rate_limit (RateLimit, optional): Cap shared with other uploaders
+        log (logging.Logger, optional): Destination of progress messages
+
+    """
+
+    def __init__(self,
+                 root,
+                 location,
+                 username,
+                 password,
+                 workers=None,
+                 retries=3,
+                 backoff=0.5,
+                 chunk_size=None,
+                 manifest=None,
+                 delta=None,
+                 hashes=None,
+                 compress=None,
+                 rate_limit=None,
+                 log=log):
+
+        from avalon.vendor import requests
+
+        self.root = root
+        self.location = location
+        self.workers = workers or max_workers()
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size or default_chunk_size()
+        self.manifest = manifest or Manifest()
+        self.delta = delta_enabled() if delta is None else delta
+        self.hashes = hashes or dict()
+        self.compress = tuple(compressible() if compress is None
+                              else compress)
+        self.rate_limit = rate_limit
+        self.log = log
+
+        # Negotiated with the remote on first use
+        self._encoding = None
+        self._lock = threading.Lock()
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.workers
+        )
+
+        session = requests.Session()
+        session.auth = requests.auth.HTTPBasicAuth(username, password)
+        session.headers["Content-Type"] = "application/octet-stream"
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        self.session = session
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _negotiate(self):
+        """Return encoding accepted by the remote, or IDENTITY"""
+        from avalon.vendor import requests
+
+        with self._lock:
+            if self._encoding is not None:
+                return self._encoding
+
+            try:
+                response = self.session.options(self.location + "/upload")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                raise _Retry(str(e))
+
+            accepted = [
+                encoding.split(";", 1)[0].strip()
+                for encoding in response.headers.get(
+                    "Accept-Encoding", "").split(",")
+            ] if response.ok else []
+
+            self._encoding = next(
+                (encoding for encoding in encodings()
+                 if encoding in accepted), IDENTITY
+            )
+
+            self.log.debug("Uploading with Content-Encoding: %s"
+                           % self._encoding)
+
+            return self._encoding
+
+    def _encoding_of(self, src):
+        """Return encoding with which to send `src`, or None"""
+        if not src.lower().endswith(self.compress):
+            return None
+
+        encoding = self._negotiate()
+        return None if encoding == IDENTITY else encoding
+
+    def _declined(self, response, encoding):
+        """Return whether the remote refused `encoding` of `response`"""
+        if encoding is None or response.status_code != 415:
+            return False
+
+        self.log.warning("Remote declined %s, uploading uncompressed"
+                         % encoding)
+        self._encoding = IDENTITY
+
+        return True
+
+    def _put(self, src, dst, headers=None):
+        encoding = self._encoding_of(src)
+
+        if os.path.getsize(src) > self.chunk_size:
+            return self._put_chunked(src, dst, headers, encoding)
+
+        from avalon.vendor import requests
+
+        with open(src, "rb") as f:
+            data = f
+            encoded = headers
+
+            if encoding is not None:
+                data = iter_encoded(f, encoding)
+                encoded = dict(headers or {},
+                               **{"Content-Encoding": encoding})
+
+            if self.rate_limit is not None:
+                if data is f:
+                    data = iter(lambda: f.read(1024 * 1024), b"")
+
+                data = self.rate_limit.iter_throttled(data)
+
+            try:
+                response = self.session.put(dst, data=data, headers=encoded)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                raise _Retry(str(e))
+
+        if self._declined(response, encoding):
+            return self._put(src, dst, headers)
+
+        if response.status_code >= 500 or response.status_code == 429:
+            raise _Retry("%d: %s" % (response.status_code, response.text))
+
+        if not response.ok:
+            raise Exception(response.text)
+
+        return os.path.getsize(src)
+
+    def _put_range(self, dst, start, end, size, data=b"", headers=None,
+                   encoding=None):
+        from avalon.vendor import requests
+
+        if self._encoding == IDENTITY:
+            # Declined since
+            encoding = None
+
+        encoded = dict(headers or {})
+
+        if data:
+            encoded["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+        else:
+            # Query
+            encoded["Content-Range"] = "bytes */%d" % size
+            encoding = None
+
+        body = data
+        if encoding is not None:
+            body = encode(data, encoding)
+            encoded["Content-Encoding"] = encoding
+
+        if self.rate_limit is not None:
+            self.rate_limit.consume(len(body))
+
+        try:
+            response = self.session.put(dst, data=body, headers=encoded)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _Retry(str(e))
+
+        if self._declined(response, encoding):
+            return self._put_range(dst, start, end, size, data, headers)
+
+        if response.status_code >= 500 or response.status_code == 429:
+            raise _Retry("%d: %s" % (response.status_code, response.text))
+
+        if response.status_code in (200, 201):
+            return size
+
+        if response.status_code in (308, 416):
+            return _acknowledged(response)
+
+        raise Exception(response.text)
+
+    def _put_chunked(self, src, dst, headers=None, encoding=None):
+        """Upload `src` in chunks, resuming from the last acknowledged
+
+        Returns:
+            size (int): Number of bytes sent
+
+        """
+
+        size = os.path.getsize(src)
+        offset = 0
+        sent = 0
+
+        if self.manifest.load(src, dst):
+            # The remote has the final say
+            offset = self._put_range(dst, 0, 0, size)
+            self.log.info("Resuming %s from %d of %d bytes"
+                          % (src, offset, size))
+
+        with open(src, "rb") as f:
+            while offset < size:
+                f.seek(offset)
+                data = f.read(self.chunk_size)
+                end = offset + len(data) - 1
+
+                try:
+                    acknowledged = self._put_range(dst, offset, end,
+                                                   size, data, headers,
+                                                   encoding)
+                except _Retry as e:
+                    raise _Retry(str(e), progressed=sent > 0)
+
+                if acknowledged == offset:
+                    raise _Retry("No progress at offset %d" % offset,
+                                 progressed=sent > 0)
+
+                sent += max(0, acknowledged - offset)
+                offset = acknowledged
+
+                self.manifest.save(src, dst, offset)
+
+        self.manifest.discard(dst)
+
+        return sent
+
+    def _reference(self, dst, hash):
+        """Register `dst` as content `hash`, if the remote has it
+
+        Returns:
+            referenced (bool): Whether `dst` was registered
+
+        """
+
+        from avalon.vendor import requests
+
+        algorithm, hexdigest = hash.split(":", 1)
+        blob = "%s/blobs/%s/%s" % (self.location, algorithm, hexdigest)
+
+        try:
+            # Asked first, as a remote unaware of references
+            # would otherwise store the empty body as-is.
+            response = self.session.head(blob)
+            if response.status_code == 200:
+                response = self.session.put(dst,
+                                            data=b"",
+                                            headers={"X-Reference": hash})
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _Retry(str(e))
+
+        if response.status_code >= 500 or response.status_code == 429:
+            raise _Retry("%d: %s" % (response.status_code, response.text))
+
+        # Anything else, e.g. 404 or 405, is uploaded as usual
+        return response.status_code in (200, 201)
+
+    def upload_one(self, src, hash=None):
+        """Upload `src`, retrying transient failures with backoff
+
+        Arguments:
+            src (str): Absolute path to published file
+            hash (str, optional): Content hash of `src`, if known
+
+        Returns:
+            size (int): Number of bytes uploaded, 0 if referenced
+            referenced (bool): Whether the remote already had `src`
+
+        """
+
+        dst = remote_path(src, self.root, self.location)
+        self.log.debug("Uploading %s -> %s" % (src, dst))
+
+        headers = None
+
+        if self.delta:
+            from . import store
+
+            hash = hash or self.hashes.get(src) or store.hash_file(src)
+            headers = {"X-Content-Hash": hash}
+        else:
+            hash = None
+
+        attempt = 0
+        while True:
+            try:
+                if hash is not None and self._reference(dst, hash):
+                    return 0, True
+
+                # Checked once, rather than on every retry
+                hash = None
+
+                return self._put(src, dst, headers), False
+
+            except _Retry as e:
+                if e.progressed:
+                    attempt = 0
+
+                if attempt >= self.retries:
+                    raise Exception("Gave up after %d attempt(s): %s"
+                                    % (attempt + 1, e))
+
+                # Exponential, with jitter to spread out
+                # workers failing at the same time.
+                delay = self.backoff * (2 ** attempt)
+                delay *= random.uniform(0.5, 1.5)
+
+                self.log.warning("Retrying %s in %.1fs: %s"
+                                 % (src, delay, e))
+
+                time.sleep(delay)
+                attempt += 1
+
+    def _upload_one(self, src):
+        try:
+            return (src,) + self.upload_one(src) + (None,)
+        except Exception as e:
+            return src, 0, False, "%s: %s" % (type(e).__name__, e)
+
+    def upload(self, paths):
+        """Upload each of `paths` concurrently
+
+        Every upload is attempted, failures are gathered
+        and raised together once all uploads have finished.
+
+        Returns:
+            stats (dict): Aggregate "files", "bytes", "seconds"
+                and "rate" in bytes/second, see :mod:`anvil.transfer`,
+                along with the number of files "referenced"
+
+        Raises:
+            UploadError on one or more failed uploads
+
+        """
+
+        started = time.time()
+        errors = list()
+        count = 0
+        total = 0
+        referenced = 0
+
+        pool = ThreadPool(self.workers)
+        try:
+            for src, size, reference, error in pool.imap(self._upload_one,
+                                                         paths):
+                count += 1
+                total += size
+                referenced += reference
+
+                if error is not None:
+                    dst = remote_path(src, self.root, self.location)
+                    errors.append((src, dst, error))
+        finally:
+            pool.close()
+            pool.join()
+
+        if errors:
+            raise UploadError(errors)
+
+        elapsed = max(time.time() - started, 1e-6)
+
+        return {
+            "files": count,
+            "bytes": total,
+            "seconds": elapsed,
+            "rate": total / elapsed,
+            "referenced": referenced,
+        }
+
+
+def credentials():
+    """Return username and password of uploads, from the environment
+
+    Called ahead of queueing uploads, such that missing credentials
+    fail the publish rather than a detached process.
+
+    """
+
+    for key in ("AVALON_USERNAME", "AVALON_PASSWORD"):
+        assert os.getenv(key), "Environment variable missing: '%s'" % key
+
+    return os.environ["AVALON_USERNAME"], os.environ["AVALON_PASSWORD"]
+
+
+def upload(paths, root, location, username, password, log=log, **kwargs):
+    """Upload each of `paths` beneath `root` to `location`
+
+    Arguments:
+        paths (iterable): Absolute paths to published files
+        root (str): Registered root, e.g. api.registered_root()
+        location (str): Remote location, e.g. AVALON_LOCATION
+        username (str): Username of remote location
+        password (str): Password of remote location
+        log (logging.Logger, optional): Destination of progress messages
+        **kwargs: Passed on to :class:`Uploader`
+
+    Returns:
+        stats (dict): See :meth:`Uploader.upload`
+
+    """
+
+    from . import transfer
+
+    with Uploader(root,
+                  location,
+                  username,
+                  password,
+                  log=log,
+                  **kwargs) as uploader:
+        stats = uploader.upload(paths)
+
+    log.info("Uploaded %s" % transfer.format_rate(stats))
+
+    if stats["referenced"]:
+        log.info("%d of %d file(s) already uploaded, registered by reference"
+                 % (stats["referenced"], stats["files"]))
+
+    return stats
+
+
+def benchmark(size=16, bandwidth=8, repeats=3):
+    """Compare uncompressed and compressed uploads over a throttled link
+
+    Uploads a generated Maya ASCII file to a local
+    :class:`anvil.standins.UploadServer`.
+
+    Arguments:
+        size (int): Megabytes of Maya ASCII to upload
+        bandwidth (float): Megabytes/second received by the remote
+        repeats (int): Best of this many uploads
+
+    Returns:
+        timings (tuple): Best time in seconds for (raw, compressed)
+
+    """
+
+    import shutil
+    import tempfile
+
+    from . import standins
+
+    root = tempfile.mkdtemp()
+    path = os.path.join(root, "model.ma")
+
+    # Resembling the vertex positions making up most of a scene
+    rand = random.Random(0)
+    with open(path, "w") as f:
+        vertex = 0
+        while f.tell() < size * 1024 * 1024:
+            f.write("\tsetAttr \".pt[%d]\" -type \"float3\" %.6f %.6f %.6f ;\n"
+                    % (vertex, rand.uniform(-1, 1),
+                       rand.uniform(-1, 1), rand.uniform(-1, 1)))
+            vertex += 1
+
+    server = standins.UploadServer.start()
+    server.bandwidth = bandwidth * 1024 * 1024
+
+    timings = list()
+
+    try:
+        for compress in ((), (".ma",)):
+            best = None
+
+            for _ in range(repeats):
+                with Uploader(root, server.url, "user", "pass",
+                              compress=compress) as uploader:
+                    stats = uploader.upload([path])
+
+                best = (stats["seconds"] if best is None
+                        else min(best, stats["seconds"]))
+
+            timings.append(best)
+
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+
+    return tuple(timings)
+
+
+def _main():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m anvil.upload")
+    parser.add_argument("command", choices=["benchmark"])
+    parser.add_argument("--size", type=int, default=16,
+                        help="Megabytes to upload")
+    parser.add_argument("--bandwidth", type=float, default=8,
+                        help="Megabytes/second of the throttled link")
+    parser.add_argument("--repeats", type=int, default=3)
+
+    args = parser.parse_args()
+
+    raw, compressed = benchmark(args.size, args.bandwidth, args.repeats)
+    print("%-12s %8.2fs" % ("raw", raw))
+    print("%-12s %8.2fs (%.1fx, %s)" % ("compressed", compressed,
+                                       raw / max(compressed, 1e-9),
+                                       encodings()[0]))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,475 @@
+"""Integrate published files in the background
+
+With AVALON_INTEGRATE_IN_BACKGROUND set, the integrator writes the
+version and its representations to the database as usual, but leaves
+transferring files to a detached process such that the artist may
+continue working right away.
+
+Versions are written with a "status" of "pending", and flipped to
+"complete" once every file has been transferred, and uploaded. Loaders
+refuse versions that aren't complete. With uploads scheduled, see
+:mod:`anvil.scheduler`, versions are complete once transferred.
+
+Jobs are JSON files in a queue directory, defaulting to
+~/.avalon/queue, and processed by
+
+    $ python -m anvil.worker
+
+Which is started automatically on publish, and exits once the
+queue is empty.
+
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import logging
+import tempfile
+import subprocess
+import functools
+
+from . import transfer
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMPLETE = "complete"
+FAILED = "failed"
+
+
+def enabled():
+    """Return whether files should be integrated in the background"""
+    return bool(os.getenv("AVALON_INTEGRATE_IN_BACKGROUND"))
+
+
+def is_complete(version):
+    """Return whether all files of `version` are in place
+
+    Versions published prior to background integration
+    have no status, and are complete.
+
+    """
+
+    return version["data"].get("status", COMPLETE) == COMPLETE
+
+
+def assert_complete(context):
+    """Loaders call this to refuse versions still being integrated
+
+    Arguments:
+        context (dict): Representation context, with a "version"
+
+    """
+
+    version = context["version"]
+    assert is_complete(version), (
+        "Version %s is %s, try again once it has been integrated"
+        % (version["name"], version["data"].get("status"))
+    )
+
+
+def queue_dir():
+    return os.getenv("AVALON_QUEUE",
+                     os.path.join(os.path.expanduser("~"), ".avalon", "queue"))
+
+
+def _dirs(root=None):
+    root = root or queue_dir()
+    return {name: os.path.join(root, name)
+            for name in ("pending", "active", "failed")}
+
+
+def enqueue(job, root=None, delay=0):
+    """Add `job` to the queue
+
+    Arguments:
+        job (dict): Serialisable description of work, with "project",
+            "version" and "transfers" of [src, dst, representation]
+        root (str, optional): Queue directory, defaults to
+            AVALON_QUEUE or ~/.avalon/queue
+        delay (float, optional): Seconds before the job may be claimed
+
+    Returns:
+        path (str): Absolute path to queued job
+
+    """
+
+    if job.get("upload"):
+        from . import upload
+
+        # Read by the worker, see :func:`process`
+        upload.credentials()
+
+    dirs = _dirs(root)
+    for dirname in dirs.values():
+        transfer.makedirs(dirname)
+
+    # Oldest first, when listed alphabetically
+    name = "%.6f-%s.json" % (time.time() + delay, job["version"])
+
+    # Written elsewhere first, such that workers
+    # never encounter a partially written job.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dirs["pending"]))
+    with os.fdopen(fd, "w") as f:
+        json.dump(job, f)
+
+    path = os.path.join(dirs["pending"], name)
+    os.rename(tmp, path)
+
+    return path
+
+
+def _python():
+    """Return interpreter for the worker, mayapy in place of maya"""
+    executable = os.getenv("AVALON_WORKER_PYTHON", sys.executable)
+    dirname, basename = os.path.split(executable)
+    name, ext = os.path.splitext(basename)
+
+    if name.lower() == "maya":
+        executable = os.path.join(dirname, "mayapy" + ext)
+
+    return executable
+
+
+def spawn(root=None, module="anvil.worker"):
+    """Start a worker, detached from the current process
+
+    The worker inherits the environment, and thereby the
+    database connection and credentials, of this process.
+
+    Arguments:
+        root (str, optional): Queue directory, see :func:`enqueue`
+        module (str, optional): Worker to run, e.g. "anvil.scheduler"
+
+    """
+
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(
+        [package] + [p for p in [env.get("PYTHONPATH")] if p]
+    )
+
+    if root:
+        env["AVALON_QUEUE"] = root
+
+    kwargs = {}
+    if sys.platform == "win32":
+        DETACHED_PROCESS = 0x00000008
+        CREATE_NEW_PROCESS_GROUP = 0x00000200
+        kwargs["creationflags"] = DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["preexec_fn"] = os.setsid
+
+    with open(os.devnull, "r+") as devnull:
+        return subprocess.Popen(
+            [_python(), "-m", module],
+            env=env,
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=sys.platform != "win32",
+            **kwargs
+        )
+
+
+def _alive(pid):
+    if sys.platform == "win32":
+        # Unable to tell, assume the best
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+
+def _claim(dirs):
+    """Move the oldest pending job into active, return its path"""
+    now = time.time()
+
+    for name in sorted(os.listdir(dirs["pending"])):
+        if float(name.split("-", 1)[0]) > now:
+            # Delayed, and so are those that follow
+            break
+
+        # Claimed by this process and host
+        claimed = "%s@%s@%d" % (name, socket.gethostname(), os.getpid())
+        path = os.path.join(dirs["active"], claimed)
+
+        try:
+            os.rename(os.path.join(dirs["pending"], name), path)
+        except OSError:
+            # Claimed by another worker
+            continue
+
+        return path
+
+
+def _recover(dirs):
+    """Return jobs of workers no longer running to the queue"""
+    hostname = socket.gethostname()
+
+    for name in os.listdir(dirs["active"]):
+        job, host, pid = name.rsplit("@", 2)
+
+        if host != hostname or _alive(int(pid)):
+            continue
+
+        log.warning("Recovering %s, abandoned by process %s" % (job, pid))
+
+        try:
+            os.rename(os.path.join(dirs["active"], name),
+                      os.path.join(dirs["pending"], job))
+        except OSError:
+            pass
+
+
+def skip_existing(function, hashed=False):
+    """Return `function` skipping files transferred by a previous pass
+
+    A destination is considered transferred when of equal size and no
+    older than its source, or, with `hashed`, of identical content.
+
+    Arguments:
+        function (callable): Transfer function
+        hashed (bool, optional): Compare content, and return
+            the "hash" of existing files, as `function` would
+
+    """
+
+    from . import store
+
+    def resumable(src, dst):
+        try:
+            source, destination = os.stat(src), os.stat(dst)
+        except OSError:
+            return function(src, dst)
+
+        if source.st_size == destination.st_size:
+            if hashed:
+                checksum = store.hash_file(dst)
+                if checksum == store.hash_file(src):
+                    return {"method": "existing", "hash": checksum}
+
+            elif destination.st_mtime >= source.st_mtime:
+                return {"method": "existing"}
+
+        return function(src, dst)
+
+    return resumable
+
+
+def process(job):
+    """Transfer, and optionally upload, files of `job`
+
+    Transfers previously completed are skipped, such that
+    an interrupted job may be processed again.
+
+    Returns:
+        done (bool): False for renders still in progress, whose
+            job is to be processed again, see :mod:`anvil.progressive`
+
+    """
+
+    from avalon import io
+
+    from . import (
+        store,
+        sequence,
+        upload,
+        scheduler,
+        progressive,
+        checksums,
+    )
+
+    io.activate_project(job["project"])
+
+    directories = transfer.Directories()
+    function = functools.partial(transfer.copy, directories=directories)
+
+    if job.get("blobstore"):
+        function = store.BlobStore(job["blobstore"], directories).put
+
+    elif job.get("checksums"):
+        function = functools.partial(transfer.copy,
+                                     directories=directories,
+                                     hashed=True)
+
+    resumable = skip_existing(function,
+                              hashed=bool(job.get("blobstore") or
+                                          job.get("checksums")))
+
+    if job.get("checksums"):
+        # Read anew each pass, as tasks finish rendering
+        resumable = checksums.verified(resumable,
+                                       checksums.load(job["checksums"]))
+
+    if job.get("renders"):
+        transferred, finished = progressive.integrate(job, resumable, log)
+        results = [result for _, result in transferred]
+
+    else:
+        finished = True
+
+        pairs = [(src, dst) for src, dst, _ in job["transfers"]]
+        results, stats = transfer.transfer(pairs, function=resumable)
+        transferred = list(zip(job["transfers"], results))
+
+        log.info("Transferred %s" % transfer.format_rate(stats))
+
+    # Content hashes from the blob store, per representation
+    hashes = dict()
+    for (_, _, representation), result in transferred:
+        if "hash" in result:
+            hashes.setdefault(representation, dict())[
+                os.path.basename(result["dst"])] = result["hash"]
+
+    for representation, files in hashes.items():
+        if job.get("renders"):
+            # Added to those of previous passes
+            document = io.find_one({"_id": io.ObjectId(representation)})
+            files = dict(document["data"].get("hashes", {}), **files)
+
+        io.update_many({"_id": io.ObjectId(representation)},
+                       {"$set": {"data.hashes": files}})
+
+    if not finished:
+        return False
+
+    if not job.get("upload"):
+        return True
+
+    hashes = {result["dst"]: result["hash"]
+              for result in results if "hash" in result}
+
+    if scheduler.enabled():
+        # Complete once transferred, uploaded whenever scheduled
+        scheduler.enqueue(job["output"],
+                          family=job.get("family"),
+                          root=job["root"],
+                          location=job["location"],
+                          version=job["version"],
+                          hashes=hashes)
+        scheduler.spawn()
+
+    else:
+        username, password = upload.credentials()
+        upload.upload(sequence.iter_outputs(job["output"]),
+                      root=job["root"],
+                      location=job["location"],
+                      username=username,
+                      password=password,
+                      hashes=hashes,
+                      log=log)
+
+    return True
+
+
+def _requeue(path, job, dirs, delay=0):
+    """Return claimed `job` at `path` to the queue, updated
+
+    The claimed job is updated in place and moved back in one step,
+    such that it is never both claimed and queued, and never lost.
+
+    """
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dirs["pending"]))
+    with os.fdopen(fd, "w") as f:
+        json.dump(job, f)
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Windows refuses to replace existing files
+        os.remove(path)
+        os.rename(tmp, path)
+
+    name = "%.6f-%s.json" % (time.time() + delay, job["version"])
+    os.rename(path, os.path.join(dirs["pending"], name))
+
+
+def _set_status(job, status):
+    from avalon import io
+
+    io.activate_project(job["project"])
+    io.update_many({"_id": io.ObjectId(job["version"])},
+                   {"$set": {"data.status": status}})
+
+
+def run(root=None, idle=5.0):
+    """Process queued jobs until the queue has been empty for `idle` seconds
+
+    Returns:
+        count (int): Number of jobs processed
+
+    """
+
+    from avalon import io
+
+    from . import progressive
+
+    io.install()
+
+    dirs = _dirs(root)
+    for dirname in dirs.values():
+        transfer.makedirs(dirname)
+
+    _recover(dirs)
+
+    count = 0
+    last = time.time()
+
+    while time.time() - last < idle:
+        path = _claim(dirs)
+
+        if path is None:
+            if os.listdir(dirs["pending"]):
+                # Delayed jobs, e.g. of renders in progress
+                last = time.time()
+
+            time.sleep(0.5)
+            continue
+
+        with open(path) as f:
+            job = json.load(f)
+
+        log.info("Processing version %s.." % job["version"])
+
+        try:
+            done = process(job)
+
+        except Exception:
+            log.exception("Failed to process %s" % path)
+            _set_status(job, FAILED)
+            os.rename(path, os.path.join(dirs["failed"],
+                                         os.path.basename(path)))
+
+        else:
+            if done:
+                _set_status(job, COMPLETE)
+                os.remove(path)
+            else:
+                # Along with progress made thus far
+                _requeue(path, job, dirs, delay=progressive.interval())
+
+        count += 1
+        last = time.time()
+
+    return count
+
+
+if __name__ == "__main__":
+    transfer.makedirs(queue_dir())
+    logging.basicConfig(
+        filename=os.path.join(queue_dir(), "worker.log"),
+        level=logging.INFO,
+        format="%(asctime)s %(process)d %(levelname)s %(message)s"
+    )
+
+    run()